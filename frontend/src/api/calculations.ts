@@ -1,5 +1,11 @@
 import apiClient from './client';
-import type { Calculation, PaginatedResponse, CalculationCreateRequest } from '../types.ts';
+import type {
+  Calculation,
+  PaginatedResponse,
+  CalculationCreateRequest,
+  CalculationUpdateResponse,
+  CalculationLineResponse,
+} from '../types.ts';
 
 export const calculationsApi = {
   // Получить список расчётов
@@ -24,7 +30,7 @@ export const calculationsApi = {
 
   // Обновить расчёт
   update: async (id: number, data: CalculationCreateRequest) => {
-    const response = await apiClient.put<Calculation>(`/calculations/${id}/`, data);
+    const response = await apiClient.put<CalculationUpdateResponse>(`/calculations/${id}/`, data);
     return response.data;
   },
 
@@ -33,6 +39,30 @@ export const calculationsApi = {
     await apiClient.delete(`/calculations/${id}/`);
   },
 
+  // Добавить товар в расчёт (ответ содержит новые итоги)
+  addLine: async (id: number, item: number, quantity = 1) => {
+    const response = await apiClient.post<CalculationLineResponse>(`/calculations/${id}/items/`, {
+      item,
+      quantity,
+    });
+    return response.data;
+  },
+
+  // Изменить количество в позиции
+  updateLine: async (id: number, lineId: number, quantity: number) => {
+    const response = await apiClient.patch<CalculationLineResponse>(
+      `/calculations/${id}/items/${lineId}/`,
+      { quantity },
+    );
+    return response.data;
+  },
+
+  // Удалить позицию
+  removeLine: async (id: number, lineId: number) => {
+    const response = await apiClient.delete<CalculationLineResponse>(`/calculations/${id}/items/${lineId}/`);
+    return response.data;
+  },
+
   // Копировать расчёт
   copy: async (id: number) => {
     const response = await apiClient.post<Calculation>(`/calculations/${id}/copy/`);
@@ -1,6 +1,14 @@
 import apiClient from './client';
 import type { Item, PaginatedResponse } from '../types.ts';
 
+// Опрос фоновой задачи импорта: раз в секунду; если воркер не взял задачу за 2 минуты
+// или она не завершилась за час (ITEMS_IMPORT_JOB_TIMEOUT на сервере), опрос прекращается
+const IMPORT_POLL_INTERVAL_MS = 1000;
+const IMPORT_PENDING_MAX_ATTEMPTS = 120;
+const IMPORT_POLL_MAX_ATTEMPTS = 3600;
+
+const importJobError = (message: string) => ({ response: { data: { error: message } } });
+
 export const itemsApi = {
   // Получить список товаров с поиском
   getList: async (params?: { page?: number; search?: string; ordering?: string }) => {
@@ -35,7 +43,8 @@ export const itemsApi = {
     await apiClient.delete(`/items/${id}/`);
   },
 
-  // Загрузить товары из Excel
+  // Загрузить товары из Excel.
+  // Большие файлы сервер ставит в очередь (202 + job_id) — ждём завершения задачи.
   upload: async (file: File) => {
     const formData = new FormData();
     formData.append('file', file);
@@ -44,7 +53,30 @@ export const itemsApi = {
         'Content-Type': 'multipart/form-data',
       },
     });
-    return response.data;
+    if (response.status !== 202) {
+      return response.data;
+    }
+
+    const jobId = response.data.job_id;
+    for (let attempt = 1; attempt <= IMPORT_POLL_MAX_ATTEMPTS; attempt++) {
+      await new Promise((resolve) => setTimeout(resolve, IMPORT_POLL_INTERVAL_MS));
+      const { data: job } = await apiClient.get(`/import-jobs/${jobId}/`);
+      if (job.status === 'done') {
+        return job;
+      }
+      if (job.status === 'failed') {
+        throw importJobError(job.error_message);
+      }
+      if (job.status === 'pending' && attempt >= IMPORT_PENDING_MAX_ATTEMPTS) {
+        throw importJobError(
+          `Импорт поставлен в очередь (задача №${jobId}), но обработчик импорта его не запустил. ` +
+            'Обратитесь к администратору; результат задачи можно будет посмотреть позже.',
+        );
+      }
+    }
+    throw importJobError(
+      `Импорт (задача №${jobId}) выполняется слишком долго. Проверьте список товаров позже.`,
+    );
   },
 };
 
@@ -1,13 +1,21 @@
 import apiClient from './client';
-import type { PriceHistory, PaginatedResponse } from '../types.ts';
+import type { PriceHistory, PaginatedResponse, CursorPaginatedResponse } from '../types.ts';
 
 export const priceHistoryApi = {
   // Получить историю цен
-  getList: async (params?: { page?: number; search?: string }) => {
+  getList: async (params?: { page?: number; search?: string; item?: number }) => {
     const response = await apiClient.get<PaginatedResponse<PriceHistory>>('/price-history/', {
       params,
     });
     return response.data;
   },
+
+  // Keyset-пагинация: cursor '' — первая страница, дальше курсор из next/previous
+  getPage: async (params: { cursor: string; search?: string; item?: number; count?: 'off' | 'estimate' | 'exact' }) => {
+    const response = await apiClient.get<CursorPaginatedResponse<PriceHistory>>('/price-history/', {
+      params,
+    });
+    return response.data;
+  },
 };
 
@@ -290,7 +290,7 @@ export default function ItemsList() {
           <input
             type="file"
             hidden
-            accept=".xlsx,.xls"
+            accept=".xlsx,.xls,.csv,.tsv,.parquet"
             onChange={(e) => {
               const file = e.target.files?.[0];
               if (file) {
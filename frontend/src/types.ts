@@ -30,6 +30,8 @@ export interface Calculation {
   total_price: string;
   total_price_with_markup: string;
   items_count: number;
+  updated_at: string;
+  revision: number;
   items?: CalculationItem[];
 }
 
@@ -40,6 +42,11 @@ export interface PaginatedResponse<T> {
   results: T[];
 }
 
+// Ответ в режиме ?cursor= (keyset): count равен null при ?count=off
+export interface CursorPaginatedResponse<T> extends Omit<PaginatedResponse<T>, 'count'> {
+  count: number | null;
+}
+
 // Request types для создания/обновления расчёта
 export interface CalculationCreateRequest {
   title: string;
@@ -50,6 +57,30 @@ export interface CalculationCreateRequest {
   }>;
 }
 
+// Ответ PUT/PATCH /calculations/<id>/: что изменилось (id товаров и поля расчёта)
+export interface CalculationChanges {
+  fields: string[];
+  created: number[];
+  updated: number[];
+  deleted: number[];
+}
+
+export interface CalculationUpdateResponse {
+  id: number;
+  title: string;
+  markup: string;
+  changes: CalculationChanges;
+}
+
+export interface CalculationLineResponse {
+  line: CalculationItem | null;
+  calculation: {
+    id: number;
+    total_price: string;
+    total_price_with_markup: string;
+  };
+}
+
 // Price History
 export interface PriceHistory {
   id: number;
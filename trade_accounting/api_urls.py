@@ -2,7 +2,7 @@ from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from trades.api_views import (
     ItemViewSet, CalculationViewSet, PriceHistoryViewSet,
-    CalculationSnapshotViewSet, UserViewSet
+    CalculationSnapshotViewSet, UserViewSet, ImportJobViewSet
 )
 from trades import views
 
@@ -12,6 +12,7 @@ router.register(r'calculations', CalculationViewSet)
 router.register(r'price-history', PriceHistoryViewSet, basename='pricehistory')
 router.register(r'snapshots', CalculationSnapshotViewSet, basename='snapshot')
 router.register(r'users', UserViewSet, basename='user')
+router.register(r'import-jobs', ImportJobViewSet, basename='importjob')
 
 urlpatterns = [
     # ВАЖНО: путь экспорта должен идти ДО include(router.urls), иначе его перехватит роутер
@@ -1,4 +1,10 @@
+from django.conf import settings
+from rest_framework.exceptions import NotFound
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from trades.keyset import InvalidCursor, get_count_mode, get_ordering, paginate_keyset
 
 
 class StandardResultsSetPagination(PageNumberPagination):
@@ -6,11 +12,52 @@ class StandardResultsSetPagination(PageNumberPagination):
     Базовый пагинатор для API:
     - page_size по умолчанию 50
     - поддержка параметра ?page_size=
+    - ?cursor= включает keyset-пагинацию (next/previous — ссылки с курсором),
+      общее количество тогда задаётся ?count=off|estimate|exact
     """
 
     page_size = 50
     page_size_query_param = "page_size"
     max_page_size = 1000
+    cursor_query_param = "cursor"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset_page = None
+        ordering = None
+        if self.cursor_query_param in request.query_params:
+            ordering = get_ordering(queryset)
+        if not ordering:
+            # Сортировка по релевантности, связанным полям и т.п. — обычные страницы
+            return super().paginate_queryset(queryset, request, view)
 
+        self.request = request
+        count_mode = get_count_mode(
+            request, getattr(settings, "PAGINATION_COUNT_MODE", "exact")
+        )
+        try:
+            self.keyset_page = paginate_keyset(
+                queryset,
+                request.query_params[self.cursor_query_param],
+                self.get_page_size(request),
+                ordering=ordering,
+                count_mode=count_mode,
+            )
+        except InvalidCursor as e:
+            raise NotFound(str(e))
+        return list(self.keyset_page)
 
+    def _cursor_link(self, cursor):
+        if cursor is None:
+            return None
+        url = remove_query_param(self.request.build_absolute_uri(), self.page_query_param)
+        return replace_query_param(url, self.cursor_query_param, cursor)
 
+    def get_paginated_response(self, data):
+        if self.keyset_page is None:
+            return super().get_paginated_response(data)
+        return Response({
+            "count": self.keyset_page.count,
+            "next": self._cursor_link(self.keyset_page.next_cursor),
+            "previous": self._cursor_link(self.keyset_page.previous_cursor),
+            "results": data,
+        })
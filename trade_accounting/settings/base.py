@@ -114,3 +114,34 @@ AUTHENTICATION_BACKENDS = [
     'trade_accounting.auth_backends.UsernameOrEmailBackend',
     'django.contrib.auth.backends.ModelBackend'
 ]
+
+# Импорт прайс-листов: xlsx-файлы от этого размера (в байтах) читаются потоково,
+# по умолчанию — всё, что Django уже сбрасывает на диск (FILE_UPLOAD_MAX_MEMORY_SIZE)
+ITEMS_IMPORT_STREAMING_MIN_SIZE = int(os.environ.get('ITEMS_IMPORT_STREAMING_MIN_SIZE', 2621440))
+# Файлы от этого размера загружаются через /api/upload-items/ в фоновую задачу (run_import_worker)
+ITEMS_IMPORT_BACKGROUND_MIN_SIZE = int(os.environ.get('ITEMS_IMPORT_BACKGROUND_MIN_SIZE', 1048576))
+# Задача импорта в статусе running дольше этого времени (сек) считается брошенной (воркер
+# остановлен) и забирается повторно; после ITEMS_IMPORT_JOB_MAX_ATTEMPTS попыток — ошибка
+ITEMS_IMPORT_JOB_TIMEOUT = int(os.environ.get('ITEMS_IMPORT_JOB_TIMEOUT', 3600))
+ITEMS_IMPORT_JOB_MAX_ATTEMPTS = int(os.environ.get('ITEMS_IMPORT_JOB_MAX_ATTEMPTS', 3))
+# Сколько секунд хранить в кэше статистику списка товаров (сбрасывается при любом изменении Item)
+ITEMS_STATS_CACHE_TIMEOUT = int(os.environ.get('ITEMS_STATS_CACHE_TIMEOUT', 300))
+# Общее количество записей при keyset-пагинации (?cursor=): off, estimate (оценка планировщика PostgreSQL) или exact
+PAGINATION_COUNT_MODE = os.environ.get('PAGINATION_COUNT_MODE', 'exact')
+# Итоги расчётов при изменении цены товара: eager — пересчёт сразу, lazy — пометка
+# totals_stale и пересчёт при чтении или фоновым sweep_stale_totals / run_import_worker
+CALCULATION_TOTALS_MODE = os.environ.get('CALCULATION_TOTALS_MODE', 'eager')
+# Максимум операций в одном запросе POST /api/calculations/batch/
+CALCULATION_BATCH_MAX_OPERATIONS = int(os.environ.get('CALCULATION_BATCH_MAX_OPERATIONS', 500))
+# Время жизни (сек) кэшированных ответов списка и карточек расчётов. Актуальность
+# обеспечивают версии в ключах, таймаут только ограничивает объём кэша
+RESPONSE_CACHE_TIMEOUT = int(os.environ.get('RESPONSE_CACHE_TIMEOUT', 3600))
+# Экспорт расчётов в Excel: сколько расчётов (с позициями) читать из БД за один запрос
+CALCULATION_EXPORT_CHUNK_SIZE = int(os.environ.get('CALCULATION_EXPORT_CHUNK_SIZE', 50))
+# Число процессов для сборки книг экспорта (1 — без пула; не больше числа ядер). Пул
+# создаётся в каждом воркере gunicorn, поэтому всего процессов — (--workers) × это значение.
+# С какого числа выбранных расчётов включается пул
+CALCULATION_EXPORT_WORKERS = int(os.environ.get('CALCULATION_EXPORT_WORKERS', 2))
+CALCULATION_EXPORT_PARALLEL_MIN = int(os.environ.get('CALCULATION_EXPORT_PARALLEL_MIN', 8))
+# Сколько секунд ждать сборки одной книги в пуле; зависший воркер не держит запрос дольше
+CALCULATION_EXPORT_TIMEOUT = int(os.environ.get('CALCULATION_EXPORT_TIMEOUT', 300))
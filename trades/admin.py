@@ -1,7 +1,7 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
 from .models import Item, Calculation, CalculationItem, CustomUser, PriceHistory, CalculationSnapshot, \
-    CalculationSnapshotItem
+    CalculationSnapshotItem, ImportJob
 
 # Регистрация стандартных моделей
 admin.site.register(Item)
@@ -9,6 +9,7 @@ admin.site.register(Calculation)
 admin.site.register(PriceHistory)
 admin.site.register(CalculationSnapshot)
 admin.site.register(CalculationSnapshotItem)
+admin.site.register(ImportJob)
 
 
 # Кастомный админ для CalculationItem с использованием raw_id_fields и list_display
@@ -1,40 +1,86 @@
 from rest_framework import viewsets, filters, status
 from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from django.core.exceptions import PermissionDenied
-from .models import Item, Calculation, CalculationItem, PriceHistory, CalculationSnapshot, CustomUser
+from django.db.models import Count, Max, Sum
+from django.shortcuts import get_object_or_404
+from .models import Item, Calculation, CalculationItem, PriceHistory, CalculationSnapshot, CustomUser, ImportJob, \
+    refresh_stale_totals
 from .serializers import (
     ItemSerializer, 
     CalculationSerializer, 
     CalculationCreateUpdateSerializer,
+    CalculationBatchSerializer,
+    CalculationItemSerializer,
+    CalculationLineSerializer,
+    calculation_totals,
     PriceHistorySerializer,
     CalculationSnapshotSerializer,
-    UserSerializer
+    UserSerializer,
+    ImportJobSerializer
 )
+from . import caching
+from .conditional import ConditionalGetMixin
+from .fieldsets import SparseFieldsViewSetMixin
+from .search import RankedSearchFilter
 
-class ItemViewSet(viewsets.ModelViewSet):
+class ItemViewSet(SparseFieldsViewSetMixin, ConditionalGetMixin, viewsets.ModelViewSet):
     queryset = Item.objects.all().order_by('name')
     serializer_class = ItemSerializer
     permission_classes = [IsAuthenticated]
-    filter_backends = [filters.SearchFilter, filters.OrderingFilter]
+    filter_backends = [filters.OrderingFilter, RankedSearchFilter]
     search_fields = ['name']
     ordering_fields = ['name', 'price']
     ordering = ['name']
 
-class CalculationViewSet(viewsets.ModelViewSet):
-    queryset = (
-        Calculation.objects.all()
-        .select_related('user')
-        .prefetch_related('items__item')
-        .order_by('-created_at')
-    )
+    # Каталог целиком версионируется в trades.caching (версия растёт при любой записи товаров)
+    def get_list_validators(self, queryset):
+        return (caching.get_version(caching.ITEMS),), caching.get_modified(caching.ITEMS)
+
+    def get_object_validators(self, queryset, pk):
+        return self.get_list_validators(queryset)
+
+class CalculationViewSet(SparseFieldsViewSetMixin, ConditionalGetMixin, viewsets.ModelViewSet):
+    queryset = Calculation.objects.all().select_related('user').order_by('-created_at')
     permission_classes = [IsAuthenticated]
-    filter_backends = [filters.SearchFilter, filters.OrderingFilter]
+    filter_backends = [filters.OrderingFilter, RankedSearchFilter]
     search_fields = ['title']
     ordering_fields = ['title', 'total_price', 'total_price_with_markup', 'created_at', 'markup']
     ordering = ['-created_at']
 
+    response_cache = 'api.calculations'
+
+    def _with_items_version(self, parts, modified):
+        # Вложенные позиции показывают названия и цены товаров — учитываем версию каталога
+        if 'items' not in self.get_serializer().fields:
+            return parts, modified
+        items_modified = caching.get_modified(caching.ITEMS)
+        return (*parts, caching.get_version(caching.ITEMS)), max(modified.timestamp(), items_modified)
+
+    def get_list_validators(self, queryset):
+        stats = queryset.prefetch_related(None).aggregate(
+            count=Count('pk'), updated=Max('updated_at'), revisions=Sum('revision')
+        )
+        if stats['updated'] is None:
+            return None
+        return self._with_items_version((stats['count'], stats['updated'], stats['revisions']), stats['updated'])
+
+    def get_object_validators(self, queryset, pk):
+        row = (
+            queryset.prefetch_related(None).filter(pk=pk)
+            .values_list('revision', 'updated_at', 'totals_stale').first()
+        )
+        if row is None or row[2]:
+            # Нет доступа (ответит 404) или итоги пересчитаются при сериализации
+            return None
+        return self._with_items_version(row[:2], row[1])
+
+    def get_default_expand(self):
+        # Позиции — в деталях расчёта; в списке только по ?expand=items
+        return () if self.action == 'list' else ('items',)
+
     def get_serializer_class(self):
         if self.action in ['create', 'update', 'partial_update']:
             return CalculationCreateUpdateSerializer
@@ -43,35 +89,83 @@ class CalculationViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         # Показывать только свои расчеты для обычных юзеров, все для админов
         user = self.request.user
+        queryset = super().get_queryset()
         if user.is_superuser or user.is_admin:
-            return super().get_queryset()
-        return super().get_queryset().filter(user=user)
+            return queryset
+        return queryset.filter(user=user)
+
+    def list(self, request, *args, **kwargs):
+        # Устаревшие итоги (ленивый режим) пересчитываем до сортировки по суммам
+        refresh_stale_totals(self.get_queryset())
+        return super().list(request, *args, **kwargs)
     
     @action(detail=True, methods=['post'])
     def copy(self, request, pk=None):
-        """Копировать расчёт"""
-        original = self.get_object()
-        new_calculation = Calculation.objects.create(
-            user=request.user,
-            title=f"{original.title} (копия)",
-            markup=original.markup
-        )
-        
-        for item in original.items.all():
-            CalculationItem.objects.create(
-                calculation=new_calculation,
-                item=item.item,
-                quantity=item.quantity
-            )
-        
-        new_calculation.refresh_totals()
+        """Копировать расчёт (на стороне БД, итоги переносятся без пересчёта)"""
+        new_calculation = self.get_object().copy(user=request.user)
         serializer = CalculationSerializer(new_calculation)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
     
+    @action(detail=False, methods=['post'])
+    def batch(self, request):
+        """
+        Пакетное создание/обновление расчётов (см. CalculationBatchSerializer).
+        Ответ — результаты по операциям; 400, если пакет atomic не применён.
+        """
+        # Допускается и просто массив операций (тогда atomic=true)
+        data = {'operations': request.data} if isinstance(request.data, list) else request.data
+        serializer = CalculationBatchSerializer(
+            data=data, context={**self.get_serializer_context(), 'queryset': self.get_queryset()}
+        )
+        serializer.is_valid(raise_exception=True)
+        results = serializer.save()
+        status_code = status.HTTP_400_BAD_REQUEST if serializer.failed else status.HTTP_200_OK
+        return Response({'atomic': serializer.validated_data['atomic'], 'results': results}, status=status_code)
+
+    def _get_calculation_for_lines(self):
+        # Без prefetch позиций: правка одной позиции не должна читать весь расчёт
+        calculation = get_object_or_404(self.get_queryset().prefetch_related(None), pk=self.kwargs['pk'])
+        self.check_object_permissions(self.request, calculation)
+        return calculation
+
+    def _line_response(self, calculation, line, status_code=status.HTTP_200_OK):
+        return Response({
+            'line': CalculationItemSerializer(line).data if line is not None else None,
+            'calculation': calculation_totals(calculation),
+        }, status=status_code)
+
+    @action(detail=True, methods=['post'], url_path='items')
+    def add_line(self, request, pk=None):
+        """Добавить товар в расчёт; итоги сдвигаются на стоимость позиции"""
+        calculation = self._get_calculation_for_lines()
+        serializer = CalculationLineSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        line = calculation.add_line(serializer.validated_data['item'], serializer.validated_data['quantity'])
+        return self._line_response(calculation, line, status.HTTP_201_CREATED)
+
+    @action(detail=True, methods=['patch', 'delete'], url_path=r'items/(?P<line_id>\d+)')
+    def line(self, request, pk=None, line_id=None):
+        """Изменить количество в позиции или удалить её; итоги сдвигаются на разницу"""
+        calculation = self._get_calculation_for_lines()
+        try:
+            if request.method == 'DELETE':
+                calculation.remove_line(line_id)
+                return self._line_response(calculation, None)
+            serializer = CalculationLineSerializer(data=request.data, partial=True)
+            serializer.is_valid(raise_exception=True)
+            if 'quantity' not in serializer.validated_data:
+                raise ValidationError({'quantity': ["Обязательное поле."]})
+            line = calculation.set_line_quantity(line_id, serializer.validated_data['quantity'])
+        except CalculationItem.DoesNotExist:
+            raise NotFound("Позиция не найдена")
+        return self._line_response(calculation, line)
+
     @action(detail=True, methods=['post'])
     def save_snapshot(self, request, pk=None):
         """Сохранить снимок расчёта"""
         calculation = self.get_object()
+        # Устаревшие итоги (ленивый режим) пересчитываем до заморозки
+        refresh_stale_totals([calculation])
         snapshot = CalculationSnapshot.objects.create(
             calculation=calculation,
             frozen_total_price=calculation.total_price,
@@ -81,7 +175,7 @@ class CalculationViewSet(viewsets.ModelViewSet):
         
         from .models import CalculationSnapshotItem
         snapshot_items = []
-        for calc_item in calculation.items.all():
+        for calc_item in calculation.items.select_related('item'):
             snapshot_items.append(
                 CalculationSnapshotItem(
                     snapshot=snapshot,
@@ -97,21 +191,63 @@ class CalculationViewSet(viewsets.ModelViewSet):
         serializer = CalculationSnapshotSerializer(snapshot)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
-class PriceHistoryViewSet(viewsets.ReadOnlyModelViewSet):
+class PriceHistoryViewSet(SparseFieldsViewSetMixin, viewsets.ReadOnlyModelViewSet):
     queryset = PriceHistory.objects.all().select_related('item', 'changed_by').order_by('-changed_at')
     serializer_class = PriceHistorySerializer
     permission_classes = [IsAuthenticated]
-    filter_backends = [filters.SearchFilter]
+    filter_backends = [RankedSearchFilter]
     search_fields = ['item__name']
 
-class CalculationSnapshotViewSet(viewsets.ReadOnlyModelViewSet):
+    def get_queryset(self):
+        # ?item=<id> — история одного товара (индекс item, -changed_at)
+        queryset = super().get_queryset()
+        item_id = self.request.query_params.get('item')
+        if item_id and item_id.isdigit():
+            queryset = queryset.filter(item_id=item_id)
+        return queryset
+
+class CalculationSnapshotViewSet(SparseFieldsViewSetMixin, ConditionalGetMixin, viewsets.ReadOnlyModelViewSet):
     queryset = CalculationSnapshot.objects.all().select_related('calculation', 'created_by').prefetch_related('items').order_by('-created_at')
     serializer_class = CalculationSnapshotSerializer
     permission_classes = [IsAuthenticated]
-    filter_backends = [filters.SearchFilter]
+    filter_backends = [RankedSearchFilter]
     search_fields = ['calculation__title']
+    default_expand = ('items',)
+
+    # Снимок не меняется после создания; название берётся из расчёта
+    def get_list_validators(self, queryset):
+        stats = queryset.prefetch_related(None).aggregate(
+            count=Count('pk'), last_id=Max('pk'), created=Max('created_at'),
+            calculation_updated=Max('calculation__updated_at'),
+        )
+        if stats['created'] is None:
+            return None
+        modified = max(filter(None, [stats['created'], stats['calculation_updated']]))
+        return (stats['count'], stats['last_id'], stats['calculation_updated']), modified
+
+    def get_object_validators(self, queryset, pk):
+        row = (
+            queryset.prefetch_related(None).filter(pk=pk)
+            .values_list('created_at', 'calculation__revision', 'calculation__updated_at').first()
+        )
+        if row is None:
+            return None
+        return row, max(filter(None, [row[0], row[2]]))
+
+class ImportJobViewSet(viewsets.ReadOnlyModelViewSet):
+    """Статус и прогресс фоновых задач импорта прайс-листов."""
+    queryset = ImportJob.objects.all().select_related('created_by').order_by('-created_at')
+    serializer_class = ImportJobSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        # Свои задачи для обычных юзеров, все для админов
+        user = self.request.user
+        if user.is_superuser or user.is_admin:
+            return super().get_queryset()
+        return super().get_queryset().filter(created_by=user)
 
-class UserViewSet(viewsets.ModelViewSet):
+class UserViewSet(SparseFieldsViewSetMixin, viewsets.ModelViewSet):
     queryset = CustomUser.objects.all().order_by('username')
     serializer_class = UserSerializer
     permission_classes = [IsAuthenticated]
@@ -1,6 +1,13 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class TradesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'trades'
+
+    def ready(self):
+        from .search import install_sqlite_fts
+
+        # Поисковые FTS5-таблицы для SQLite (на PostgreSQL — GIN-индексы из миграции 0012)
+        post_migrate.connect(install_sqlite_fts, sender=self, dispatch_uid='trades_install_sqlite_fts')
@@ -0,0 +1,114 @@
+"""
+Версионированные ключи кэша.
+
+Вместо удаления записей по шаблону (Redis KEYS / LocMem так не умеют) у каждого
+пространства имён есть счётчик версии, который входит в ключ. Запись в модель
+увеличивает версию — старые записи больше не читаются и вытесняются по таймауту.
+Версия инициализируется текущим временем, поэтому после потери счётчика
+(перезапуск кэша, вытеснение) старые ключи не совпадут с новыми.
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+# Пространства имён
+ITEMS = 'items'
+# Кэш ответов: ключи содержат ревизии данных, версия пространства меняется только
+# при полном сбросе (invalidate(RESPONSES))
+RESPONSES = 'responses'
+
+# Счётчики попаданий/промахов кэша ответов (manage.py cache_stats)
+RESPONSE_CACHES = ('api.calculations.list', 'api.calculations.retrieve', 'html.calculations_list')
+
+
+def _version_key(namespace):
+    return f'trades:version:{namespace}'
+
+
+def _modified_key(namespace):
+    return f'trades:modified:{namespace}'
+
+
+def get_version(namespace):
+    """Текущая версия пространства имён (создаётся при первом обращении)."""
+    key = _version_key(namespace)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(namespace):
+    """Инвалидирует все записи пространства имён."""
+    key = _version_key(namespace)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Счётчика нет в кэше — начинаем с нового значения
+        cache.set(key, time.time_ns(), None)
+    cache.set(_modified_key(namespace), time.time(), None)
+
+
+def get_modified(namespace):
+    """Время (unix) последней инвалидации пространства имён — для Last-Modified."""
+    key = _modified_key(namespace)
+    modified = cache.get(key)
+    if modified is None:
+        cache.add(key, time.time(), None)
+        modified = cache.get(key)
+    return modified
+
+
+def invalidate(namespace):
+    """
+    bump_version сразу и ещё раз после коммита транзакции: иначе параллельный запрос,
+    прочитавший данные до коммита, закэширует их уже под новой версией.
+    """
+    bump_version(namespace)
+    transaction.on_commit(lambda: bump_version(namespace))
+
+
+def make_key(namespace, name, *parts):
+    """Ключ вида trades:<namespace>:<версия>:<name>:<хэш частей>."""
+    digest = hashlib.sha1('\x1f'.join(map(str, parts)).encode('utf-8')).hexdigest()
+    return f'trades:{namespace}:{get_version(namespace)}:{name}:{digest}'
+
+
+def _stats_key(name, outcome):
+    return f'trades:stats:{name}:{outcome}'
+
+
+def count_lookup(name, hit):
+    """Увеличивает счётчик попаданий (hit=True) или промахов кэша name."""
+    key = _stats_key(name, 'hits' if hit else 'misses')
+    if not cache.add(key, 1, None):
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, None)
+
+
+def get_stats(names=RESPONSE_CACHES):
+    """{имя: (попадания, промахи)}"""
+    keys = {name: (_stats_key(name, 'hits'), _stats_key(name, 'misses')) for name in names}
+    values = cache.get_many([key for pair in keys.values() for key in pair])
+    return {name: (values.get(hits, 0), values.get(misses, 0)) for name, (hits, misses) in keys.items()}
+
+
+def reset_stats(names=RESPONSE_CACHES):
+    cache.delete_many([_stats_key(name, outcome) for name in names for outcome in ('hits', 'misses')])
+
+
+def get_cached(key, name):
+    """cache.get с учётом в счётчиках name; None — промах."""
+    value = cache.get(key)
+    count_lookup(name, value is not None)
+    return value
+
+
+def response_timeout():
+    return getattr(settings, 'RESPONSE_CACHE_TIMEOUT', 3600)
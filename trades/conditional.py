@@ -0,0 +1,95 @@
+"""
+Условные GET-запросы (ETag / Last-Modified) для REST API.
+
+Валидаторы считаются по дешёвой версии данных — ревизии строки, агрегату по
+таблице или версии из trades.caching — до выборки объектов и сериализации.
+If-None-Match / If-Modified-Since с совпадающей версией получают 304 без тела.
+ETag учитывает путь, параметры запроса, формат ответа и пользователя, поэтому
+разные страницы, ?fields= и области видимости не пересекаются. Он же служит
+ключом кэша ответов (response_cache): запись, изменившая данные, меняет версию,
+и старый ответ больше не читается — без подбора TTL.
+"""
+import hashlib
+
+from django.core.cache import cache
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+from rest_framework.response import Response
+
+from . import caching
+
+
+class ConditionalGetMixin:
+    """
+    Вьюсет определяет get_list_validators(queryset) и get_object_validators(queryset, pk):
+    (части версии, время изменения) или None — тогда ответ отдаётся как обычно.
+    """
+
+    # Префикс имени кэша ответов (trades.caching.RESPONSE_CACHES); None — не кэшировать.
+    # Ключ — ETag, то есть версия данных входит в ключ и устаревшие записи не читаются.
+    response_cache = None
+
+    def get_list_validators(self, queryset):
+        return None
+
+    def get_object_validators(self, queryset, pk):
+        return None
+
+    def _etag(self, request, parts):
+        raw = '\x1f'.join(map(str, [
+            request.path,
+            sorted(request.query_params.lists()),
+            request.accepted_renderer.format,
+            getattr(request.user, 'pk', None),
+            *parts,
+        ]))
+        return quote_etag(hashlib.sha1(raw.encode('utf-8')).hexdigest())
+
+    def _conditional(self, request, validators, respond):
+        if validators is None:
+            return respond()
+        parts, last_modified = validators
+        etag = self._etag(request, parts)
+        if hasattr(last_modified, 'timestamp'):
+            last_modified = last_modified.timestamp()
+        last_modified = int(last_modified) if last_modified is not None else None
+
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = self._cached_response(etag, respond)
+            if response.status_code != 200:
+                return response
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+        # Ответ зависит от пользователя и должен перепроверяться при каждом запросе
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+    def _cached_response(self, etag, respond):
+        if self.response_cache is None:
+            return respond()
+        name = f'{self.response_cache}.{self.action}'
+        key = caching.make_key(caching.RESPONSES, name, etag)
+        data = caching.get_cached(key, name)
+        if data is not None:
+            return Response(data)
+        response = respond()
+        if response.status_code == 200:
+            cache.set(key, response.data, caching.response_timeout())
+        return response
+
+    def list(self, request, *args, **kwargs):
+        validators = self.get_list_validators(self.filter_queryset(self.get_queryset()))
+        return self._conditional(request, validators, lambda: super(ConditionalGetMixin, self).list(
+            request, *args, **kwargs
+        ))
+
+    def retrieve(self, request, *args, **kwargs):
+        pk = str(self.kwargs[self.lookup_url_kwarg or self.lookup_field])
+        validators = None
+        if pk.isdigit():
+            validators = self.get_object_validators(self.filter_queryset(self.get_queryset()), pk)
+        return self._conditional(request, validators, lambda: super(ConditionalGetMixin, self).retrieve(
+            request, *args, **kwargs
+        ))
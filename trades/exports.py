@@ -0,0 +1,318 @@
+"""
+Экспорт расчётов в Excel: ZIP-архив с отдельной книгой на каждый расчёт.
+
+Архив отдаётся потоково (StreamingHttpResponse): расчёты читаются из БД пачками,
+книга каждого расчёта сжимается и сразу уходит клиенту, так что в памяти
+воркера одновременно находится не больше одной книги. Книги пишутся напрямую
+через xlsxwriter (constant_memory) из простых данных calculation_export_data,
+без промежуточных DataFrame.
+
+Для больших выборок книги собираются параллельно в пуле процессов: данные
+расчётов передаются воркерам простыми значениями, а готовые книги попадают
+в архив в исходном порядке. В обработке одновременно не больше двух книг
+на воркер, поэтому память остаётся ограниченной.
+"""
+import io
+import multiprocessing
+import os
+import threading
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import xlsxwriter
+from django.conf import settings
+from django.http import StreamingHttpResponse
+
+
+# Сколько расчётов (вместе с позициями) читается из БД за один запрос
+EXPORT_CHUNK_SIZE = 50
+
+
+# С какого числа расчётов книги собираются в пуле процессов
+EXPORT_PARALLEL_MIN = 8
+
+# Сколько секунд ждать одну книгу из пула
+EXPORT_TIMEOUT = 300
+
+# Сколько процессов сборки книг по умолчанию (в каждом процессе веб-сервера)
+EXPORT_WORKERS = 2
+
+# Пулы процессов по числу воркеров: {workers: ProcessPoolExecutor}
+_pools = {}
+# Сколько экспортов сейчас используют пул и пулы, выведенные из работы после сбоя
+_pool_users = {}
+_retired_pools = set()
+_pool_lock = threading.Lock()
+
+
+def get_export_chunk_size():
+    return max(1, int(getattr(settings, 'CALCULATION_EXPORT_CHUNK_SIZE', EXPORT_CHUNK_SIZE)))
+
+
+def get_export_workers():
+    """
+    Число процессов для сборки книг: CALCULATION_EXPORT_WORKERS, но не больше
+    числа ядер. Пул свой в каждом процессе веб-сервера; 1 — сборка в процессе запроса.
+    """
+    workers = int(getattr(settings, 'CALCULATION_EXPORT_WORKERS', EXPORT_WORKERS))
+    return max(1, min(workers, os.cpu_count() or 1))
+
+
+def get_export_parallel_min():
+    return int(getattr(settings, 'CALCULATION_EXPORT_PARALLEL_MIN', EXPORT_PARALLEL_MIN))
+
+
+def get_export_timeout():
+    return float(getattr(settings, 'CALCULATION_EXPORT_TIMEOUT', EXPORT_TIMEOUT))
+
+
+INFO_SHEET = "Информация"
+LINES_SHEET = "Позиции"
+INFO_COLUMNS = ("ID", "Создал", "Название", "Наценка (%)", "Стоимость", "Стоимость с наценкой", "Дата создания")
+
+HEADER_FORMAT = {'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'}
+MONEY_FORMAT = {'num_format': '#,##0.00 ₽'}
+# Ширина и формат столбцов листа «Позиции»: (первый, последний, ширина, денежный формат)
+LINES_COLUMNS_LAYOUT = (
+    (0, 0, 5, False),    # №
+    (1, 1, 40, False),   # Наименование
+    (2, 2, 15, True),    # Цена за ед.
+    (3, 3, 12, False),   # Количество
+    (4, 5, 18, True),    # Сумма и Сумма с наценкой
+)
+
+
+def calculation_export_data(calc):
+    """
+    Данные книги расчёта простыми значениями (без ORM-объектов): заголовок и
+    позиции (наименование, цена, количество). Позиции берутся из calc.items.all(),
+    их стоит подгрузить prefetch_related('items__item').
+    """
+    return {
+        'id': calc.id,
+        'user': calc.user.username if calc.user else "Не указан",
+        'title': calc.title,
+        'markup': calc.markup,
+        'total_price': calc.total_price,
+        'total_price_with_markup': calc.total_price_with_markup,
+        'created_at': calc.created_at.strftime("%d.%m.%Y %H:%M"),
+        'lines': [(line.item.name, line.item.price, line.quantity) for line in calc.items.all()],
+    }
+
+
+def workbook_name(data):
+    return f"calculation_{data['id']}_{data['title'][:30]}.xlsx"
+
+
+def write_calculation_workbook(output, data):
+    """
+    Пишет книгу расчёта (лист «Информация» и, если есть позиции, лист «Позиции»)
+    в output — путь или файловый объект. Строки пишутся напрямую в xlsxwriter
+    в режиме constant_memory: каждая строка сбрасывается на диск сразу после
+    записи, поэтому память не растёт с числом позиций.
+    """
+    workbook = xlsxwriter.Workbook(output, {'constant_memory': True})
+    header_format = workbook.add_format(HEADER_FORMAT)
+
+    info = workbook.add_worksheet(INFO_SHEET)
+    info.write_row(0, 0, INFO_COLUMNS, header_format)
+    info.write_number(1, 0, data['id'])
+    info.write_string(1, 1, data['user'])
+    info.write_string(1, 2, data['title'])
+    info.write_number(1, 3, data['markup'])
+    info.write_number(1, 4, data['total_price'])
+    info.write_number(1, 5, data['total_price_with_markup'])
+    info.write_string(1, 6, data['created_at'])
+
+    lines = data['lines']
+    if lines:
+        markup = data['markup']
+        factor = 1 + markup / 100
+        money_format = workbook.add_format(MONEY_FORMAT)
+        sheet = workbook.add_worksheet(LINES_SHEET)
+        # В режиме constant_memory форматы столбцов задаются до записи строк
+        for first, last, width, money in LINES_COLUMNS_LAYOUT:
+            sheet.set_column(first, last, width, money_format if money else None)
+        sheet.write_row(0, 0, (
+            "№", "Наименование", "Цена за ед.", "Количество", "Сумма", f"Сумма с наценкой ({markup}%)",
+        ), header_format)
+        for row, (name, price, quantity) in enumerate(lines, start=1):
+            total = price * quantity
+            sheet.write_number(row, 0, row)
+            sheet.write_string(row, 1, name)
+            sheet.write_number(row, 2, price)
+            sheet.write_number(row, 3, quantity)
+            sheet.write_number(row, 4, total)
+            sheet.write_number(row, 5, total * factor)
+    workbook.close()
+
+
+def build_calculation_workbook(data):
+    """Книга расчёта по данным calculation_export_data; возвращает bytes."""
+    output = io.BytesIO()
+    write_calculation_workbook(output, data)
+    return output.getvalue()
+
+
+class _ZipOutput:
+    """
+    Выход ZipFile без seek/tell: zipfile пишет размеры после данных (data
+    descriptor), а записанные байты забираются drain() и отдаются клиенту.
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def stream_zip(entries):
+    """Генератор байтов ZIP-архива из пар (имя файла, содержимое); каждый файл отдаётся сразу после сжатия."""
+    output = _ZipOutput()
+    with zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+        for name, data in entries:
+            zip_file.writestr(name, data)
+            chunk = output.drain()
+            if chunk:
+                yield chunk
+    # Центральный каталог записывается при закрытии архива
+    chunk = output.drain()
+    if chunk:
+        yield chunk
+
+
+def _get_pool(workers):
+    """
+    Общий на процесс пул сборки книг — свой для каждого числа воркеров, чтобы
+    экспорт с другим workers не останавливал пул, из которого параллельно
+    стримится другой архив. Процессы запускаются через spawn: fork процесса
+    веб-сервера унаследовал бы его соединения с БД и потоки.
+    """
+    with _pool_lock:
+        pool = _pools.get(workers)
+        if pool is None:
+            pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+            _pools[workers] = pool
+        return pool
+
+
+def _acquire_pool(workers):
+    """Пул для экспорта; пока экспорт не вызовет _release_pool, пул не останавливается."""
+    pool = _get_pool(workers)
+    with _pool_lock:
+        _pool_users[pool] = _pool_users.get(pool, 0) + 1
+    return pool
+
+
+def _release_pool(pool):
+    with _pool_lock:
+        _pool_users[pool] -= 1
+        idle = not _pool_users[pool]
+        if idle:
+            del _pool_users[pool]
+        terminate = idle and pool in _retired_pools
+        if terminate:
+            _retired_pools.discard(pool)
+    if terminate:
+        _terminate_pool(pool)
+
+
+def _retire_pool(workers, pool):
+    """
+    Убирает пул из общих: следующие экспорты получат новый. Процессы пула
+    (в том числе зависший) завершаются, когда его отпустит последний экспорт,
+    поэтому параллельные экспорты из этого пула дорабатывают.
+    """
+    with _pool_lock:
+        if _pools.get(workers) is pool:
+            del _pools[workers]
+        _retired_pools.add(pool)
+
+
+def _terminate_pool(pool):
+    # Зависшую задачу не отменить через Future.cancel() — процессы завершаются принудительно
+    processes = list((getattr(pool, '_processes', None) or {}).values())
+    pool.shutdown(wait=False, cancel_futures=True)
+    for process in processes:
+        if process.is_alive():
+            process.terminate()
+
+
+def build_workbooks_parallel(datas, workers):
+    """
+    (имя файла, книга) по данным datas; книги собираются в пуле из workers
+    процессов и отдаются в исходном порядке. Данные читаются из datas по мере
+    освобождения воркеров (не больше 2 * workers книг в обработке). Если книга
+    не готова за CALCULATION_EXPORT_TIMEOUT секунд, выбрасывается TimeoutError,
+    а пул с зависшим процессом заменяется новым.
+    """
+    pool = _acquire_pool(workers)
+    timeout = get_export_timeout()
+    pending = deque()
+    try:
+        for data in datas:
+            pending.append((workbook_name(data), pool.submit(build_calculation_workbook, data)))
+            if len(pending) >= workers * 2:
+                name, future = pending.popleft()
+                yield name, future.result(timeout=timeout)
+        while pending:
+            name, future = pending.popleft()
+            yield name, future.result(timeout=timeout)
+    except (BrokenProcessPool, TimeoutError):
+        # Упавший воркер ломает весь пул, зависший занимает место в нём —
+        # следующий экспорт создаст новый
+        _retire_pool(workers, pool)
+        raise
+    finally:
+        for _, future in pending:
+            future.cancel()
+        _release_pool(pool)
+
+
+def iter_calculation_workbooks(queryset, chunk_size=None, workers=None):
+    """
+    (имя файла, книга) по расчётам queryset; расчёты с позициями читаются пачками
+    по chunk_size. Книги собираются в workers процессах; по умолчанию — во всех
+    из CALCULATION_EXPORT_WORKERS, если расчётов не меньше CALCULATION_EXPORT_PARALLEL_MIN.
+    """
+    queryset = (
+        queryset
+        .select_related('user')
+        .prefetch_related('items__item')
+        .order_by('id')
+    )
+    if workers is None:
+        workers = get_export_workers()
+        if workers > 1 and queryset.count() < get_export_parallel_min():
+            workers = 1
+    datas = (
+        calculation_export_data(calc)
+        for calc in queryset.iterator(chunk_size=chunk_size or get_export_chunk_size())
+    )
+    if workers > 1:
+        yield from build_workbooks_parallel(datas, workers)
+        return
+    for data in datas:
+        yield workbook_name(data), build_calculation_workbook(data)
+
+
+def calculations_zip_response(queryset, filename="calculations.zip"):
+    """Потоковый ответ с ZIP-архивом книг расчётов queryset."""
+    response = StreamingHttpResponse(
+        stream_zip(iter_calculation_workbooks(queryset)),
+        content_type="application/zip",
+    )
+    response["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return response
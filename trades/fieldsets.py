@@ -0,0 +1,165 @@
+"""
+Выборочные поля (?fields=) и раскрытие связей (?expand=) для REST API.
+
+?fields=id,title — в ответе только перечисленные поля; ?expand=items — добавить
+вложенные связи из expandable_fields сериализатора (без ?expand= они выводятся
+только если входят в default_expand вьюсета или явно перечислены в ?fields=).
+
+Набор полей влияет и на запрос: SparseFieldsViewSetMixin по полям сериализатора
+строит only(), select_related и prefetch_related, так что неиспользуемые колонки,
+JOIN и вложенные списки не читаются из БД.
+"""
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
+from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
+
+
+def parse_field_list(value):
+    """'id, title,,items' -> {'id', 'title', 'items'}"""
+    return {name.strip() for name in (value or '').split(',') if name.strip()}
+
+
+class SparseFieldsSerializerMixin:
+    """
+    Оставляет в сериализаторе поля по ?fields= и ?expand= (только для GET/HEAD —
+    у записи набор полей не меняется). Вложенные сериализаторы не фильтруются.
+    """
+    # Вложенные связи, которые выводятся только по ?expand= (или default_expand)
+    expandable_fields = ()
+    # Откуда берут данные поля без source (SerializerMethodField): пути через точку
+    field_sources = {}
+    # Поля модели, нужные сериализатору независимо от набора полей
+    required_sources = ()
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        if request is None or request.method not in SAFE_METHODS:
+            return
+        requested = parse_field_list(request.query_params.get('fields'))
+        expand = parse_field_list(request.query_params.get('expand'))
+        expand.update(self.context.get('default_expand', ()))
+        for name in list(self.fields):
+            if requested:
+                keep = name in requested
+            else:
+                keep = name not in self.expandable_fields or name in expand
+            if not keep:
+                self.fields.pop(name)
+
+
+def _source_paths(serializer, name, field):
+    """Пути к данным модели для поля или None, если источник неизвестен."""
+    if name in getattr(serializer, 'field_sources', {}):
+        return list(serializer.field_sources[name])
+    if isinstance(field, serializers.SerializerMethodField) or field.source == '*':
+        return None
+    return [field.source]
+
+
+def _resolve_path(model, path):
+    """
+    'user.username' -> (('user',), 'user__username'): связи для select_related и
+    путь для only(). None — если путь ведёт не к полю модели (свойство, метод).
+    """
+    parts = path.split('.')
+    relations = []
+    for index, part in enumerate(parts):
+        try:
+            field = model._meta.get_field(part)
+        except FieldDoesNotExist:
+            return None
+        if not field.concrete:
+            return None
+        if index == len(parts) - 1:
+            return tuple(relations), '__'.join(parts)
+        if not (field.many_to_one or field.one_to_one):
+            return None
+        relations.append('__'.join(parts[:index + 1]))
+        model = field.related_model
+    return None
+
+
+def optimize_queryset(queryset, serializer, required=()):
+    """
+    Ограничивает queryset данными, которые выведет serializer: only() по нужным
+    колонкам, select_related для полей через связь, Prefetch (с такой же
+    оптимизацией) для вложенных списков; required — колонки, нужные всегда.
+    Если источник какого-то поля неизвестен, only() не применяется, связи всё
+    равно подгружаются заранее.
+    """
+    model = queryset.model
+    only = {model._meta.pk.name, *required}
+    select = set()
+    prefetch = []
+    complete = True
+
+    for name, field in serializer.fields.items():
+        if field.write_only:
+            continue
+        if isinstance(field, serializers.ListSerializer):
+            relation = model._meta.get_field(field.source)
+            # Внешний ключ на родителя нужен prefetch_related для сопоставления
+            child_qs = optimize_queryset(
+                relation.related_model._default_manager.all(), field.child, required=(relation.field.name,)
+            )
+            prefetch.append(Prefetch(field.source, queryset=child_qs))
+            continue
+        if isinstance(field, serializers.ManyRelatedField):
+            prefetch.append(field.source)
+            continue
+        paths = _source_paths(serializer, name, field)
+        if paths is None:
+            complete = False
+            continue
+        for path in paths:
+            resolved = _resolve_path(model, path)
+            if resolved is None:
+                complete = False
+                continue
+            relations, lookup = resolved
+            select.update(relations)
+            only.add(lookup)
+
+    for path in getattr(serializer, 'required_sources', ()):
+        only.add(path.replace('.', '__'))
+    # Поля сортировки нужны keyset-пагинации для курсора
+    for entry in queryset.query.order_by:
+        if isinstance(entry, str) and '__' not in entry.lstrip('-'):
+            try:
+                only.add(model._meta.get_field(entry.lstrip('-')).name)
+            except FieldDoesNotExist:
+                pass
+
+    queryset = queryset.select_related(None).prefetch_related(None)
+    if select:
+        queryset = queryset.select_related(*select)
+    if prefetch:
+        queryset = queryset.prefetch_related(*prefetch)
+    if complete:
+        queryset = queryset.only(*only)
+    return queryset
+
+
+class SparseFieldsViewSetMixin:
+    """
+    Передаёт сериализатору default_expand и сокращает queryset списка и деталей
+    под выбранные поля (см. optimize_queryset).
+    """
+    # Связи, раскрытые без ?expand=
+    default_expand = ()
+
+    def get_default_expand(self):
+        return self.default_expand
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['default_expand'] = self.get_default_expand()
+        return context
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if self.request.method in SAFE_METHODS and self.action in ('list', 'retrieve'):
+            queryset = optimize_queryset(queryset, self.get_serializer())
+        return queryset
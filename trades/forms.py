@@ -1,6 +1,7 @@
 from django import forms
 from django.contrib.auth.forms import UserCreationForm, UserChangeForm, SetPasswordForm
 from .models import Item, Calculation, CalculationItem, CustomUser
+from .utils import ITEM_NAME_TAKEN_MESSAGE, item_name_taken
 
 class ItemForm(forms.ModelForm):
     class Meta:
@@ -21,6 +22,9 @@ class ItemForm(forms.ModelForm):
             name = name.strip()
             if len(name) < 2:
                 raise forms.ValidationError("Название должно содержать минимум 2 символа")
+            # Дубли ищутся по нормализованному ключу (регистр, пробелы, ё/е)
+            if item_name_taken(name, self.instance):
+                raise forms.ValidationError(ITEM_NAME_TAKEN_MESSAGE)
         return name
 
 
@@ -0,0 +1,453 @@
+"""
+Пакетный импорт прайс-листов товаров.
+
+Строки файла сначала целиком нормализуются и проверяются (без обращений к БД),
+затем применяются пачками: один запрос на поиск существующих товаров,
+bulk_create для новых и bulk_update для изменившихся цен. Связанные расчёты
+пересчитываются один раз в конце импорта.
+
+Большие xlsx-файлы читаются потоково (openpyxl read-only): строки идут в импорт
+пачками фиксированного размера, и пик памяти не зависит от размера файла.
+CSV/TSV и Parquet читаются колоночно (pandas / pyarrow) только по нужным столбцам.
+"""
+import csv
+import decimal
+import io
+import os
+from decimal import Decimal
+
+import pandas as pd
+from django.conf import settings
+from django.db import transaction
+
+from . import caching
+from .models import Item, refresh_calculations_for_items
+from .utils import make_item_lookup_key, normalize_item_name
+
+
+NAME_COLUMN = 'Наименование комплектующей'
+PRICE_COLUMN = 'Цена'
+REQUIRED_COLUMNS = (NAME_COLUMN, PRICE_COLUMN)
+
+# Размер пачки: столько строк за раз ищется в БД и записывается через bulk_*
+IMPORT_BATCH_SIZE = 500
+
+NAME_MAX_LENGTH = Item._meta.get_field('name').max_length
+PRICE_QUANT = Decimal('0.01')
+# Item.price: max_digits=10, decimal_places=2
+MAX_PRICE = Decimal('99999999.99')
+
+
+class ImportFormatError(ValueError):
+    """Файл не подходит для импорта (например, нет обязательных столбцов)."""
+
+
+def check_columns(columns):
+    """Проверяет наличие обязательных столбцов, иначе бросает ImportFormatError."""
+    if any(column not in columns for column in REQUIRED_COLUMNS):
+        raise ImportFormatError(
+            f"Файл должен содержать столбцы '{NAME_COLUMN}' и '{PRICE_COLUMN}'."
+        )
+
+
+def parse_price(value):
+    """Приводит значение ячейки к цене Decimal с двумя знаками. None — если цена некорректна."""
+    try:
+        price = Decimal(str(value).strip().replace(',', '.'))
+    except (decimal.InvalidOperation, TypeError, ValueError):
+        return None
+    if not price.is_finite():
+        return None
+    price = price.quantize(PRICE_QUANT)
+    if abs(price) > MAX_PRICE:
+        return None
+    return price
+
+
+def normalize_frame(df, first_row_number=2, row_numbers=None):
+    """
+    Нормализует весь DataFrame прайс-листа за один проход.
+
+    Возвращает (rows, errors), где rows — список кортежей (номер строки, название, цена),
+    а errors — сообщения о пропущенных строках. Номер строки соответствует строке
+    в исходном файле (заголовок — первая строка); при потоковом чтении номера
+    передаются явно через row_numbers.
+    """
+    check_columns(df.columns)
+
+    names = df[NAME_COLUMN]
+    prices = df[PRICE_COLUMN]
+    clean_names = names.where(names.notna(), '').astype(str).str.strip()
+    # Пустые ячейки считаются отсутствующими значениями (нулевая цена — см. ниже)
+    blank_price = prices.isna() | prices.astype(str).str.strip().eq('')
+    missing = clean_names.eq('') | blank_price
+
+    rows, errors = [], []
+    if row_numbers is None:
+        row_numbers = range(first_row_number, first_row_number + len(df))
+    for row_number, name, raw_price, is_missing in zip(row_numbers, clean_names, prices, missing):
+        if is_missing:
+            errors.append(f"Строка {row_number}: отсутствует название или цена")
+            continue
+        if len(name) > NAME_MAX_LENGTH:
+            errors.append(f"Строка {row_number}: название длиннее {NAME_MAX_LENGTH} символов")
+            continue
+        price = parse_price(raw_price)
+        if price is None:
+            errors.append(f"Строка {row_number}: некорректная цена")
+            continue
+        # Проверка после разбора: так «0,00» и «-5,10» из CSV ловятся так же, как числа из xlsx
+        if price <= 0:
+            if price == 0:
+                errors.append(f"Строка {row_number}: отсутствует название или цена")
+            else:
+                errors.append(f"Строка {row_number}: цена должна быть больше нуля")
+            continue
+        rows.append((row_number, normalize_item_name(name), price))
+    return rows, errors
+
+
+def iter_chunks(rows, size=IMPORT_BATCH_SIZE):
+    """Режет список строк на пачки фиксированного размера."""
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
+
+
+FORMAT_XLSX = 'xlsx'
+FORMAT_XLS = 'xls'
+FORMAT_CSV = 'csv'
+FORMAT_TSV = 'tsv'
+FORMAT_PARQUET = 'parquet'
+
+EXTENSION_FORMATS = {
+    '.xlsx': FORMAT_XLSX,
+    '.xlsm': FORMAT_XLSX,
+    '.xls': FORMAT_XLS,
+    '.csv': FORMAT_CSV,
+    '.txt': FORMAT_CSV,
+    '.tsv': FORMAT_TSV,
+    '.tab': FORMAT_TSV,
+    '.parquet': FORMAT_PARQUET,
+    '.pq': FORMAT_PARQUET,
+}
+
+MAGIC_FORMATS = (
+    (b'PK\x03\x04', FORMAT_XLSX),
+    (b'\xd0\xcf\x11\xe0', FORMAT_XLS),
+    (b'PAR1', FORMAT_PARQUET),
+)
+
+# Кодировки текстовых выгрузок: UTF-8 (с BOM и без) и Windows-1251 из старых ERP
+TEXT_ENCODINGS = ('utf-8-sig', 'cp1251')
+
+
+def _read_head(file, size):
+    file.seek(0)
+    head = file.read(size)
+    file.seek(0)
+    return head
+
+
+def detect_format(file):
+    """
+    Определяет формат загруженного файла: сначала по сигнатуре (xlsx/xls/parquet),
+    затем по расширению, для текста без расширения — CSV или TSV по заголовку.
+    """
+    head = _read_head(file, 4096)
+    for magic, file_format in MAGIC_FORMATS:
+        if head.startswith(magic):
+            return file_format
+
+    # Расширение решает только между текстовыми форматами: если у «.xlsx» нет
+    # сигнатуры zip, это на самом деле текстовая выгрузка
+    extension = os.path.splitext(getattr(file, 'name', '') or '')[1].lower()
+    file_format = EXTENSION_FORMATS.get(extension)
+    if file_format in (FORMAT_CSV, FORMAT_TSV):
+        return file_format
+
+    first_line = head.split(b'\n', 1)[0]
+    return FORMAT_TSV if b'\t' in first_line else FORMAT_CSV
+
+
+# Форматы шаблона импорта: расширение файла и content-type ответа
+TEMPLATE_FORMATS = {
+    FORMAT_XLSX: ('xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+    FORMAT_CSV: ('csv', 'text/csv; charset=utf-8'),
+    FORMAT_TSV: ('tsv', 'text/tab-separated-values; charset=utf-8'),
+    FORMAT_PARQUET: ('parquet', 'application/vnd.apache.parquet'),
+}
+
+
+def build_import_template(file_format=FORMAT_XLSX):
+    """Возвращает содержимое пустого шаблона импорта в формате file_format."""
+    df = pd.DataFrame({
+        NAME_COLUMN: pd.Series(dtype=str),
+        PRICE_COLUMN: pd.Series(dtype=float),
+    })
+    output = io.BytesIO()
+    if file_format == FORMAT_XLSX:
+        with pd.ExcelWriter(output, engine="xlsxwriter") as writer:
+            df.to_excel(writer, index=False, sheet_name="Импорт")
+    elif file_format in (FORMAT_CSV, FORMAT_TSV):
+        separator = '\t' if file_format == FORMAT_TSV else ','
+        # BOM нужен, чтобы Excel открыл кириллицу в UTF-8 без вопросов
+        output.write(df.to_csv(index=False, sep=separator).encode('utf-8-sig'))
+    elif file_format == FORMAT_PARQUET:
+        try:
+            df.to_parquet(output, index=False)
+        except ImportError:
+            raise ImportFormatError("Для шаблона Parquet на сервере должен быть установлен пакет pyarrow.")
+    else:
+        raise ImportFormatError(f"Неизвестный формат шаблона: {file_format}")
+    return output.getvalue()
+
+
+def is_xlsx_upload(file):
+    """Можно ли читать файл openpyxl (xlsx/xlsm)."""
+    return detect_format(file) == FORMAT_XLSX
+
+
+def _text_header(file):
+    """Возвращает (кодировка, разделитель, столбцы) по первой строке текстового файла."""
+    head = _read_head(file, 64 * 1024)
+    first_line = head.split(b'\n', 1)[0].rstrip(b'\r')
+    for encoding in TEXT_ENCODINGS:
+        try:
+            text = first_line.decode(encoding)
+            break
+        except UnicodeDecodeError:
+            continue
+    else:
+        raise ImportFormatError("Не удалось определить кодировку файла (ожидается UTF-8 или Windows-1251).")
+
+    delimiter = max('\t;,', key=text.count)
+    columns = [column.strip() for column in next(csv.reader([text], delimiter=delimiter), [])]
+    return encoding, delimiter, columns
+
+
+def _binary_handle(source):
+    """
+    pandas определяет бинарный поток по классу или атрибуту mode, которых у
+    InMemoryUploadedFile нет, — спускаемся до исходного BytesIO/файла.
+    """
+    while not isinstance(source, (str, os.PathLike)) and not hasattr(source, 'mode') and hasattr(source, 'file'):
+        source = source.file
+    return source
+
+
+def iter_csv_chunks(file, source=None, chunk_size=IMPORT_BATCH_SIZE, delimiter=None):
+    """
+    Читает CSV/TSV пачками по chunk_size строк только по обязательным столбцам.
+
+    Цены читаются строками, чтобы «12,50» и «12.50» разбирались одинаково.
+    """
+    encoding, sniffed_delimiter, columns = _text_header(file)
+    check_columns(columns)
+    reader = pd.read_csv(
+        _binary_handle(source if source is not None else file),
+        sep=delimiter or sniffed_delimiter,
+        encoding=encoding,
+        usecols=lambda column: column.strip() in REQUIRED_COLUMNS,
+        dtype=str,
+        chunksize=chunk_size,
+    )
+    with reader:
+        for chunk in reader:
+            chunk.columns = [column.strip() for column in chunk.columns]
+            yield normalize_frame(chunk, first_row_number=int(chunk.index[0]) + 2)
+
+
+def iter_parquet_chunks(source, chunk_size=IMPORT_BATCH_SIZE):
+    """Читает Parquet пакетами строк (record batches) только по обязательным столбцам."""
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportFormatError("Для импорта Parquet на сервере должен быть установлен пакет pyarrow.")
+
+    parquet_file = pq.ParquetFile(source)
+    check_columns(parquet_file.schema_arrow.names)
+    row_number = 2
+    for batch in parquet_file.iter_batches(batch_size=chunk_size, columns=list(REQUIRED_COLUMNS)):
+        yield normalize_frame(batch.to_pandas(), first_row_number=row_number)
+        row_number += batch.num_rows
+
+
+def upload_source(file):
+    """
+    Возвращает источник для чтения загруженного файла без копирования:
+    путь к временному файлу, если Django уже сбросил загрузку на диск
+    (файл больше FILE_UPLOAD_MAX_MEMORY_SIZE), иначе сам файловый объект.
+    """
+    if hasattr(file, 'temporary_file_path'):
+        return file.temporary_file_path()
+    file.seek(0)
+    return file
+
+
+def iter_xlsx_chunks(source, chunk_size=IMPORT_BATCH_SIZE):
+    """
+    Потоково читает первый лист xlsx и отдаёт пачки (rows, errors) по chunk_size строк.
+
+    Используется read-only режим openpyxl: строки разбираются лениво, в памяти
+    одновременно находится только текущая пачка.
+    """
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(source, read_only=True, data_only=True)
+    try:
+        worksheet = workbook.worksheets[0]
+        # Размеры листа в файлах из ERP часто записаны неверно — читаем до конца
+        worksheet.reset_dimensions()
+        rows = worksheet.iter_rows(values_only=True)
+
+        header = [str(value).strip() if value is not None else '' for value in next(rows, ())]
+        check_columns(header)
+        name_index = header.index(NAME_COLUMN)
+        price_index = header.index(PRICE_COLUMN)
+
+        buffer, row_numbers = [], []
+        for row_number, values in enumerate(rows, start=2):
+            if not any(value is not None for value in values):
+                continue
+            buffer.append((
+                values[name_index] if name_index < len(values) else None,
+                values[price_index] if price_index < len(values) else None,
+            ))
+            row_numbers.append(row_number)
+            if len(buffer) >= chunk_size:
+                yield normalize_frame(pd.DataFrame(buffer, columns=REQUIRED_COLUMNS), row_numbers=row_numbers)
+                buffer, row_numbers = [], []
+        if buffer:
+            yield normalize_frame(pd.DataFrame(buffer, columns=REQUIRED_COLUMNS), row_numbers=row_numbers)
+    finally:
+        workbook.close()
+
+
+class ItemImporter:
+    """
+    Применяет нормализованные строки прайс-листа к справочнику товаров.
+
+    Семантика совпадает с построчным update_or_create_item_clean: поиск по
+    Item.lookup_key (регистр, пробелы и ё/е не различаются), повтор названия
+    в файле обновляет цену, совпадающая цена — пропуск.
+    """
+
+    def __init__(self, batch_size=IMPORT_BATCH_SIZE, on_progress=None):
+        self.batch_size = batch_size
+        # on_progress(importer) вызывается после каждой обработанной пачки
+        self.on_progress = on_progress
+        self.created = 0
+        self.updated = 0
+        self.skipped = 0
+        self.errors = []
+        self.changed_item_ids = set()
+
+    @property
+    def rows_processed(self):
+        return self.created + self.updated + self.skipped + len(self.errors)
+
+    def _lookup(self, keys):
+        """Одним запросом (по уникальному индексу lookup_key) находит существующие товары пачки."""
+        existing = Item.objects.filter(lookup_key__in=keys).only('id', 'lookup_key', 'price')
+        return {item.lookup_key: item for item in existing}
+
+    def feed(self, rows, errors=()):
+        """Обрабатывает пачку строк (номер строки, название, цена) и ошибки разбора этой пачки."""
+        self.errors.extend(errors)
+        if rows:
+            self._apply(rows)
+        if self.on_progress:
+            self.on_progress(self)
+
+    def _apply(self, rows):
+        keyed_rows = [(make_item_lookup_key(name), name, price) for _, name, price in rows]
+        items = self._lookup({key for key, _, _ in keyed_rows})
+        to_create, to_update = {}, {}
+
+        for key, name, price in keyed_rows:
+            item = items.get(key)
+            if item is None:
+                # bulk_create не вызывает save(), поэтому ключ задаётся явно
+                item = Item(name=name, lookup_key=key, price=price)
+                items[key] = to_create[key] = item
+                self.created += 1
+            elif item.price != price:
+                item.price = price
+                if item.pk:
+                    to_update[key] = item
+                self.updated += 1
+            else:
+                self.skipped += 1
+
+        with transaction.atomic():
+            if to_create:
+                Item.objects.bulk_create(to_create.values(), batch_size=self.batch_size)
+            if to_update:
+                Item.objects.bulk_update(to_update.values(), ['price'], batch_size=self.batch_size)
+        self.changed_item_ids.update(item.pk for item in to_update.values())
+        if to_create or to_update:
+            # bulk-операции не отправляют сигналы post_save
+            caching.invalidate(caching.ITEMS)
+
+    def finish(self):
+        """Пересчитывает расчёты с изменившимися товарами и возвращает отчёт."""
+        if self.changed_item_ids:
+            refresh_calculations_for_items(self.changed_item_ids)
+            self.changed_item_ids = set()
+        return self.report()
+
+    def report(self):
+        return {
+            'created': self.created,
+            'updated': self.updated,
+            'skipped': self.skipped,
+            'errors': self.errors,
+        }
+
+
+def import_items_dataframe(df, batch_size=IMPORT_BATCH_SIZE, on_progress=None):
+    """Импортирует прайс-лист из DataFrame и возвращает отчёт created/updated/skipped/errors."""
+    rows, errors = normalize_frame(df)
+    importer = ItemImporter(batch_size=batch_size, on_progress=on_progress)
+    importer.errors.extend(errors)
+    for chunk in iter_chunks(rows, batch_size):
+        importer.feed(chunk)
+    return importer.finish()
+
+
+def import_items_stream(chunks, batch_size=IMPORT_BATCH_SIZE, on_progress=None):
+    """Импортирует прайс-лист из потока пачек (rows, errors)."""
+    importer = ItemImporter(batch_size=batch_size, on_progress=on_progress)
+    for rows, errors in chunks:
+        importer.feed(rows, errors)
+    return importer.finish()
+
+
+def use_streaming(file):
+    """Потоковое чтение включается для xlsx не меньше ITEMS_IMPORT_STREAMING_MIN_SIZE байт."""
+    threshold = getattr(settings, 'ITEMS_IMPORT_STREAMING_MIN_SIZE', settings.FILE_UPLOAD_MAX_MEMORY_SIZE)
+    return is_xlsx_upload(file) and (file.size or 0) >= threshold
+
+
+def import_items_upload(file, streaming=None, batch_size=IMPORT_BATCH_SIZE, on_progress=None):
+    """
+    Импортирует загруженный файл прайс-листа (xlsx, xls, csv, tsv или parquet).
+
+    Текстовые форматы и Parquet всегда читаются пачками. Для xlsx streaming=None
+    выбирает режим автоматически по размеру файла.
+    """
+    file_format = detect_format(file)
+    if streaming is None:
+        streaming = use_streaming(file)
+    source = upload_source(file)
+
+    if file_format in (FORMAT_CSV, FORMAT_TSV):
+        delimiter = '\t' if file_format == FORMAT_TSV else None
+        chunks = iter_csv_chunks(file, source, batch_size, delimiter=delimiter)
+    elif file_format == FORMAT_PARQUET:
+        chunks = iter_parquet_chunks(source, batch_size)
+    elif file_format == FORMAT_XLSX and streaming:
+        chunks = iter_xlsx_chunks(source, batch_size)
+    else:
+        return import_items_dataframe(pd.read_excel(source), batch_size=batch_size, on_progress=on_progress)
+    return import_items_stream(chunks, batch_size=batch_size, on_progress=on_progress)
@@ -0,0 +1,181 @@
+"""
+Очередь фоновых задач импорта прайс-листов на основе таблицы ImportJob.
+
+Загрузка сохраняет файл и создаёт задачу в статусе pending; воркер
+(manage.py run_import_worker) забирает задачи по одной, выполняет импорт
+и после каждой пачки строк записывает прогресс в задачу. Задача, оставшаяся
+в running после остановки воркера, по истечении ITEMS_IMPORT_JOB_TIMEOUT
+забирается повторно, а после ITEMS_IMPORT_JOB_MAX_ATTEMPTS попыток
+завершается с ошибкой. Загруженный файл удаляется после завершения задачи.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .importers import ImportFormatError, import_items_upload, is_xlsx_upload
+from .models import ImportJob
+
+logger = logging.getLogger(__name__)
+
+# Сколько сообщений об ошибках строк хранить в задаче (счётчик errors_count — полный)
+MAX_STORED_ERRORS = 1000
+
+# Через сколько секунд задача в running считается брошенной и сколько раз её забирать
+JOB_TIMEOUT = 3600
+JOB_MAX_ATTEMPTS = 3
+
+
+def use_background_import(request, file):
+    """
+    Решает, выполнять ли импорт в фоне.
+
+    ?background=1 / ?background=0 задают режим явно, иначе в фон уходят файлы
+    от ITEMS_IMPORT_BACKGROUND_MIN_SIZE байт.
+    """
+    flag = request.GET.get('background')
+    if flag is not None:
+        return flag.lower() in ('1', 'true', 'yes')
+    threshold = getattr(settings, 'ITEMS_IMPORT_BACKGROUND_MIN_SIZE', None)
+    return threshold is not None and (file.size or 0) >= threshold
+
+
+def enqueue_import_job(file, user=None):
+    """Сохраняет загруженный файл и ставит задачу импорта в очередь."""
+    job = ImportJob(original_name=(file.name or '')[:255], created_by=user)
+    job.file.save(file.name, file, save=False)
+    job.save()
+    return job
+
+
+def _discard_file(job):
+    """Удаляет загруженный файл задачи: после импорта (успешного или нет) он не нужен."""
+    if job.file:
+        job.file.delete(save=False)
+        ImportJob.objects.filter(pk=job.pk).update(file='')
+
+
+def expire_abandoned_jobs(stale_before, now=None):
+    """Брошенные задачи, исчерпавшие попытки, переводит в failed и удаляет их файлы."""
+    max_attempts = getattr(settings, 'ITEMS_IMPORT_JOB_MAX_ATTEMPTS', JOB_MAX_ATTEMPTS)
+    now = now or timezone.now()
+    expired = 0
+    abandoned = ImportJob.objects.filter(
+        status=ImportJob.STATUS_RUNNING, started_at__lt=stale_before, attempts__gte=max_attempts
+    )
+    for job in abandoned:
+        updated = (
+            ImportJob.objects
+            .filter(pk=job.pk, status=ImportJob.STATUS_RUNNING, started_at=job.started_at)
+            .update(
+                status=ImportJob.STATUS_FAILED,
+                error_message="Импорт прерван: воркер не завершил задачу",
+                finished_at=now,
+            )
+        )
+        if updated:
+            _discard_file(job)
+            expired += 1
+    return expired
+
+
+def claim_next_job():
+    """
+    Забирает самую старую задачу из очереди и переводит её в running.
+
+    Кроме pending забираются и брошенные задачи: в running дольше
+    ITEMS_IMPORT_JOB_TIMEOUT (воркер остановлен посреди импорта).
+    На PostgreSQL параллельные воркеры пропускают заблокированные строки
+    (skip_locked); условный UPDATE по статусу и started_at дополнительно
+    гарантирует, что задачу заберёт только один воркер и на SQLite.
+    """
+    now = timezone.now()
+    stale_before = now - timedelta(seconds=getattr(settings, 'ITEMS_IMPORT_JOB_TIMEOUT', JOB_TIMEOUT))
+    expire_abandoned_jobs(stale_before, now)
+    with transaction.atomic():
+        job = (
+            ImportJob.objects
+            .select_for_update(skip_locked=True)
+            .filter(
+                Q(status=ImportJob.STATUS_PENDING)
+                | Q(status=ImportJob.STATUS_RUNNING, started_at__lt=stale_before)
+            )
+            .order_by('created_at', 'id')
+            .first()
+        )
+        if job is None:
+            return None
+        if job.status == ImportJob.STATUS_RUNNING:
+            logger.warning("Import job %s was abandoned, claiming it again", job.pk)
+        claimed = (
+            ImportJob.objects
+            .filter(pk=job.pk, status=job.status, started_at=job.started_at)
+            .update(
+                status=ImportJob.STATUS_RUNNING, started_at=now, attempts=F('attempts') + 1,
+                rows_processed=0, created=0, updated=0, skipped=0, errors_count=0, errors=[],
+            )
+        )
+    if not claimed:
+        return None
+    job.refresh_from_db()
+    return job
+
+
+def _progress_fields(importer):
+    return {
+        'rows_processed': importer.rows_processed,
+        'created': importer.created,
+        'updated': importer.updated,
+        'skipped': importer.skipped,
+        'errors_count': len(importer.errors),
+        'errors': importer.errors[:MAX_STORED_ERRORS],
+    }
+
+
+def run_import_job(job):
+    """Выполняет импорт по задаче, обновляя прогресс после каждой пачки."""
+    def on_progress(importer):
+        ImportJob.objects.filter(pk=job.pk).update(**_progress_fields(importer))
+
+    try:
+        try:
+            with job.file.open('rb') as file:
+                # В фоне xlsx всегда читается потоково: память воркера не зависит от размера файла
+                report = import_items_upload(file, streaming=is_xlsx_upload(file), on_progress=on_progress)
+        except Exception as e:
+            if not isinstance(e, ImportFormatError):
+                logger.exception("Import job %s failed", job.pk)
+            job.status = ImportJob.STATUS_FAILED
+            job.error_message = str(e)
+            job.finished_at = timezone.now()
+            job.save(update_fields=['status', 'error_message', 'finished_at'])
+            return job
+
+        job.rows_processed = report['created'] + report['updated'] + report['skipped'] + len(report['errors'])
+        job.created = report['created']
+        job.updated = report['updated']
+        job.skipped = report['skipped']
+        job.errors_count = len(report['errors'])
+        job.errors = report['errors'][:MAX_STORED_ERRORS]
+        job.status = ImportJob.STATUS_DONE
+        job.finished_at = timezone.now()
+        job.save()
+        return job
+    finally:
+        # Файл больше не нужен — освобождаем место в MEDIA_ROOT
+        _discard_file(job)
+
+
+def process_pending_jobs(limit=None):
+    """Выполняет задачи из очереди, пока она не опустеет (или не наберётся limit). Возвращает число задач."""
+    processed = 0
+    while limit is None or processed < limit:
+        job = claim_next_job()
+        if job is None:
+            break
+        run_import_job(job)
+        processed += 1
+    return processed
@@ -0,0 +1,195 @@
+"""
+Keyset-пагинация (по курсору) и режимы подсчёта общего количества.
+
+Вместо OFFSET следующая страница выбирается условием «строго после последней
+записи» по полям сортировки, поэтому глубокие страницы стоят столько же,
+сколько первая, и используют индексы (item, -changed_at), (user, -created_at),
+(-created_at). К сортировке всегда добавляется pk — курсор однозначен даже при
+совпадающих датах, а вставка новых записей не сдвигает страницы.
+
+Курсор — base64 от JSON с позицией и сортировкой, для клиента он непрозрачен.
+"""
+import base64
+import binascii
+import datetime
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db import DatabaseError, connections
+from django.db.models import F, Q
+
+COUNT_OFF = 'off'
+COUNT_ESTIMATE = 'estimate'
+COUNT_EXACT = 'exact'
+COUNT_MODES = (COUNT_OFF, COUNT_ESTIMATE, COUNT_EXACT)
+
+
+class InvalidCursor(ValueError):
+    """Курсор повреждён или получен для другой сортировки."""
+
+
+def get_count_mode(request, default=COUNT_EXACT):
+    """Режим подсчёта из ?count=off|estimate|exact (иначе default)."""
+    mode = request.GET.get('count', default)
+    return mode if mode in COUNT_MODES else default
+
+
+def count_queryset(queryset, mode=COUNT_EXACT):
+    """
+    Общее количество записей: None (off), оценка планировщика (estimate) или COUNT(*).
+
+    Оценка доступна на PostgreSQL (EXPLAIN без выполнения запроса); на других СУБД
+    вместо неё считается точное значение.
+    """
+    if mode == COUNT_OFF:
+        return None
+    if mode == COUNT_ESTIMATE and connections[queryset.db].vendor == 'postgresql':
+        try:
+            plan = json.loads(queryset.order_by().explain(format='json'))
+            return int(plan[0]['Plan']['Plan Rows'])
+        except (DatabaseError, ValueError, KeyError, IndexError, TypeError):
+            pass
+    return queryset.count()
+
+
+def get_ordering(queryset):
+    """
+    Сортировка queryset в виде [(поле модели, по убыванию)], дополненная pk.
+
+    Возвращает None, если сортировку нельзя использовать для курсора
+    (выражения, аннотации, поля связанных моделей, NULL-значения).
+    """
+    opts = queryset.model._meta
+    ordering = list(queryset.query.order_by or opts.ordering or [])
+    result = []
+    for entry in ordering:
+        if not isinstance(entry, str) or '__' in entry or entry == '?':
+            return None
+        descending = entry.startswith('-')
+        name = entry.lstrip('-')
+        if name == 'pk':
+            name = opts.pk.name
+        try:
+            field = opts.get_field(name)
+        except FieldDoesNotExist:
+            return None
+        if not field.concrete or field.null:
+            return None
+        result.append((field, descending))
+        if field.primary_key:
+            return result
+    result.append((opts.pk, result[-1][1] if result else False))
+    return result
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    """DjangoJSONEncoder обрезает время до миллисекунд — для курсора нужна полная точность."""
+
+    def default(self, o):
+        if isinstance(o, (datetime.datetime, datetime.time)):
+            return o.isoformat()
+        return super().default(o)
+
+
+def _signature(ordering):
+    return [f"{'-' if desc else ''}{field.name}" for field, desc in ordering]
+
+
+def encode_cursor(obj, ordering, backwards=False):
+    position = [getattr(obj, field.attname) for field, _ in ordering]
+    payload = {'p': position, 'o': _signature(ordering)}
+    if backwards:
+        payload['r'] = 1
+    data = json.dumps(payload, cls=CursorEncoder, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token, ordering):
+    """Возвращает (значения позиции, назад ли). Бросает InvalidCursor."""
+    try:
+        data = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        payload = json.loads(data)
+        position = payload['p']
+        if payload['o'] != _signature(ordering) or len(position) != len(ordering):
+            raise InvalidCursor('Курсор не соответствует сортировке')
+        values = [field.to_python(value) for (field, _), value in zip(ordering, position)]
+    except (binascii.Error, ValueError, KeyError, TypeError, ValidationError) as e:
+        if isinstance(e, InvalidCursor):
+            raise
+        raise InvalidCursor('Некорректный курсор') from e
+    return values, bool(payload.get('r'))
+
+
+def _after(ordering, values, backwards):
+    """Условие «строго после позиции» (или «строго до» при backwards)."""
+    condition = Q()
+    equal = Q()
+    for (field, descending), value in zip(ordering, values):
+        lookup = 'lt' if descending != backwards else 'gt'
+        condition |= equal & Q(**{f'{field.attname}__{lookup}': value})
+        equal &= Q(**{field.attname: value})
+    # Избыточное условие по первому полю позволяет СУБД сканировать индекс диапазоном
+    first_field, first_desc = ordering[0]
+    bound = 'lte' if first_desc != backwards else 'gte'
+    return Q(**{f'{first_field.attname}__{bound}': values[0]}) & condition
+
+
+class KeysetPage:
+    """Страница keyset-пагинации; в шаблоне отличается по is_keyset."""
+    is_keyset = True
+
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None, count=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        self.count = count
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+def paginate_keyset(queryset, cursor, page_size, ordering=None, count_mode=COUNT_OFF):
+    """
+    Возвращает KeysetPage для позиции cursor (None или '' — первая страница).
+
+    Бросает InvalidCursor для повреждённого курсора и ValueError, если сортировка
+    queryset не подходит для keyset (см. get_ordering).
+    """
+    ordering = ordering or get_ordering(queryset)
+    if not ordering:
+        raise ValueError('Сортировка не подходит для keyset-пагинации')
+
+    backwards = False
+    page_qs = queryset
+    if cursor:
+        values, backwards = decode_cursor(cursor, ordering)
+        page_qs = page_qs.filter(_after(ordering, values, backwards))
+    count = count_queryset(queryset, count_mode)
+
+    order_by = [
+        F(field.attname).desc() if descending != backwards else F(field.attname).asc()
+        for field, descending in ordering
+    ]
+    rows = list(page_qs.order_by(*order_by)[:page_size + 1])
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    if backwards:
+        rows.reverse()
+
+    next_cursor = previous_cursor = None
+    if rows:
+        if has_more or backwards:
+            next_cursor = encode_cursor(rows[-1], ordering)
+        if (has_more and backwards) or (cursor and not backwards):
+            previous_cursor = encode_cursor(rows[0], ordering, backwards=True)
+    return KeysetPage(rows, next_cursor, previous_cursor, count)
@@ -0,0 +1,128 @@
+import io
+import multiprocessing
+import sys
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+
+from trades import exports
+
+try:
+    import resource
+except ImportError:  # Windows: пиковая память не измеряется
+    resource = None
+
+
+def make_data(calc_id, lines):
+    """Синтетический расчёт в формате exports.calculation_export_data."""
+    return {
+        'id': calc_id,
+        'user': "admin",
+        'title': f"Расчёт {calc_id}",
+        'markup': Decimal("12.50"),
+        'total_price': Decimal("0"),
+        'total_price_with_markup': Decimal("0"),
+        'created_at': "01.01.2026 12:00",
+        'lines': [
+            (f"Товар {calc_id}-{index}", Decimal(index % 1000) + Decimal("0.99"), index % 50 + 1)
+            for index in range(lines)
+        ],
+    }
+
+
+def build_workbook_pandas(data):
+    """Прежний способ экспорта: DataFrame на каждый лист и pd.ExcelWriter (для сравнения)."""
+    import pandas as pd
+
+    df_calc = pd.DataFrame({
+        "ID": [data['id']],
+        "Создал": [data['user']],
+        "Название": [data['title']],
+        "Наценка (%)": [data['markup']],
+        "Стоимость": [data['total_price']],
+        "Стоимость с наценкой": [data['total_price_with_markup']],
+        "Дата создания": [data['created_at']],
+    })
+    markup = data['markup']
+    items_data = []
+    for idx, (name, price, quantity) in enumerate(data['lines'], start=1):
+        item_total = price * quantity
+        items_data.append({
+            "№": idx,
+            "Наименование": name,
+            "Цена за ед.": float(price),
+            "Количество": quantity,
+            "Сумма": float(item_total),
+            f"Сумма с наценкой ({markup}%)": float(item_total * (1 + markup / 100)),
+        })
+    df_items = pd.DataFrame(items_data) if items_data else pd.DataFrame()
+
+    excel_buffer = io.BytesIO()
+    with pd.ExcelWriter(excel_buffer, engine='xlsxwriter') as writer:
+        df_calc.to_excel(writer, index=False, sheet_name="Информация")
+        if not df_items.empty:
+            df_items.to_excel(writer, index=False, sheet_name="Позиции")
+            worksheet = writer.sheets["Позиции"]
+            money_format = writer.book.add_format({'num_format': '#,##0.00 ₽'})
+            worksheet.set_column('C:C', 15, money_format)
+            worksheet.set_column('E:F', 18, money_format)
+            worksheet.set_column('A:A', 5)
+            worksheet.set_column('B:B', 40)
+            worksheet.set_column('D:D', 12)
+    return excel_buffer.getvalue()
+
+
+ENGINES = {
+    'pandas': build_workbook_pandas,
+    'xlsxwriter': exports.build_calculation_workbook,
+}
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux отдаёт килобайты, macOS — байты
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def run_engine(engine, calculations, lines):
+    """Выполняется в отдельном процессе, чтобы пик памяти относился только к этому способу."""
+    build = ENGINES[engine]
+    started = time.perf_counter()
+    size = 0
+    for calc_id in range(1, calculations + 1):
+        data = make_data(calc_id, lines)
+        size += len(build(data))
+    return time.perf_counter() - started, size, peak_rss_mb()
+
+
+class Command(BaseCommand):
+    help = "Сравнивает скорость и пиковую память экспорта расчётов в Excel: pandas и прямая запись xlsxwriter"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--calculations", type=int, default=20, help="Число расчётов (книг)")
+        parser.add_argument("--lines", type=int, default=5000, help="Позиций в каждом расчёте")
+        parser.add_argument(
+            "--engine",
+            choices=sorted(ENGINES),
+            action="append",
+            help="Какой способ измерять (по умолчанию оба)",
+        )
+
+    def handle(self, *args, **options):
+        calculations, lines = options["calculations"], options["lines"]
+        rows = calculations * lines
+        self.stdout.write(f"Расчётов: {calculations}, позиций в каждом: {lines}, всего строк: {rows}")
+
+        # Каждый способ — в свежем процессе: ru_maxrss не сбрасывается внутри процесса
+        context = multiprocessing.get_context("spawn")
+        for engine in options["engine"] or sorted(ENGINES):
+            with context.Pool(1) as pool:
+                seconds, size, peak = pool.apply(run_engine, (engine, calculations, lines))
+            peak_text = f"{peak:.1f} МБ" if peak is not None else "—"
+            self.stdout.write(
+                f"{engine}: {seconds:.2f} с, {rows / seconds:,.0f} строк/с, "
+                f"пик RSS {peak_text}, объём книг {size / (1024 * 1024):.1f} МБ"
+            )
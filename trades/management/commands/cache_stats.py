@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from trades import caching
+
+
+class Command(BaseCommand):
+    help = "Показывает попадания и промахи кэша ответов (списки и карточки расчётов)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--reset",
+            action="store_true",
+            help="Обнулить счётчики после вывода",
+        )
+
+    def handle(self, *args, **options):
+        for name, (hits, misses) in caching.get_stats().items():
+            total = hits + misses
+            ratio = f"{hits / total:.1%}" if total else "—"
+            self.stdout.write(f"{name}: попаданий {hits}, промахов {misses}, доля попаданий {ratio}")
+        if options["reset"]:
+            caching.reset_stats()
+            self.stdout.write(self.style.SUCCESS("Счётчики обнулены"))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from trades.models import repair_calculation_counters
+
+
+class Command(BaseCommand):
+    help = "Сверяет Calculation.items_count с фактическим числом позиций и исправляет расхождения"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Только показать расхождения, ничего не менять",
+        )
+
+    def handle(self, *args, **options):
+        drift = repair_calculation_counters(fix=not options["dry_run"])
+        for pk, stored, actual in drift:
+            self.stdout.write(f"  расчёт {pk}: items_count={stored}, позиций={actual}")
+        if not drift:
+            self.stdout.write(self.style.SUCCESS("Расхождений нет"))
+        elif options["dry_run"]:
+            self.stdout.write(self.style.WARNING(f"Найдено расхождений: {len(drift)}"))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Исправлено расчётов: {len(drift)}"))
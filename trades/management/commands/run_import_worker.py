@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from trades.jobs import process_pending_jobs
+from trades.models import sweep_stale_totals
+
+
+class Command(BaseCommand):
+    help = "Воркер фоновых задач импорта прайс-листов (очередь ImportJob в БД)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Выполнить все задачи из очереди и завершиться",
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=2.0,
+            help="Пауза (сек) между опросами пустой очереди",
+        )
+
+    def handle(self, *args, **options):
+        if options["once"]:
+            processed = process_pending_jobs()
+            self.stdout.write(self.style.SUCCESS(f"Выполнено задач импорта: {processed}"))
+            return
+
+        self.stdout.write("Воркер импорта запущен, ожидаю задачи...")
+        while True:
+            if process_pending_jobs(limit=1):
+                continue
+            # Очередь пуста — время простоя тратим на устаревшие итоги расчётов
+            if not sweep_stale_totals(max_batches=1):
+                time.sleep(options["poll_interval"])
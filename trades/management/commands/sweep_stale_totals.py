@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from trades.models import sweep_stale_totals
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает устаревшие итоги расчётов (режим CALCULATION_TOTALS_MODE='lazy')"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="Сколько расчётов пересчитывать одним UPDATE",
+        )
+        parser.add_argument(
+            "--loop",
+            action="store_true",
+            help="Не завершаться, а повторять проход каждые --interval секунд",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=30.0,
+            help="Пауза (сек) между проходами в режиме --loop",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            swept = sweep_stale_totals(batch_size=options["batch_size"])
+            if not options["loop"]:
+                self.stdout.write(self.style.SUCCESS(f"Пересчитано расчётов: {swept}"))
+                return
+            time.sleep(options["interval"])
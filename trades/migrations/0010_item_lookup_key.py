@@ -0,0 +1,64 @@
+# Generated by Django 5.2.7 on 2026-10-18 15:09
+
+import sys
+
+from django.db import migrations, models
+
+
+BATCH_SIZE = 1000
+
+
+def make_lookup_key(name):
+    # Копия trades.utils.make_item_lookup_key: миграция не должна зависеть от кода приложения
+    return " ".join(str(name).casefold().replace("ё", "е").split())[:255]
+
+
+def backfill_lookup_keys(apps, schema_editor):
+    """
+    Заполняет Item.lookup_key. Если несколько товаров дают один ключ, ключ получает
+    товар с наименьшим id, остальные остаются с NULL и перечисляются в отчёте —
+    их нужно объединить вручную.
+    """
+    Item = apps.get_model('trades', 'Item')
+
+    owners = {}
+    collisions = {}
+    batch = []
+    for item in Item.objects.order_by('pk').only('id', 'name').iterator(chunk_size=BATCH_SIZE):
+        key = make_lookup_key(item.name)
+        if key in owners:
+            collisions.setdefault(key, [owners[key]]).append(item.pk)
+            continue
+        owners[key] = item.pk
+        item.lookup_key = key
+        batch.append(item)
+        if len(batch) >= BATCH_SIZE:
+            Item.objects.bulk_update(batch, ['lookup_key'])
+            batch = []
+    if batch:
+        Item.objects.bulk_update(batch, ['lookup_key'])
+
+    if collisions:
+        sys.stdout.write(
+            f"\n  Item.lookup_key: найдено {len(collisions)} групп товаров-дублей "
+            f"(ключ оставлен у первого id, у остальных NULL):\n"
+        )
+        for key, ids in sorted(collisions.items()):
+            sys.stdout.write(f"    {key!r}: id {', '.join(map(str, ids))}\n")
+    return collisions
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trades', '0009_importjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='lookup_key',
+            field=models.CharField(editable=False, max_length=255, null=True),
+        ),
+        migrations.RunPython(backfill_lookup_keys, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.7 on 2026-10-18 15:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Уникальность включается отдельной миграцией (отдельной транзакцией),
+    # после того как 0010 заполнила ключи
+
+    dependencies = [
+        ('trades', '0010_item_lookup_key'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='item',
+            name='lookup_key',
+            field=models.CharField(editable=False, max_length=255, null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,39 @@
+from django.db import migrations
+
+
+# (таблица, колонка) для GIN-индексов pg_trgm. Выражение UPPER(...) совпадает с тем,
+# во что Django компилирует icontains на PostgreSQL, поэтому индекс используется для LIKE '%q%'.
+TRIGRAM_INDEXES = [
+    ('trades_item', 'name'),
+    ('trades_calculation', 'title'),
+]
+
+
+def create_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        # На SQLite поиск идёт по FTS5-таблицам, их создаёт trades.search.install_sqlite_fts
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for table, column in TRIGRAM_INDEXES:
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS {table}_{column}_trgm '
+            f'ON {table} USING gin (UPPER({column}::text) gin_trgm_ops)'
+        )
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for table, column in TRIGRAM_INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {table}_{column}_trgm')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trades', '0011_item_lookup_key_unique'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.7 on 2026-10-18 15:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trades', '0012_search_trigram_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='calculation',
+            name='totals_stale',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='calculation',
+            index=models.Index(condition=models.Q(('totals_stale', True)), fields=['id'], name='trades_calc_totals_stale_idx'),
+        ),
+    ]
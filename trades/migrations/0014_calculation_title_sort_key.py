@@ -0,0 +1,45 @@
+# Generated by Django 5.2.7 on 2026-10-18 15:38
+
+from django.db import migrations, models
+
+
+BATCH_SIZE = 1000
+TITLE_SORT_KEY_LENGTH = 512
+
+
+def backfill_title_sort_keys(apps, schema_editor):
+    """Заполняет Calculation.title_sort_key (копия trades.utils.make_title_sort_key)."""
+    from pyuca import Collator
+
+    collator = Collator()
+    Calculation = apps.get_model('trades', 'Calculation')
+    batch = []
+    for calculation in Calculation.objects.order_by('pk').only('id', 'title').iterator(chunk_size=BATCH_SIZE):
+        key = "".join(f"{weight:04x}" for weight in collator.sort_key(calculation.title))
+        calculation.title_sort_key = key[:TITLE_SORT_KEY_LENGTH]
+        batch.append(calculation)
+        if len(batch) >= BATCH_SIZE:
+            Calculation.objects.bulk_update(batch, ['title_sort_key'])
+            batch = []
+    if batch:
+        Calculation.objects.bulk_update(batch, ['title_sort_key'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trades', '0013_calculation_totals_stale'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='calculation',
+            name='title_sort_key',
+            field=models.CharField(default='', editable=False, max_length=512),
+        ),
+        migrations.RunPython(backfill_title_sort_keys, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='calculation',
+            index=models.Index(fields=['title_sort_key', 'id'], name='trades_calc_title_sort_idx'),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.7 on 2026-10-18 15:46
+
+from django.db import migrations, models
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_counters(apps, schema_editor):
+    """items_count — фактическое число позиций, updated_at — дата создания."""
+    Calculation = apps.get_model('trades', 'Calculation')
+    CalculationItem = apps.get_model('trades', 'CalculationItem')
+    lines = (
+        CalculationItem.objects.filter(calculation=OuterRef('pk'))
+        .order_by().values('calculation').annotate(count=Count('pk')).values('count')
+    )
+    Calculation.objects.update(
+        items_count=Coalesce(Subquery(lines, output_field=models.IntegerField()), 0),
+        updated_at=F('created_at'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trades', '0014_calculation_title_sort_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='calculation',
+            name='items_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='calculation',
+            name='revision',
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='calculation',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
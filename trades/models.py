@@ -1,15 +1,23 @@
+import sys
+from contextvars import ContextVar
 from decimal import Decimal
 
 from django.core.validators import MinValueValidator
-from django.db import models, transaction
+from django.db import connection, models, transaction
+from django.db.models import ExpressionWrapper, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Cast, Coalesce, Round
 from django.contrib.auth.models import User, AbstractUser, Permission, Group
 from django.conf import settings  # Импорт для ссылки на модель пользователя
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
 from django.dispatch import receiver
+from django.utils import timezone
 
 
 class Item(models.Model):
     name = models.CharField(max_length=255, unique=True)
+    # Нормализованное название (см. make_item_lookup_key) для поиска дублей при импорте.
+    # NULL остаётся только у старых дублей, найденных при заполнении ключа миграцией.
+    lookup_key = models.CharField(max_length=255, unique=True, null=True, editable=False)
     price = models.DecimalField(
         max_digits=10, 
         decimal_places=2, 
@@ -22,6 +30,31 @@ class Item(models.Model):
             models.Index(fields=['name']),  # Для поиска по имени
         ]
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Название при загрузке: lookup_key пересчитывается, только если оно изменилось
+        instance._loaded_name = instance.__dict__.get('name')
+        return instance
+
+    def save(self, *args, **kwargs):
+        from .utils import make_item_lookup_key
+
+        update_fields = kwargs.get('update_fields')
+        name_saved = update_fields is None or 'name' in update_fields
+        if name_saved and (self._state.adding or self.name != getattr(self, '_loaded_name', None)):
+            key = make_item_lookup_key(self.name)
+            # Старый дубль (lookup_key=NULL) не получает ключ, уже занятый другим товаром
+            if not (
+                self.lookup_key is None and not self._state.adding
+                and Item.objects.filter(lookup_key=key).exclude(pk=self.pk).exists()
+            ):
+                self.lookup_key = key
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'lookup_key'}
+        super().save(*args, **kwargs)
+        self._loaded_name = self.name
+
     def __str__(self):
         return self.name
 
@@ -39,19 +72,60 @@ class Calculation(models.Model):
     )
 
     title = models.CharField(max_length=255)
+    # Ключ сортировки title по правилам Unicode (см. make_title_sort_key):
+    # сортировка по названию выполняется в БД по индексу
+    title_sort_key = models.CharField(max_length=512, default='', editable=False)
     markup = models.DecimalField(max_digits=5, decimal_places=2, default=0)
     created_at = models.DateTimeField(auto_now_add=True, db_index=True)
 
     # Поля для хранения итоговых сумм
     total_price = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     total_price_with_markup = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    # Итоги устарели: цена товара изменилась в режиме CALCULATION_TOTALS_MODE='lazy'.
+    # Пересчитываются при чтении (refresh_stale_totals) или фоновым sweep_stale_totals.
+    totals_stale = models.BooleanField(default=False, editable=False)
+    # Денормализованные счётчики для списков, ETag и ключей кэша: число позиций и
+    # ревизия, которая растёт при каждом изменении расчёта или его позиций.
+    # Расхождения находит и исправляет manage.py repair_calculation_counters.
+    items_count = models.PositiveIntegerField(default=0, editable=False)
+    revision = models.PositiveBigIntegerField(default=0, editable=False)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    # Поля, которые меняются при пересчёте итогов и правке позиций
+    STATE_FIELDS = ('total_price', 'total_price_with_markup', 'totals_stale', 'items_count', 'revision', 'updated_at')
 
     class Meta:
         indexes = [
             models.Index(fields=['user', '-created_at']),  # Для фильтрации по пользователю и сортировки
             models.Index(fields=['-created_at']),  # Для общей сортировки по дате создания
+            # Частичный индекс: sweeper находит устаревшие расчёты, не читая всю таблицу
+            models.Index(fields=['id'], condition=models.Q(totals_stale=True), name='trades_calc_totals_stale_idx'),
+            models.Index(fields=['title_sort_key', 'id'], name='trades_calc_title_sort_idx'),  # Для сортировки по названию
         ]
 
+    def save(self, *args, **kwargs):
+        from .utils import make_title_sort_key
+
+        self.title_sort_key = make_title_sort_key(self.title)
+        bump = not self._state.adding
+        if bump:
+            # Ревизия растёт в БД: при параллельных сохранениях каждое получает свою
+            self.revision = F('revision') + 1
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            update_fields = {*update_fields, 'revision', 'updated_at'}
+            if 'title' in update_fields:
+                update_fields.add('title_sort_key')
+            kwargs['update_fields'] = update_fields
+        super().save(*args, **kwargs)
+        if bump:
+            self.refresh_from_db(fields=['revision'])
+
+    def _copy_state(self, locked):
+        """Переносит итоги и счётчики из заблокированной копии строки."""
+        for field in self.STATE_FIELDS:
+            setattr(self, field, getattr(locked, field))
+
     def total_price_without_markup_calc(self):
         """Вычисляет сумму без наценки по всем CalculationItem, связанным с этим расчетом."""
         return sum(item.total_price() for item in self.items.all())
@@ -74,16 +148,229 @@ class Calculation(models.Model):
             total, total_with_markup = calculate_total_price(locked)
             locked.total_price = total
             locked.total_price_with_markup = total_with_markup
-            locked.save(update_fields=["total_price", "total_price_with_markup"])
+            locked.totals_stale = False
+            locked.items_count = len(locked.items.all())
+            locked.save(update_fields=["total_price", "total_price_with_markup", "totals_stale", "items_count"])
 
-        self.total_price = total
-        self.total_price_with_markup = total_with_markup
+        self._copy_state(locked)
         return total, total_with_markup
 
+    def copy(self, user, title=None):
+        """
+        Копирует расчёт на стороне БД: заголовок с сохранёнными итогами (без пересчёта)
+        и все позиции одним INSERT … SELECT. Исходный расчёт блокируется на время
+        копирования, чтобы итоги и позиции копии соответствовали друг другу.
+        """
+        with transaction.atomic():
+            source = Calculation.objects.select_for_update().get(pk=self.pk)
+            new_calculation = Calculation.objects.create(
+                user=user,
+                title=title or f"{source.title} (копия)",
+                markup=source.markup,
+                total_price=source.total_price,
+                total_price_with_markup=source.total_price_with_markup,
+                totals_stale=source.totals_stale,
+                items_count=source.items_count,
+            )
+            opts = CalculationItem._meta
+            qn = connection.ops.quote_name
+            table = qn(opts.db_table)
+            calculation_column = qn(opts.get_field('calculation').column)
+            item_column = qn(opts.get_field('item').column)
+            quantity_column = qn(opts.get_field('quantity').column)
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"INSERT INTO {table} ({calculation_column}, {item_column}, {quantity_column}) "
+                    f"SELECT %s, {item_column}, {quantity_column} FROM {table} "
+                    f"WHERE {calculation_column} = %s ORDER BY {qn(opts.pk.column)}",
+                    [new_calculation.pk, source.pk],
+                )
+        return new_calculation
+
+    def _shift_totals(self, locked, delta, count_delta=0):
+        """
+        Сдвигает сохранённые итоги заблокированного расчёта на delta (и число позиций
+        на count_delta) вместо пересчёта всех позиций. Устаревшие (totals_stale)
+        итоги пересчитываются целиком.
+        """
+        from .utils import calculate_lines_total
+
+        if locked.totals_stale:
+            locked.refresh_totals()
+        elif delta or count_delta:
+            locked.total_price, locked.total_price_with_markup = calculate_lines_total(
+                [(1, locked.total_price + delta)], locked.markup
+            )
+            locked.items_count += count_delta
+            locked.save(update_fields=["total_price", "total_price_with_markup", "items_count"])
+        self._copy_state(locked)
+
+    def add_line(self, item, quantity=1):
+        """
+        Добавляет товар в расчёт (или увеличивает количество уже добавленного)
+        и сдвигает итоги на стоимость добавленного. Возвращает позицию.
+        """
+        with transaction.atomic():
+            locked = Calculation.objects.select_for_update().get(pk=self.pk)
+            line = (
+                CalculationItem.objects.filter(calculation=locked, item=item)
+                .order_by('pk').first()
+            )
+            created = line is None
+            if created:
+                line = CalculationItem(calculation=locked, item=item, quantity=quantity)
+            else:
+                line.quantity += quantity
+            line.save(update_calculation=False, _touch=False)
+            self._shift_totals(locked, item.price * quantity, count_delta=int(created))
+        return line
+
+    def set_line_quantity(self, line_id, quantity):
+        """Меняет количество в позиции line_id, итоги сдвигаются на разницу. Возвращает позицию."""
+        with transaction.atomic():
+            locked = Calculation.objects.select_for_update().get(pk=self.pk)
+            line = CalculationItem.objects.select_related('item').get(calculation=locked, pk=line_id)
+            delta = line.item.price * (quantity - line.quantity)
+            if quantity != line.quantity:
+                line.quantity = quantity
+                line.save(update_calculation=False, _touch=False, update_fields=['quantity'])
+            self._shift_totals(locked, delta)
+        return line
+
+    def remove_line(self, line_id):
+        """Удаляет позицию line_id, итоги уменьшаются на её стоимость."""
+        with transaction.atomic():
+            locked = Calculation.objects.select_for_update().get(pk=self.pk)
+            line = CalculationItem.objects.select_related('item').get(calculation=locked, pk=line_id)
+            line.delete(update_calculation=False, _touch=False)
+            self._shift_totals(locked, -line.item.price * line.quantity, count_delta=-1)
+
+    def batch_edit(self):
+        """
+        Контекст пакетного редактирования позиций::
+
+            with calculation.batch_edit() as batch:
+                batch.set_quantity(item_id, 3)
+                batch.remove(other_item_id)
+
+        Позиции записываются bulk-запросами, итоги пересчитываются один раз.
+        """
+        return CalculationBatch(self)
+
     def __str__(self):
         return self.title
 
 
+# Расчёты, позиции которых сейчас редактируются пачкой: {calculation_id: CalculationBatch}
+_active_batches = ContextVar('trades_calculation_batches', default={})
+
+
+class CalculationBatch:
+    """
+    Пакетное редактирование позиций расчёта (см. Calculation.batch_edit).
+
+    Изменения копятся в памяти и при выходе из блока записываются тремя
+    запросами (delete, bulk_create, bulk_update), после чего итоги пересчитываются
+    один раз. CalculationItem.save()/delete() этого расчёта внутри блока тоже
+    не пересчитывают итоги. Блок выполняется в транзакции.
+    """
+
+    def __init__(self, calculation):
+        self.calculation = calculation
+        self._lines = None
+        self._to_create = {}
+        self._to_update = {}
+        self._to_delete = {}
+        # item_id добавленных, изменённых и удалённых позиций — для отчёта
+        self.created = set()
+        self.updated = set()
+        self.deleted = set()
+        self.dirty = False
+
+    @property
+    def lines(self):
+        """Текущие позиции {item_id: CalculationItem} с учётом несохранённых изменений."""
+        if self._lines is None:
+            self._lines = {}
+            for line in CalculationItem.objects.filter(calculation=self.calculation).order_by('pk'):
+                first = self._lines.get(line.item_id)
+                if first is None:
+                    self._lines[line.item_id] = line
+                else:
+                    # Дубли одного товара схлопываются в первую позицию
+                    first.quantity += line.quantity
+                    self._to_update[line.item_id] = first
+                    self._to_delete[line.pk] = line.item_id
+        return self._lines
+
+    def set_quantity(self, item_id, quantity):
+        """Добавляет товар в расчёт или меняет его количество."""
+        line = self.lines.get(item_id)
+        if line is None:
+            line = CalculationItem(calculation=self.calculation, item_id=item_id, quantity=quantity)
+            self.lines[item_id] = line
+            self._to_create[item_id] = line
+            self.created.add(item_id)
+        elif line.quantity != quantity:
+            line.quantity = quantity
+            if line.pk is not None:
+                self._to_update[item_id] = line
+                self.updated.add(item_id)
+
+    def add(self, item_id, quantity=1):
+        """Увеличивает количество товара (или добавляет его)."""
+        line = self.lines.get(item_id)
+        self.set_quantity(item_id, quantity + (line.quantity if line else 0))
+
+    def remove(self, item_id):
+        line = self.lines.pop(item_id, None)
+        if line is None:
+            return
+        if line.pk is None:
+            self._to_create.pop(item_id, None)
+            self.created.discard(item_id)
+        else:
+            self._to_update.pop(item_id, None)
+            self.updated.discard(item_id)
+            self._to_delete[line.pk] = item_id
+            self.deleted.add(item_id)
+
+    @property
+    def has_changes(self):
+        return bool(self._to_create or self._to_update or self._to_delete)
+
+    def flush(self):
+        """Записывает накопленные изменения позиций (без пересчёта итогов)."""
+        if not self.has_changes:
+            return
+        if self._to_delete:
+            CalculationItem.objects.filter(pk__in=list(self._to_delete)).delete()
+        if self._to_create:
+            CalculationItem.objects.bulk_create(self._to_create.values())
+        if self._to_update:
+            CalculationItem.objects.bulk_update(self._to_update.values(), ['quantity'])
+        self._to_create, self._to_update, self._to_delete = {}, {}, {}
+        self.dirty = True
+
+    def __enter__(self):
+        self._atomic = transaction.atomic()
+        self._atomic.__enter__()
+        self._token = _active_batches.set({**_active_batches.get(), self.calculation.pk: self})
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _active_batches.reset(self._token)
+        try:
+            if exc_type is None:
+                self.flush()
+                if self.dirty:
+                    self.calculation.refresh_totals()
+        except BaseException:
+            self._atomic.__exit__(*sys.exc_info())
+            raise
+        return self._atomic.__exit__(exc_type, exc, tb)
+
+
 class CalculationItem(models.Model):
     calculation = models.ForeignKey(Calculation, related_name='items', on_delete=models.CASCADE, db_index=True)
     item = models.ForeignKey(Item, on_delete=models.CASCADE, db_index=True)
@@ -95,18 +382,49 @@ class CalculationItem(models.Model):
     def __str__(self):
         return f"{self.item.name} x {self.quantity}"
 
-    def save(self, *args, update_calculation=True, **kwargs):
-        """Сохраняет позицию и при необходимости пересчитывает расчёт."""
+    def _refresh_calculation(self, calculation):
+        batch = _active_batches.get().get(self.calculation_id)
+        if batch is not None:
+            # Внутри Calculation.batch_edit() итоги пересчитаются один раз при выходе
+            batch.dirty = True
+        else:
+            calculation.refresh_totals()
+
+    def _touch_calculation(self, count_delta):
+        """
+        Без пересчёта итогов (update_calculation=False) расчёт всё равно получает
+        новое число позиций и ревизию: по ним строятся ETag и ключи кэша ответов.
+        """
+        Calculation.objects.filter(pk=self.calculation_id).update(
+            items_count=F('items_count') + count_delta,
+            revision=F('revision') + 1,
+            updated_at=timezone.now(),
+        )
+
+    def save(self, *args, update_calculation=True, _touch=True, **kwargs):
+        """
+        Сохраняет позицию и при необходимости пересчитывает расчёт. _touch=False —
+        только для методов расчёта, которые сами сдвигают итоги и счётчики.
+        """
+        created = self._state.adding
         super().save(*args, **kwargs)
 
-        if update_calculation and self.calculation_id:
-            self.calculation.refresh_totals()
+        if not self.calculation_id:
+            return
+        if update_calculation:
+            self._refresh_calculation(self.calculation)
+        elif _touch:
+            self._touch_calculation(int(created))
 
-    def delete(self, *args, update_calculation=True, **kwargs):
+    def delete(self, *args, update_calculation=True, _touch=True, **kwargs):
         calculation = self.calculation if self.calculation_id else None
         super().delete(*args, **kwargs)
-        if update_calculation and calculation:
-            calculation.refresh_totals()
+        if not calculation:
+            return
+        if update_calculation:
+            self._refresh_calculation(calculation)
+        elif _touch:
+            self._touch_calculation(-1)
 
 
 
@@ -182,15 +500,316 @@ class CalculationSnapshotItem(models.Model):
         return f"{self.item_name} x {self.quantity} (Итого: {self.total_price})"
 
 
-@receiver(post_save, sender=Item)
-def refresh_calculation_totals_for_item(sender, instance, **kwargs):
-    """После изменения товара пересчитываем связанные расчёты."""
-    related_calculations = (
-        Calculation.objects
-        .filter(items__item=instance)
-        .distinct()
+class ImportJob(models.Model):
+    """Фоновая задача импорта прайс-листа. Очередь хранится в БД, внешний брокер не нужен."""
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'В очереди'),
+        (STATUS_RUNNING, 'Выполняется'),
+        (STATUS_DONE, 'Завершён'),
+        (STATUS_FAILED, 'Ошибка'),
+    ]
+
+    file = models.FileField(upload_to='imports/%Y/%m/')
+    original_name = models.CharField(max_length=255, blank=True)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    created_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        verbose_name="Загрузил",
     )
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    # Сколько раз задачу забирал воркер: зависшие задачи забираются повторно (см. claim_next_job)
+    attempts = models.PositiveSmallIntegerField(default=0)
+
+    # Прогресс обновляется воркером после каждой пачки строк
+    rows_processed = models.PositiveIntegerField(default=0)
+    created = models.PositiveIntegerField(default=0)
+    updated = models.PositiveIntegerField(default=0)
+    skipped = models.PositiveIntegerField(default=0)
+    errors_count = models.PositiveIntegerField(default=0)
+    errors = models.JSONField(default=list, blank=True)
+    error_message = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'created_at']),  # Для выборки следующей задачи из очереди
+        ]
+
+    def __str__(self):
+        return f"Импорт {self.original_name or self.file.name} ({self.get_status_display()})"
+
+
+def resolve_items(item_ids):
+    """
+    Находит товары одним запросом. Возвращает ({id: Item}, список id, которых нет
+    в каталоге или которые не являются числом) — чтобы сообщить обо всех сразу.
+    """
+    ids = set()
+    invalid = []
+    for item_id in item_ids:
+        try:
+            ids.add(int(item_id))
+        except (TypeError, ValueError):
+            invalid.append(item_id)
+    items = Item.objects.in_bulk(ids) if ids else {}
+    return items, sorted(ids - items.keys()) + invalid
+
+
+def create_calculations_with_items(*, user, specs):
+    """
+    Создаёт несколько расчётов; specs — тройки (название, наценка, lines), где
+    lines — пары (Item, количество).
+
+    Итоги считаются в памяти по уже загруженным товарам, заголовки и позиции всех
+    расчётов вставляются двумя bulk_create — число запросов не зависит ни от
+    количества расчётов, ни от количества позиций.
+    """
+    from .utils import calculate_lines_total, make_title_sort_key
+
+    calculations = []
+    for title, markup, lines in specs:
+        total, total_with_markup = calculate_lines_total(
+            ((quantity, item.price) for item, quantity in lines), markup
+        )
+        calculations.append(Calculation(
+            user=user,
+            title=title,
+            title_sort_key=make_title_sort_key(title),
+            markup=markup,
+            items_count=len(lines),
+            total_price=total,
+            total_price_with_markup=total_with_markup,
+        ))
+    with transaction.atomic():
+        Calculation.objects.bulk_create(calculations)
+        CalculationItem.objects.bulk_create(
+            CalculationItem(calculation=calculation, item=item, quantity=quantity)
+            for calculation, (_, _, lines) in zip(calculations, specs)
+            for item, quantity in lines
+        )
+    return calculations
+
+
+def create_calculation_with_items(*, user, title, markup, lines, snapshot_by=None):
+    """
+    Создаёт расчёт с позициями lines — пары (Item, количество).
+
+    Позиции (и позиции снимка, если передан snapshot_by) вставляются одним
+    bulk_create: запросов столько же для 1 и для 1000 позиций.
+    """
+    with transaction.atomic():
+        calculation, = create_calculations_with_items(user=user, specs=[(title, markup, lines)])
+        if snapshot_by is not None:
+            snapshot = CalculationSnapshot.objects.create(
+                calculation=calculation,
+                frozen_total_price=calculation.total_price,
+                frozen_total_price_with_markup=calculation.total_price_with_markup,
+                created_by=snapshot_by,
+            )
+            CalculationSnapshotItem.objects.bulk_create(
+                CalculationSnapshotItem(
+                    snapshot=snapshot,
+                    item_name=item.name,
+                    item_price=item.price,
+                    quantity=quantity,
+                    total_price=item.price * quantity,
+                )
+                for item, quantity in lines
+            )
+    return calculation
+
+
+def _cents(expression):
+    """Сумма в копейках целым числом: дальше считаем без float-погрешностей SQLite."""
+    return Cast(Round(expression * Value(100)), models.BigIntegerField())
+
+
+def recalculate_calculation_totals(calculations):
+    """
+    Пересчитывает итоги расчётов из queryset одним UPDATE с коррелированным SUM
+    по позициям (CalculationItem × Item.price). Число запросов не зависит от того,
+    сколько расчётов затронуто.
+
+    Вычисления идут в целых копейках с округлением суммы с наценкой половина вверх —
+    результат совпадает с calculate_total_price на любой СУБД. Возвращает число
+    обновлённых расчётов.
+    """
+    total_cents = Coalesce(
+        Subquery(
+            CalculationItem.objects
+            .filter(calculation_id=OuterRef('pk'))
+            .order_by()
+            .values('calculation_id')
+            .annotate(cents=Sum(F('quantity') * _cents(F('item__price'))))
+            .values('cents'),
+            output_field=models.BigIntegerField(),
+        ),
+        Value(0),
+    )
+    # total × (100 + markup) / 100 в копейках; +5000 перед целочисленным делением — округление
+    with_markup_cents = (total_cents * (Value(10000) + _cents(F('markup'))) + Value(5000)) / Value(10000)
+    decimal_field = models.DecimalField(max_digits=10, decimal_places=2)
+    return calculations.update(
+        total_price=ExpressionWrapper(total_cents * Value(Decimal('0.01')), output_field=decimal_field),
+        total_price_with_markup=ExpressionWrapper(
+            with_markup_cents * Value(Decimal('0.01')), output_field=decimal_field
+        ),
+        totals_stale=False,
+        revision=F('revision') + 1,
+        updated_at=timezone.now(),
+    )
+
+
+def calculation_totals_are_lazy():
+    return getattr(settings, 'CALCULATION_TOTALS_MODE', 'eager') == 'lazy'
+
+
+def invalidate_calculation_totals(calculations):
+    """
+    Реакция на изменение цен товаров в расчётах из queryset: в режиме 'eager'
+    итоги пересчитываются сразу, в режиме 'lazy' расчёты только помечаются
+    устаревшими — время записи товара не зависит от числа расчётов с ним.
+    """
+    if calculation_totals_are_lazy():
+        return calculations.update(totals_stale=True, revision=F('revision') + 1, updated_at=timezone.now())
+    return recalculate_calculation_totals(calculations)
 
-    for calculation in related_calculations:
-        calculation.refresh_totals()
 
+def _items_count_subquery():
+    """Фактическое число позиций расчёта — коррелированный подзапрос."""
+    lines = (
+        CalculationItem.objects.filter(calculation=OuterRef('pk'))
+        .order_by().values('calculation').annotate(count=models.Count('pk')).values('count')
+    )
+    return Coalesce(Subquery(lines, output_field=models.IntegerField()), 0)
+
+
+def sync_items_count(calculations):
+    """
+    Пересчитывает items_count расчётов из queryset одним UPDATE и увеличивает их
+    ревизию — для путей, которые меняют позиции в обход модели (каскадное удаление).
+    """
+    return calculations.update(
+        items_count=_items_count_subquery(), revision=F('revision') + 1, updated_at=timezone.now()
+    )
+
+
+def repair_calculation_counters(fix=True):
+    """
+    Сверяет items_count с фактическим числом позиций. Возвращает список
+    (id, сохранённое, фактическое) для расхождений; при fix=True исправляет их.
+    """
+    drift = list(
+        Calculation.objects.annotate(actual_count=_items_count_subquery())
+        .exclude(items_count=F('actual_count'))
+        .order_by('pk')
+        .values_list('pk', 'items_count', 'actual_count')
+    )
+    if fix and drift:
+        sync_items_count(Calculation.objects.filter(pk__in=[pk for pk, _, _ in drift]))
+    return drift
+
+
+def refresh_stale_totals(calculations):
+    """
+    Пересчитывает устаревшие итоги перед чтением.
+
+    calculations — queryset (один UPDATE по его устаревшим расчётам, нужен перед
+    сортировкой по суммам) или уже загруженные объекты: их поля обновляются на месте.
+    Возвращает число пересчитанных расчётов.
+    """
+    if isinstance(calculations, models.QuerySet):
+        return recalculate_calculation_totals(
+            Calculation.objects.filter(totals_stale=True, pk__in=calculations.order_by().values('pk'))
+        )
+
+    stale = {calculation.pk: calculation for calculation in calculations if calculation.totals_stale}
+    if not stale:
+        return 0
+    recalculate_calculation_totals(Calculation.objects.filter(pk__in=stale))
+    fresh = Calculation.objects.filter(pk__in=stale).values('pk', *Calculation.STATE_FIELDS)
+    for values in fresh:
+        calculation = stale[values.pop('pk')]
+        for field, value in values.items():
+            setattr(calculation, field, value)
+    return len(stale)
+
+
+def sweep_stale_totals(batch_size=500, max_batches=None):
+    """Фоновый пересчёт устаревших итогов пачками по batch_size. Возвращает число расчётов."""
+    swept = batches = 0
+    while max_batches is None or batches < max_batches:
+        ids = list(
+            Calculation.objects.filter(totals_stale=True).order_by('pk').values_list('pk', flat=True)[:batch_size]
+        )
+        if not ids:
+            break
+        swept += recalculate_calculation_totals(Calculation.objects.filter(pk__in=ids))
+        batches += 1
+    return swept
+
+
+def refresh_calculations_for_items(item_ids, chunk_size=500):
+    """Пересчитывает итоги всех расчётов, в которых встречаются товары item_ids.
+
+    Используется там, где цены меняются в обход Item.save() (bulk_update при импорте),
+    поэтому сигнал post_save не срабатывает. Один UPDATE на chunk_size товаров.
+    """
+    item_ids = list(item_ids)
+    for start in range(0, len(item_ids), chunk_size):
+        invalidate_calculation_totals(
+            Calculation.objects.filter(items__item_id__in=item_ids[start:start + chunk_size])
+        )
+
+
+@receiver([post_save, post_delete], sender=Item)
+def invalidate_item_cache(sender, **kwargs):
+    """Любое изменение каталога сбрасывает кэш статистики товаров."""
+    from . import caching
+
+    caching.invalidate(caching.ITEMS)
+
+
+@receiver(pre_delete, sender=Item)
+def remember_calculations_for_item(sender, instance, **kwargs):
+    """Позиции с товаром удалятся каскадом — запоминаем затронутые расчёты."""
+    instance._calculation_ids = list(
+        Calculation.objects.filter(items__item=instance).values_list('pk', flat=True).distinct()
+    )
+
+
+@receiver(post_delete, sender=Item)
+def refresh_calculations_for_deleted_item(sender, instance, **kwargs):
+    """После каскадного удаления позиций обновляем число позиций и итоги расчётов."""
+    calculation_ids = getattr(instance, '_calculation_ids', None)
+    if calculation_ids:
+        calculations = Calculation.objects.filter(pk__in=calculation_ids)
+        sync_items_count(calculations)
+        invalidate_calculation_totals(calculations)
+
+
+@receiver(post_save, sender=Item)
+def refresh_calculation_totals_for_item(sender, instance, **kwargs):
+    """После изменения товара пересчитываем (или помечаем устаревшими) связанные расчёты."""
+    invalidate_calculation_totals(Calculation.objects.filter(items__item=instance))
+
+
+@receiver(pre_save, sender=CustomUser)
+def touch_calculations_for_renamed_user(sender, instance, update_fields=None, **kwargs):
+    """
+    Имя автора выводится в расчётах: при переименовании увеличиваем их ревизию,
+    чтобы сменились ETag и ключи кэша ответов.
+    """
+    if instance.pk is None or (update_fields is not None and 'username' not in update_fields):
+        return
+    old = CustomUser.objects.filter(pk=instance.pk).values_list('username', flat=True).first()
+    if old is not None and old != instance.username:
+        Calculation.objects.filter(user=instance).update(revision=F('revision') + 1, updated_at=timezone.now())
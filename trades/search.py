@@ -0,0 +1,243 @@
+"""
+Поиск по каталогу товаров и названиям расчётов.
+
+Бэкенд выбирается по СУБД:
+- PostgreSQL — расширение pg_trgm: GIN-индексы по UPPER(name)/UPPER(title)
+  (миграция 0012) обслуживают icontains, релевантность — TrigramSimilarity;
+- SQLite — теневые FTS5-таблицы с токенизатором trigram, которые поддерживаются
+  триггерами (см. install_sqlite_fts), релевантность — bm25;
+- остальные СУБД — обычный icontains с простым ранжированием.
+
+Все варианты добавляют к queryset аннотацию search_rank: чем больше, тем релевантнее.
+"""
+import logging
+import re
+
+from django.db import OperationalError, connections
+from django.db.models import Case, FloatField, Value, When
+from django.db.models.expressions import RawSQL
+from rest_framework import filters
+
+logger = logging.getLogger(__name__)
+
+# Модели (app_label.model_name) и поле, по которому строится поисковый индекс
+SEARCH_FIELDS = {
+    'trades.item': 'name',
+    'trades.calculation': 'title',
+}
+
+# Токенизатор trigram не находит строки короче трёх символов
+FTS_MIN_TERM_LENGTH = 3
+
+_fts_tables_cache = {}
+
+
+def split_terms(query):
+    """Разбивает запрос на слова, как это делает DRF SearchFilter."""
+    return [term for term in re.split(r'[\s,]+', query or '') if term]
+
+
+def search_field(model):
+    return SEARCH_FIELDS[model._meta.label_lower]
+
+
+def fts_table(model):
+    return f'{model._meta.db_table}_fts'
+
+
+class IContainsSearchBackend:
+    """Поиск через icontains по каждому слову; ранжирование: точное совпадение, начало строки, вхождение."""
+
+    def filter(self, queryset, query):
+        field = search_field(queryset.model)
+        for term in split_terms(query):
+            queryset = queryset.filter(**{f'{field}__icontains': term})
+        return queryset
+
+    def rank(self, queryset, query):
+        field = search_field(queryset.model)
+        return Case(
+            When(**{f'{field}__iexact': query}, then=Value(3.0)),
+            When(**{f'{field}__istartswith': query}, then=Value(2.0)),
+            default=Value(1.0),
+            output_field=FloatField(),
+        )
+
+    def search(self, queryset, query):
+        """Фильтрует queryset по запросу и добавляет аннотацию search_rank."""
+        if not split_terms(query):
+            return queryset
+        return self.filter(queryset, query).annotate(search_rank=self.rank(queryset, query))
+
+
+class PostgresTrigramSearchBackend(IContainsSearchBackend):
+    """icontains по GIN-индексу gin_trgm_ops, релевантность — триграммное сходство со всей строкой запроса."""
+
+    def rank(self, queryset, query):
+        from django.contrib.postgres.search import TrigramSimilarity
+
+        return TrigramSimilarity(search_field(queryset.model), query)
+
+
+class SQLiteFTS5SearchBackend(IContainsSearchBackend):
+    """Поиск по теневой FTS5-таблице <db_table>_fts (токенизатор trigram — поиск подстроки)."""
+
+    @staticmethod
+    def match_expression(terms):
+        return ' AND '.join('"{}"'.format(term.replace('"', '""')) for term in terms)
+
+    def _split(self, query):
+        terms = split_terms(query)
+        long_terms = [term for term in terms if len(term) >= FTS_MIN_TERM_LENGTH]
+        short_terms = [term for term in terms if len(term) < FTS_MIN_TERM_LENGTH]
+        return long_terms, short_terms
+
+    def filter(self, queryset, query):
+        model = queryset.model
+        if not fts_available(model, queryset.db):
+            return super().filter(queryset, query)
+
+        long_terms, short_terms = self._split(query)
+        if long_terms:
+            table = fts_table(model)
+            queryset = queryset.filter(pk__in=RawSQL(
+                f'SELECT rowid FROM {table} WHERE {table} MATCH %s',
+                [self.match_expression(long_terms)],
+            ))
+        field = search_field(model)
+        for term in short_terms:
+            queryset = queryset.filter(**{f'{field}__icontains': term})
+        return queryset
+
+    def rank(self, queryset, query):
+        model = queryset.model
+        long_terms, _ = self._split(query)
+        if not long_terms or not fts_available(model, queryset.db):
+            return super().rank(queryset, query)
+
+        table = fts_table(model)
+        # bm25 в FTS5 отрицательный (меньше — лучше), поэтому берём со знаком минус
+        return RawSQL(
+            f'SELECT -{table}.rank FROM {table} WHERE {table} MATCH %s '
+            f'AND {table}.rowid = {model._meta.db_table}.{model._meta.pk.column}',
+            [self.match_expression(long_terms)],
+            output_field=FloatField(),
+        )
+
+
+BACKENDS = {
+    'postgresql': PostgresTrigramSearchBackend,
+    'sqlite': SQLiteFTS5SearchBackend,
+}
+
+
+def get_search_backend(using='default'):
+    return BACKENDS.get(connections[using].vendor, IContainsSearchBackend)()
+
+
+def search(queryset, query):
+    """Ищет по queryset товаров или расчётов; результат аннотирован search_rank."""
+    return get_search_backend(queryset.db).search(queryset, query)
+
+
+def search_ordered(queryset, query, *tiebreak):
+    """search() с сортировкой по релевантности (при равной — по полям tiebreak)."""
+    if not split_terms(query):
+        return queryset
+    return search(queryset, query).order_by('-search_rank', *tiebreak)
+
+
+def fts_available(model, using='default'):
+    """Есть ли FTS5-таблица для модели (создаётся в post_migrate, если SQLite поддерживает trigram)."""
+    key = (using, model._meta.db_table)
+    if key not in _fts_tables_cache:
+        with connections[using].cursor() as cursor:
+            cursor.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s",
+                [fts_table(model)],
+            )
+            _fts_tables_cache[key] = cursor.fetchone() is not None
+    return _fts_tables_cache[key]
+
+
+def install_sqlite_fts(sender=None, using='default', apps=None, **kwargs):
+    """
+    post_migrate: создаёт FTS5-таблицы и триггеры синхронизации для SQLite.
+
+    Триггеры ставятся после каждой миграции, потому что SQLite при изменении
+    схемы пересоздаёт таблицу и её триггеры теряются; в этом случае индекс
+    перестраивается из исходной таблицы.
+    """
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return
+
+    from django.apps import apps as global_apps
+
+    with connection.cursor() as cursor:
+        for label, field_name in SEARCH_FIELDS.items():
+            model = global_apps.get_model(label)
+            table = model._meta.db_table
+            column = model._meta.get_field(field_name).column
+            pk = model._meta.pk.column
+            fts = fts_table(model)
+
+            cursor.execute("SELECT name FROM sqlite_master WHERE name LIKE %s", [f'{fts}%'])
+            existing = {row[0] for row in cursor.fetchall()}
+            triggers = {
+                f'{fts}_ai': f'AFTER INSERT ON {table} BEGIN '
+                             f'INSERT INTO {fts}(rowid, {column}) VALUES (new.{pk}, new.{column}); END',
+                f'{fts}_ad': f'AFTER DELETE ON {table} BEGIN '
+                             f"INSERT INTO {fts}({fts}, rowid, {column}) VALUES ('delete', old.{pk}, old.{column}); END",
+                f'{fts}_au': f'AFTER UPDATE OF {column} ON {table} BEGIN '
+                             f"INSERT INTO {fts}({fts}, rowid, {column}) VALUES ('delete', old.{pk}, old.{column}); "
+                             f'INSERT INTO {fts}(rowid, {column}) VALUES (new.{pk}, new.{column}); END',
+            }
+            if fts in existing and existing.issuperset(triggers):
+                continue
+
+            try:
+                cursor.execute(
+                    f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+                    f"{column}, content='{table}', content_rowid='{pk}', tokenize='trigram')"
+                )
+            except OperationalError:
+                logger.warning("SQLite без поддержки FTS5 trigram: поиск по %s работает через LIKE", table)
+                continue
+            for name, body in triggers.items():
+                cursor.execute(f'CREATE TRIGGER IF NOT EXISTS {name} {body}')
+            cursor.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+            _fts_tables_cache.pop((using, table), None)
+
+
+class RankedSearchFilter(filters.SearchFilter):
+    """
+    SearchFilter, который ищет через поисковый бэкенд и сортирует по релевантности,
+    если клиент не задал ?ordering=. Ставится в filter_backends после OrderingFilter.
+
+    Поля search_fields вида 'item__name' ищутся подзапросом по связанной модели.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        query = ' '.join(self.get_search_terms(request))
+        search_fields = self.get_search_fields(view, request)
+        if not query or not search_fields:
+            return queryset
+
+        path = search_fields[0]
+        *relation, field = path.split('__')
+        model = queryset.model
+        for name in relation:
+            model = model._meta.get_field(name).related_model
+        if SEARCH_FIELDS.get(model._meta.label_lower) != field:
+            return super().filter_queryset(request, queryset, view)
+
+        if relation:
+            matches = get_search_backend(queryset.db).filter(model._default_manager.all(), query)
+            return queryset.filter(**{'__'.join(relation) + '__in': matches.values('pk')})
+
+        ordering = list(queryset.query.order_by)
+        queryset = search(queryset, query)
+        if filters.OrderingFilter.ordering_param not in request.query_params:
+            queryset = queryset.order_by('-search_rank', *ordering)
+        return queryset
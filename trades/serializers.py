@@ -1,17 +1,29 @@
+from django.conf import settings
+from django.db import DatabaseError, transaction
 from rest_framework import serializers
-from .models import Item, Calculation, CalculationItem, CustomUser, PriceHistory, CalculationSnapshot, CalculationSnapshotItem
+from .fieldsets import SparseFieldsSerializerMixin
+from .utils import ITEM_NAME_TAKEN_MESSAGE, item_name_taken
+from .models import Item, Calculation, CalculationItem, CustomUser, PriceHistory, CalculationSnapshot, CalculationSnapshotItem, \
+    ImportJob, create_calculation_with_items, create_calculations_with_items, refresh_stale_totals, \
+    resolve_items
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(SparseFieldsSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = CustomUser
         fields = ['id', 'username', 'email', 'is_admin']
 
-class ItemSerializer(serializers.ModelSerializer):
+class ItemSerializer(SparseFieldsSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Item
         fields = ['id', 'name', 'price']
 
-class PriceHistorySerializer(serializers.ModelSerializer):
+    def validate_name(self, value):
+        # Дубли ищутся по нормализованному ключу (регистр, пробелы, ё/е)
+        if item_name_taken(value, self.instance):
+            raise serializers.ValidationError(ITEM_NAME_TAKEN_MESSAGE)
+        return value
+
+class PriceHistorySerializer(SparseFieldsSerializerMixin, serializers.ModelSerializer):
     item_name = serializers.CharField(source='item.name', read_only=True)
     changed_by_username = serializers.CharField(source='changed_by.username', read_only=True)
     
@@ -19,12 +31,26 @@ class PriceHistorySerializer(serializers.ModelSerializer):
         model = PriceHistory
         fields = ['id', 'item', 'item_name', 'old_price', 'new_price', 'changed_at', 'changed_by', 'changed_by_username']
 
+class ImportJobSerializer(serializers.ModelSerializer):
+    created_by_username = serializers.CharField(source='created_by.username', read_only=True)
+
+    class Meta:
+        model = ImportJob
+        fields = [
+            'id', 'original_name', 'status', 'rows_processed', 'created', 'updated',
+            'skipped', 'errors_count', 'errors', 'error_message', 'created_by',
+            'created_by_username', 'created_at', 'started_at', 'finished_at'
+        ]
+        read_only_fields = fields
+
 class CalculationSnapshotItemSerializer(serializers.ModelSerializer):
     class Meta:
         model = CalculationSnapshotItem
         fields = ['id', 'item_name', 'item_price', 'quantity', 'total_price']
 
-class CalculationSnapshotSerializer(serializers.ModelSerializer):
+class CalculationSnapshotSerializer(SparseFieldsSerializerMixin, serializers.ModelSerializer):
+    expandable_fields = ('items',)
+
     items = CalculationSnapshotItemSerializer(many=True, read_only=True)
     calculation_title = serializers.CharField(source='calculation.title', read_only=True)
     created_by_username = serializers.CharField(source='created_by.username', read_only=True)
@@ -38,6 +64,9 @@ class CalculationSnapshotSerializer(serializers.ModelSerializer):
         ]
 
 class CalculationItemSerializer(serializers.ModelSerializer):
+    # Данные для total_price — см. optimize_queryset (вложенный список расчёта)
+    field_sources = {'total_price': ('item.price', 'quantity')}
+
     item_name = serializers.CharField(source='item.name', read_only=True)
     item_price = serializers.DecimalField(source='item.price', max_digits=10, decimal_places=2, read_only=True)
     total_price = serializers.SerializerMethodField()
@@ -49,9 +78,27 @@ class CalculationItemSerializer(serializers.ModelSerializer):
     def get_total_price(self, obj):
         return obj.total_price()
 
-class CalculationSerializer(serializers.ModelSerializer):
+class CalculationLineSerializer(serializers.Serializer):
+    """Позиция для /api/calculations/<id>/items/: item только при добавлении."""
+    item = serializers.PrimaryKeyRelatedField(queryset=Item.objects.all())
+    quantity = serializers.IntegerField(min_value=1, default=1)
+
+
+def calculation_totals(calculation):
+    """Итоги расчёта для ответов, меняющих его позиции."""
+    return {
+        'id': calculation.pk,
+        'total_price': str(calculation.total_price),
+        'total_price_with_markup': str(calculation.total_price_with_markup),
+    }
+
+
+class CalculationSerializer(SparseFieldsSerializerMixin, serializers.ModelSerializer):
+    expandable_fields = ('items',)
+    # to_representation проверяет, не устарели ли итоги
+    required_sources = ('totals_stale',)
+
     items = CalculationItemSerializer(many=True, read_only=True)
-    items_count = serializers.SerializerMethodField()
     created_by = serializers.CharField(source='user.username', read_only=True)
 
     class Meta:
@@ -59,17 +106,23 @@ class CalculationSerializer(serializers.ModelSerializer):
         fields = [
             'id', 'title', 'markup', 'created_at', 'created_by',
             'total_price', 'total_price_with_markup', 
-            'items_count', 'items'
+            'items_count', 'updated_at', 'revision', 'items'
         ]
-        read_only_fields = ['total_price', 'total_price_with_markup', 'created_at']
+        read_only_fields = ['total_price', 'total_price_with_markup', 'created_at', 'updated_at']
 
-    def get_items_count(self, obj):
-        return obj.items.count()
+    def to_representation(self, instance):
+        # Ленивый режим итогов: устаревшие суммы пересчитываются при первом чтении
+        if instance.totals_stale:
+            refresh_stale_totals([instance])
+        return super().to_representation(instance)
 
 class CalculationCreateUpdateSerializer(serializers.ModelSerializer):
     """
     Сериализатор для создания/обновления расчета.
     Принимает список items в формате: [{"item_id": 1, "quantity": 2}, ...]
+
+    Обновление применяет к позициям diff (добавить / изменить количество / удалить),
+    в ответе поле changes описывает, что изменилось.
     """
     items = serializers.ListField(child=serializers.DictField(), write_only=True)
 
@@ -77,39 +130,245 @@ class CalculationCreateUpdateSerializer(serializers.ModelSerializer):
         model = Calculation
         fields = ['id', 'title', 'markup', 'items']
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.changes = None
+
+    def validate_items(self, value):
+        """Приводит позиции к {item_id: quantity}; повторы одного товара суммируются."""
+        quantities = {}
+        errors = []
+        for index, item_data in enumerate(value):
+            try:
+                item_id = int(item_data['item_id'])
+                quantity = int(item_data.get('quantity', 1))
+            except (KeyError, TypeError, ValueError):
+                errors.append(f"Позиция {index + 1}: нужны целые item_id и quantity")
+                continue
+            if quantity < 1:
+                errors.append(f"Позиция {index + 1}: количество должно быть не меньше 1")
+                continue
+            quantities[item_id] = quantities.get(item_id, 0) + quantity
+        if errors:
+            raise serializers.ValidationError(errors)
+        return quantities
+
+    def validate(self, attrs):
+        # Все товары проверяем одним запросом и сообщаем обо всех отсутствующих сразу
+        self.items_by_id = {}
+        if attrs.get('items'):
+            known = self.context.get('items_by_id')
+            if known is None:
+                self.items_by_id, missing_ids = resolve_items(attrs['items'])
+            else:
+                # Пакетный запрос уже загрузил товары всех операций
+                self.items_by_id = {item_id: known[item_id] for item_id in attrs['items'] if item_id in known}
+                missing_ids = sorted(attrs['items'].keys() - known.keys())
+            if missing_ids:
+                raise serializers.ValidationError({
+                    'items': [f"Товары не найдены (id): {', '.join(map(str, missing_ids))}"],
+                    'missing_item_ids': missing_ids,
+                })
+        return attrs
+
     def create(self, validated_data):
-        items_data = validated_data.pop('items', [])
-        user = self.context['request'].user
-        calculation = Calculation.objects.create(user=user, **validated_data)
-        
-        for item_data in items_data:
-            CalculationItem.objects.create(
-                calculation=calculation,
-                item_id=item_data['item_id'],
-                quantity=item_data.get('quantity', 1)
-            )
-        
-        calculation.refresh_totals()
-        return calculation
+        items_data = validated_data.pop('items', {})
+        return create_calculation_with_items(
+            user=self.context['request'].user,
+            title=validated_data['title'],
+            markup=validated_data.get('markup', 0),
+            lines=[(self.items_by_id[item_id], quantity) for item_id, quantity in items_data.items()],
+        )
 
     def update(self, instance, validated_data):
         items_data = validated_data.pop('items', None)
-        
-        instance.title = validated_data.get('title', instance.title)
-        instance.markup = validated_data.get('markup', instance.markup)
-        instance.save()
 
+        changed_fields = [
+            field for field in ('title', 'markup')
+            if field in validated_data and validated_data[field] != getattr(instance, field)
+        ]
+        for field in changed_fields:
+            setattr(instance, field, validated_data[field])
+        if changed_fields:
+            instance.save(update_fields=changed_fields)
+
+        created, updated, deleted = set(), set(), set()
+        lines_changed = False
         if items_data is not None:
-            # Удаляем старые, создаем новые (простой способ обновления)
-            # В "pro" версии лучше делать diff (обновлять существующие, удалять лишние),
-            # но для начала так надежнее.
-            instance.items.all().delete()
-            for item_data in items_data:
-                CalculationItem.objects.create(
-                    calculation=instance,
-                    item_id=item_data['item_id'],
-                    quantity=item_data.get('quantity', 1)
-                )
+            # diff с текущими позициями: три bulk-запроса и один пересчёт итогов,
+            # неизменённые позиции не трогаем
+            with instance.batch_edit() as batch:
+                for item_id in list(batch.lines):
+                    if item_id not in items_data:
+                        batch.remove(item_id)
+                for item_id, quantity in items_data.items():
+                    batch.set_quantity(item_id, quantity)
+            created, updated, deleted = batch.created, batch.updated, batch.deleted
+            lines_changed = batch.dirty
+
+        if 'markup' in changed_fields and not lines_changed:
             instance.refresh_totals()
-            
+
+        self.changes = {
+            'fields': changed_fields,
+            'created': sorted(created),
+            'updated': sorted(updated),
+            'deleted': sorted(deleted),
+        }
         return instance
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        if self.changes is not None:
+            data['changes'] = self.changes
+        return data
+
+
+class CalculationBatchSerializer(serializers.Serializer):
+    """
+    Пакет операций для POST /api/calculations/batch/:
+    {"atomic": true, "operations": [
+        {"action": "create", "title": "...", "markup": 10, "items": [{"item_id": 1, "quantity": 2}]},
+        {"action": "update", "id": 5, "items": [...]},
+    ]}
+
+    Все операции проверяются вместе: товары и обновляемые расчёты загружаются
+    одним запросом каждые, новые расчёты и их позиции вставляются двумя bulk_create.
+    atomic=true — всё или ничего (при любой ошибке ничего не записывается);
+    atomic=false — корректные операции применяются, ошибочные возвращаются с ошибками
+    (если пачка созданий не записалась, расчёты создаются по одному).
+    save() возвращает результаты в порядке операций.
+    """
+    ACTIONS = ('create', 'update')
+
+    atomic = serializers.BooleanField(default=True)
+    operations = serializers.ListField(child=serializers.DictField(), allow_empty=False)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.failed = False
+
+    def validate_operations(self, value):
+        limit = getattr(settings, 'CALCULATION_BATCH_MAX_OPERATIONS', 500)
+        if len(value) > limit:
+            raise serializers.ValidationError(f"Не больше {limit} операций в одном запросе")
+        return value
+
+    @staticmethod
+    def _as_int(value):
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return None
+
+    @staticmethod
+    def _error(index, errors):
+        return {'index': index, 'status': 'error', 'errors': errors}
+
+    @staticmethod
+    def _result(index, status, calculation, changes=None):
+        result = {'index': index, 'status': status, 'title': calculation.title, **calculation_totals(calculation)}
+        if changes is not None:
+            result['changes'] = changes
+        return result
+
+    def _preload(self, operations):
+        """Товары всех операций и обновляемые расчёты — по одному запросу."""
+        item_ids, calculation_ids = set(), set()
+        for operation in operations:
+            lines = operation.get('items')
+            for line in lines if isinstance(lines, list) else ():
+                if isinstance(line, dict) and self._as_int(line.get('item_id')) is not None:
+                    item_ids.add(self._as_int(line['item_id']))
+            if operation.get('action') == 'update' and self._as_int(operation.get('id')) is not None:
+                calculation_ids.add(self._as_int(operation['id']))
+        items_by_id = resolve_items(item_ids)[0] if item_ids else {}
+        # queryset из view уже ограничен расчётами, доступными пользователю
+        queryset = self.context['queryset'].order_by().prefetch_related(None)
+        calculations = queryset.in_bulk(calculation_ids) if calculation_ids else {}
+        return items_by_id, calculations
+
+    @staticmethod
+    def _in_savepoint(write):
+        """Выполняет запись в своей точке сохранения; возвращает ошибку БД или None."""
+        try:
+            with transaction.atomic():
+                write()
+        except DatabaseError as e:
+            return e
+        return None
+
+    def _apply(self, indexes, write, results, atomic):
+        """Выполняет запись; в режиме best-effort — в своей точке сохранения."""
+        if atomic:
+            write()
+            return
+        error = self._in_savepoint(write)
+        if error is not None:
+            for index in indexes:
+                results[index] = self._error(index, {'non_field_errors': [str(error)]})
+
+    def create(self, validated_data):
+        operations = validated_data['operations']
+        atomic = validated_data['atomic']
+        items_by_id, calculations = self._preload(operations)
+        context = {**self.context, 'items_by_id': items_by_id}
+
+        results = [None] * len(operations)
+        creates, updates = [], []
+        for index, operation in enumerate(operations):
+            action = operation.get('action')
+            if action not in self.ACTIONS:
+                results[index] = self._error(index, {'action': [f"Допустимые значения: {', '.join(self.ACTIONS)}"]})
+                continue
+            instance = None
+            if action == 'update':
+                instance = calculations.get(self._as_int(operation.get('id')))
+                if instance is None:
+                    results[index] = self._error(index, {'id': ["Расчёт не найден"]})
+                    continue
+            data = {key: value for key, value in operation.items() if key not in ('action', 'id')}
+            serializer = CalculationCreateUpdateSerializer(
+                instance, data=data, partial=instance is not None, context=context
+            )
+            if not serializer.is_valid():
+                results[index] = self._error(index, serializer.errors)
+                continue
+            (updates if instance is not None else creates).append((index, serializer))
+
+        if atomic and any(result is not None for result in results):
+            # Всё или ничего: корректные операции не применяются
+            self.failed = True
+            return [result or {'index': index, 'status': 'skipped'} for index, result in enumerate(results)]
+
+        def write_creates(batch):
+            created = create_calculations_with_items(
+                user=self.context['request'].user,
+                specs=[
+                    (
+                        serializer.validated_data['title'],
+                        serializer.validated_data.get('markup', 0),
+                        [(serializer.items_by_id[item_id], quantity)
+                         for item_id, quantity in serializer.validated_data.get('items', {}).items()],
+                    )
+                    for _, serializer in batch
+                ],
+            )
+            for (index, _), calculation in zip(batch, created):
+                results[index] = self._result(index, 'created', calculation)
+
+        def write_update(index, serializer):
+            calculation = serializer.save()
+            results[index] = self._result(index, 'updated', calculation, serializer.changes)
+
+        with transaction.atomic():
+            if atomic and creates:
+                write_creates(creates)
+            elif creates and self._in_savepoint(lambda: write_creates(creates)) is not None:
+                # Пачка не записалась: создаём по одному, чтобы ошибка одной операции
+                # не отменяла остальные
+                for entry in creates:
+                    self._apply([entry[0]], lambda entry=entry: write_creates([entry]), results, atomic)
+            for index, serializer in updates:
+                self._apply([index], lambda: write_update(index, serializer), results, atomic)
+        return results
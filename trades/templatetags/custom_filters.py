@@ -60,7 +60,7 @@ def mul(value, arg):
 def querystring(context, **kwargs):
     """
     Создаёт query string из текущих GET параметров, обновляя указанные значения.
-    Использование: {% querystring page=2 %}
+    Использование: {% querystring page=2 %}; значение None убирает параметр.
     """
     request = context.get('request')
     if not request:
@@ -80,7 +80,10 @@ def querystring(context, **kwargs):
     
     # Обновляем указанными значениями
     for key, value in kwargs.items():
-        params[key] = str(value)
+        if value is None:
+            params.pop(key, None)
+        else:
+            params[key] = str(value)
     
     # Обрабатываем множественные значения для urlencode
     query_parts = []
@@ -0,0 +1,10 @@
+import pytest
+from django.core.cache import cache
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    """Откат транзакции теста не сбрасывает версии кэша, поэтому чистим его между тестами."""
+    cache.clear()
+    yield
+    cache.clear()
@@ -101,9 +101,11 @@ def test_export_calculations_zip_success(api_client, admin, sample_calculations)
     # Django может отдавать разные заголовки, проверим по content-type и что это бинарь
     content_type = response["Content-Type"]
     assert "zip" in content_type or "application/octet-stream" in content_type
-    assert isinstance(response.content, (bytes, bytearray))
+    # Архив отдаётся потоково (StreamingHttpResponse)
+    content = response.getvalue()
+    assert isinstance(content, (bytes, bytearray))
     # На всякий случай убедимся, что ответ не пустой
-    assert len(response.content) > 0
+    assert len(content) > 0
 
 
 @pytest.mark.django_db
@@ -150,7 +152,7 @@ def test_export_calculations_user_exports_only_own_when_mixed_ids(api_client, us
 
     # Архив должен сформироваться, даже если часть id отфильтрована
     assert response.status_code == 200
-    assert len(response.content) > 0
+    assert len(response.getvalue()) > 0
 
 
 
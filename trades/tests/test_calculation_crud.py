@@ -2,8 +2,11 @@ from decimal import Decimal
 
 import pytest
 from django.contrib.auth import get_user_model
+from django.db import DatabaseError, connection
+from django.test.utils import CaptureQueriesContext
 from rest_framework.test import APIClient
 
+from trades import serializers as serializers_module
 from trades.models import Item, Calculation, CalculationItem
 
 
@@ -79,3 +82,360 @@ def test_update_calculation_via_api_recalculates_totals(api_client, user):
     assert calc.total_price_with_markup == Decimal("54.00")
 
 
+
+
+@pytest.fixture
+def calculation_with_lines(db):
+    items = [Item.objects.create(name=f"Позиция {i}", price=Decimal("10.00")) for i in range(4)]
+    calc = Calculation.objects.create(title="Пакетный", markup=Decimal("10"))
+    for item in items[:3]:
+        CalculationItem(calculation=calc, item=item, quantity=1).save(update_calculation=False)
+    calc.refresh_totals()
+    return calc, items
+
+
+@pytest.mark.django_db
+def test_batch_edit_flushes_in_bulk_and_recalculates_once(calculation_with_lines, monkeypatch):
+    calc, items = calculation_with_lines
+    refreshes = []
+    original = Calculation.refresh_totals
+    monkeypatch.setattr(Calculation, "refresh_totals", lambda self: refreshes.append(self.pk) or original(self))
+
+    with calc.batch_edit() as batch:
+        batch.set_quantity(items[0].id, 5)
+        batch.remove(items[1].id)
+        batch.add(items[3].id, 2)
+        batch.add(items[3].id)
+        # Обычное сохранение позиции внутри блока тоже не пересчитывает итоги
+        line = CalculationItem.objects.get(calculation=calc, item=items[2])
+        line.quantity = 4
+        line.save()
+
+    assert refreshes == [calc.pk]
+    assert batch.created == {items[3].id}
+    assert batch.updated == {items[0].id}
+    assert batch.deleted == {items[1].id}
+    quantities = dict(calc.items.values_list("item_id", "quantity"))
+    assert quantities == {items[0].id: 5, items[2].id: 4, items[3].id: 3}
+    calc.refresh_from_db()
+    assert calc.total_price == Decimal("120.00")
+
+
+@pytest.mark.django_db
+def test_batch_edit_rolls_back_on_error(calculation_with_lines):
+    calc, items = calculation_with_lines
+
+    with pytest.raises(RuntimeError):
+        with calc.batch_edit() as batch:
+            batch.remove(items[0].id)
+            batch.flush()
+            raise RuntimeError
+
+    assert calc.items.count() == 3
+
+
+@pytest.mark.django_db
+def test_api_update_replaces_lines_in_batch(api_client, user, calculation_with_lines):
+    calc, items = calculation_with_lines
+    calc.user = user
+    calc.save()
+    api_client.force_authenticate(user=user)
+
+    payload = {"title": "Пакетный", "markup": "10", "items": [
+        {"item_id": items[0].id, "quantity": 2},
+        {"item_id": items[3].id, "quantity": 1},
+    ]}
+    response = api_client.put(f"/api/calculations/{calc.id}/", payload, format="json")
+
+    assert response.status_code == 200
+    calc.refresh_from_db()
+    assert calc.total_price == Decimal("30.00")
+    assert calc.total_price_with_markup == Decimal("33.00")
+
+
+@pytest.mark.django_db
+def test_api_update_applies_diff_and_reports_changes(api_client, user, calculation_with_lines):
+    calc, items = calculation_with_lines
+    calc.user = user
+    calc.save()
+    api_client.force_authenticate(user=user)
+    kept_line = CalculationItem.objects.get(calculation=calc, item=items[2])
+
+    payload = {"title": "Пакетный", "markup": "10", "items": [
+        {"item_id": items[0].id, "quantity": 3},
+        {"item_id": items[2].id, "quantity": 1},
+        {"item_id": items[3].id, "quantity": 1},
+        {"item_id": items[3].id, "quantity": 1},
+    ]}
+    response = api_client.put(f"/api/calculations/{calc.id}/", payload, format="json")
+
+    assert response.status_code == 200
+    assert response.data["changes"] == {
+        "fields": [], "created": [items[3].id], "updated": [items[0].id], "deleted": [items[1].id],
+    }
+    # Неизменённая позиция не пересоздаётся
+    assert CalculationItem.objects.filter(pk=kept_line.pk, quantity=1).exists()
+    calc.refresh_from_db()
+    assert calc.total_price == Decimal("60.00")
+
+
+@pytest.mark.django_db
+def test_api_update_without_changes_writes_nothing(api_client, user, calculation_with_lines):
+    calc, items = calculation_with_lines
+    calc.user = user
+    calc.save()
+    api_client.force_authenticate(user=user)
+    payload = {"title": "Пакетный", "markup": "10.00", "items": [
+        {"item_id": item.id, "quantity": 1} for item in items[:3]
+    ]}
+
+    with CaptureQueriesContext(connection) as ctx:
+        response = api_client.put(f"/api/calculations/{calc.id}/", payload, format="json")
+
+    assert response.data["changes"] == {"fields": [], "created": [], "updated": [], "deleted": []}
+    writes = [q["sql"] for q in ctx.captured_queries if q["sql"].startswith(("INSERT", "UPDATE", "DELETE"))]
+    assert writes == []
+
+
+@pytest.mark.django_db
+def test_api_update_rejects_bad_lines(api_client, user, calculation_with_lines):
+    calc, _ = calculation_with_lines
+    calc.user = user
+    calc.save()
+    api_client.force_authenticate(user=user)
+
+    response = api_client.patch(
+        f"/api/calculations/{calc.id}/", {"items": [{"item_id": "x"}, {"item_id": 1, "quantity": 0}]}, format="json"
+    )
+
+    assert response.status_code == 400
+    assert len(response.data["items"]) == 2
+
+
+@pytest.mark.django_db
+def test_api_create_uses_constant_queries(api_client, user):
+    api_client.force_authenticate(user=user)
+    items = Item.objects.bulk_create(
+        Item(name=f"Деталь {i}", lookup_key=f"деталь {i}", price=Decimal("2.50")) for i in range(60)
+    )
+    payload = {"title": "Большой", "markup": "10", "items": [{"item_id": item.id, "quantity": 2} for item in items]}
+
+    with CaptureQueriesContext(connection) as ctx:
+        response = api_client.post("/api/calculations/", payload, format="json")
+
+    assert response.status_code == 201
+    assert len(ctx.captured_queries) < 10
+    calc = Calculation.objects.get(pk=response.data["id"])
+    assert calc.items.count() == 60
+    assert calc.total_price == Decimal("300.00")
+    assert calc.total_price_with_markup == Decimal("330.00")
+
+
+@pytest.mark.django_db
+def test_api_create_reports_all_missing_items(api_client, user):
+    api_client.force_authenticate(user=user)
+    item = Item.objects.create(name="Есть", price=Decimal("1.00"))
+
+    payload = {"title": "Ошибка", "markup": "0", "items": [
+        {"item_id": 999998}, {"item_id": item.id}, {"item_id": 999997},
+    ]}
+    response = api_client.post("/api/calculations/", payload, format="json")
+
+    assert response.status_code == 400
+    assert response.json()["missing_item_ids"] == ["999997", "999998"]
+    assert not Calculation.objects.filter(title="Ошибка").exists()
+
+
+@pytest.mark.django_db
+def test_api_copy_inserts_lines_in_one_statement(api_client, user, calculation_with_lines):
+    api_client.force_authenticate(user=user)
+    user.is_admin = True
+    user.save()
+    calc, _ = calculation_with_lines
+
+    with CaptureQueriesContext(connection) as ctx:
+        response = api_client.post(f"/api/calculations/{calc.id}/copy/")
+
+    assert response.status_code == 201
+    inserts = [q["sql"] for q in ctx.captured_queries if q["sql"].startswith("INSERT INTO")]
+    assert len(inserts) == 2  # заголовок и все позиции
+    copy = Calculation.objects.get(pk=response.data["id"])
+    assert copy.title == "Пакетный (копия)"
+    assert copy.user == user
+    assert copy.total_price == calc.total_price
+    assert copy.total_price_with_markup == calc.total_price_with_markup
+    assert list(copy.items.order_by("id").values_list("item_id", "quantity")) == list(
+        calc.items.order_by("id").values_list("item_id", "quantity")
+    )
+
+
+@pytest.mark.django_db
+def test_api_batch_creates_and_updates_with_bulk_writes(api_client, user, calculation_with_lines):
+    api_client.force_authenticate(user=user)
+    calc, items = calculation_with_lines
+    calc.user = user
+    calc.save(update_fields=["user"])
+    payload = {"operations": [
+        {"action": "create", "title": f"Ночной {i}", "markup": "10",
+         "items": [{"item_id": items[0].id, "quantity": 2}, {"item_id": items[3].id}]}
+        for i in range(20)
+    ] + [{"action": "update", "id": calc.id, "items": [{"item_id": items[0].id, "quantity": 5}]}]}
+
+    with CaptureQueriesContext(connection) as ctx:
+        response = api_client.post("/api/calculations/batch/", payload, format="json")
+
+    assert response.status_code == 200
+    results = response.data["results"]
+    assert [r["status"] for r in results] == ["created"] * 20 + ["updated"]
+    assert len(ctx.captured_queries) < 25
+    created = Calculation.objects.get(pk=results[0]["id"])
+    assert created.user == user
+    assert created.items.count() == 2
+    assert created.total_price == Decimal("30.00")
+    assert results[0]["total_price_with_markup"] == "33.00"
+    calc.refresh_from_db()
+    assert calc.total_price == Decimal("50.00")
+    assert results[-1]["changes"]["deleted"] == [items[1].id, items[2].id]
+
+
+@pytest.mark.django_db
+def test_api_batch_atomic_writes_nothing_on_error(api_client, user, calculation_with_lines):
+    api_client.force_authenticate(user=user)
+    _, items = calculation_with_lines
+    payload = [
+        {"action": "create", "title": "Хороший", "items": [{"item_id": items[0].id}]},
+        {"action": "create", "title": "Плохой", "items": [{"item_id": 999999}]},
+        {"action": "update", "id": 999999, "title": "Нет такого"},
+    ]
+
+    response = api_client.post("/api/calculations/batch/", payload, format="json")
+
+    assert response.status_code == 400
+    results = response.json()["results"]
+    assert [r["status"] for r in results] == ["skipped", "error", "error"]
+    assert results[1]["errors"]["missing_item_ids"] == ["999999"]
+    assert not Calculation.objects.filter(title="Хороший").exists()
+
+
+@pytest.mark.django_db
+def test_api_batch_best_effort_applies_valid_operations(api_client, user, calculation_with_lines):
+    api_client.force_authenticate(user=user)
+    calc, items = calculation_with_lines
+    payload = {"atomic": False, "operations": [
+        {"action": "create", "title": "Хороший", "items": [{"item_id": items[0].id}]},
+        {"action": "create", "items": []},
+        # чужой расчёт обычному пользователю не виден
+        {"action": "update", "id": calc.id, "title": "Чужой"},
+    ]}
+
+    response = api_client.post("/api/calculations/batch/", payload, format="json")
+
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert [r["status"] for r in results] == ["created", "error", "error"]
+    assert "title" in results[1]["errors"]
+    assert Calculation.objects.filter(title="Хороший", user=user).exists()
+    calc.refresh_from_db()
+    assert calc.title == "Пакетный"
+
+
+@pytest.mark.django_db
+def test_api_batch_best_effort_retries_creates_one_by_one(api_client, user, calculation_with_lines, monkeypatch):
+    api_client.force_authenticate(user=user)
+    _, items = calculation_with_lines
+    original = serializers_module.create_calculations_with_items
+
+    def failing(*, user, specs):
+        if any(title == "Сбой" for title, _, _ in specs):
+            raise DatabaseError("insert failed")
+        return original(user=user, specs=specs)
+
+    monkeypatch.setattr(serializers_module, "create_calculations_with_items", failing)
+    payload = {"atomic": False, "operations": [
+        {"action": "create", "title": title, "items": [{"item_id": items[0].id}]}
+        for title in ("Первый", "Сбой", "Третий")
+    ]}
+
+    response = api_client.post("/api/calculations/batch/", payload, format="json")
+
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert [r["status"] for r in results] == ["created", "error", "created"]
+    assert results[1]["errors"]["non_field_errors"] == ["insert failed"]
+    assert set(Calculation.objects.filter(user=user).values_list("title", flat=True)) == {"Первый", "Третий"}
+
+
+@pytest.fixture
+def own_calculation(api_client, user, calculation_with_lines):
+    api_client.force_authenticate(user=user)
+    calc, items = calculation_with_lines
+    calc.user = user
+    calc.save(update_fields=["user"])
+    return calc, items
+
+
+@pytest.mark.django_db
+def test_api_line_endpoints_shift_totals_by_delta(api_client, own_calculation, monkeypatch):
+    calc, items = own_calculation
+    monkeypatch.setattr(Calculation, "refresh_totals", lambda self: pytest.fail("полный пересчёт"))
+    url = f"/api/calculations/{calc.id}/items/"
+
+    response = api_client.post(url, {"item": items[3].id, "quantity": 2}, format="json")
+    assert response.status_code == 201
+    assert response.data["line"]["quantity"] == 2
+    assert response.data["calculation"]["total_price"] == "50.00"
+    assert response.data["calculation"]["total_price_with_markup"] == "55.00"
+
+    line_id = calc.items.get(item=items[0]).id
+    response = api_client.patch(f"{url}{line_id}/", {"quantity": 4}, format="json")
+    assert response.status_code == 200
+    assert response.data["calculation"]["total_price"] == "80.00"
+
+    response = api_client.delete(f"{url}{line_id}/")
+    assert response.status_code == 200
+    assert response.data["line"] is None
+    assert response.data["calculation"]["total_price"] == "40.00"
+    calc.refresh_from_db()
+    assert calc.total_price == Decimal("40.00")
+    assert calc.total_price_with_markup == Decimal("44.00")
+
+
+@pytest.mark.django_db
+def test_api_line_endpoints_validate_input(api_client, own_calculation):
+    calc, items = own_calculation
+    url = f"/api/calculations/{calc.id}/items/"
+
+    assert api_client.post(url, {"item": 999999}, format="json").status_code == 400
+    line_id = calc.items.first().id
+    assert api_client.patch(f"{url}{line_id}/", {"quantity": 0}, format="json").status_code == 400
+    assert api_client.patch(f"{url}{line_id}/", {}, format="json").status_code == 400
+    assert api_client.delete(f"{url}999999/").status_code == 404
+
+    # Повторное добавление товара увеличивает количество в существующей позиции
+    response = api_client.post(url, {"item": items[0].id}, format="json")
+    assert response.data["line"]["id"] == calc.items.get(item=items[0]).id
+    assert response.data["line"]["quantity"] == 2
+
+
+@pytest.mark.django_db
+def test_api_list_skips_lines_unless_expanded(api_client, user):
+    api_client.force_authenticate(user=user)
+    item = Item.objects.create(name="Строка", price=Decimal("1.00"))
+    for i in range(5):
+        calc = Calculation.objects.create(title=f"Список {i}", user=user)
+        for _ in range(i):
+            CalculationItem(calculation=calc, item=item, quantity=1).save(update_calculation=False)
+
+    with CaptureQueriesContext(connection) as ctx:
+        response = api_client.get("/api/calculations/")
+
+    assert response.status_code == 200
+    rows = response.data["results"]
+    assert "items" not in rows[0]
+    assert sorted(row["items_count"] for row in rows) == [0, 1, 2, 3, 4]
+    # обновление устаревших итогов, агрегат для ETag, COUNT и сама страница
+    assert len(ctx.captured_queries) == 4
+
+    response = api_client.get("/api/calculations/", {"expand": "items"})
+    assert sorted(len(row["items"]) for row in response.data["results"]) == [0, 1, 2, 3, 4]
+    assert all(row["items_count"] == len(row["items"]) for row in response.data["results"])
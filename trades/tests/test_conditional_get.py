@@ -0,0 +1,116 @@
+from decimal import Decimal
+
+import pytest
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from trades.models import Item, Calculation, CalculationItem, CalculationSnapshot
+
+
+@pytest.fixture
+def admin_client(db):
+    User = get_user_model()
+    user = User.objects.create_user(username="admin", password="pass123", is_superuser=True, is_admin=True)
+    client = APIClient()
+    client.force_authenticate(user=user)
+    return client
+
+
+@pytest.fixture
+def calculation(db):
+    item = Item.objects.create(name="Кабель", price=Decimal("2.50"))
+    calc = Calculation.objects.create(title="Склад", markup=Decimal("10"))
+    CalculationItem.objects.create(calculation=calc, item=item, quantity=4)
+    return calc
+
+
+def revalidate(client, url, response, **params):
+    return client.get(url, params, HTTP_IF_NONE_MATCH=response["ETag"])
+
+
+@pytest.mark.django_db
+def test_calculation_detail_304_skips_loading_object(admin_client, calculation):
+    url = f"/api/calculations/{calculation.id}/"
+    response = admin_client.get(url)
+    assert response.status_code == 200
+    assert response["ETag"].startswith('"')
+    assert "Last-Modified" in response
+    assert "no-cache" in response["Cache-Control"]
+
+    with CaptureQueriesContext(connection) as ctx:
+        cached = revalidate(admin_client, url, response)
+    assert cached.status_code == 304
+    assert cached["ETag"] == response["ETag"]
+    assert len(ctx.captured_queries) == 1
+    assert 'FROM "trades_calculationitem"' not in ctx.captured_queries[0]["sql"]
+
+    # ?fields= — другое представление и другой ETag
+    assert revalidate(admin_client, url, response, fields="id").status_code == 200
+
+    calculation.add_line(Item.objects.create(name="Розетка", price=Decimal("1.00")))
+    assert revalidate(admin_client, url, response).status_code == 200
+
+
+@pytest.mark.django_db
+def test_line_saved_without_recalculation_changes_etag(admin_client, calculation):
+    url = f"/api/calculations/{calculation.id}/"
+    response = admin_client.get(url)
+
+    line = CalculationItem(calculation=calculation, item=Item.objects.create(name="Лампа", price=Decimal("3.00")))
+    line.save(update_calculation=False)
+    fresh = revalidate(admin_client, url, response)
+    assert fresh.status_code == 200
+    assert fresh.data["items_count"] == 2
+
+    line.delete(update_calculation=False)
+    assert revalidate(admin_client, url, fresh).data["items_count"] == 1
+
+
+@pytest.mark.django_db
+def test_item_rename_changes_calculation_detail_etag(admin_client, calculation):
+    url = f"/api/calculations/{calculation.id}/"
+    response = admin_client.get(url)
+
+    item = Item.objects.get(name="Кабель")
+    item.name = "Кабель медный"
+    item.save()
+
+    fresh = revalidate(admin_client, url, response)
+    assert fresh.status_code == 200
+    assert fresh.data["items"][0]["item_name"] == "Кабель медный"
+
+
+@pytest.mark.django_db
+def test_lists_revalidate_against_table_versions(admin_client, calculation):
+    items = admin_client.get("/api/items/")
+    calculations = admin_client.get("/api/calculations/")
+    snapshot = CalculationSnapshot.objects.create(
+        calculation=calculation, frozen_total_price=Decimal("10.00"), frozen_total_price_with_markup=Decimal("11.00")
+    )
+    snapshots = admin_client.get("/api/snapshots/")
+
+    assert revalidate(admin_client, "/api/items/", items).status_code == 304
+    assert revalidate(admin_client, "/api/calculations/", calculations).status_code == 304
+    assert revalidate(admin_client, "/api/snapshots/", snapshots).status_code == 304
+    assert revalidate(admin_client, "/api/items/", items, page=2).status_code != 304
+
+    Item.objects.create(name="Новый", price=Decimal("1.00"))
+    calculation.title = "Склад 2"
+    calculation.save(update_fields=["title"])
+
+    assert revalidate(admin_client, "/api/items/", items).status_code == 200
+    assert revalidate(admin_client, "/api/calculations/", calculations).status_code == 200
+    assert revalidate(admin_client, "/api/snapshots/", snapshots).status_code == 200
+    assert admin_client.get(f"/api/snapshots/{snapshot.id}/").status_code == 200
+
+
+@pytest.mark.django_db
+def test_if_modified_since(admin_client, calculation):
+    url = f"/api/calculations/{calculation.id}/"
+    response = admin_client.get(url)
+
+    cached = admin_client.get(url, HTTP_IF_MODIFIED_SINCE=response["Last-Modified"])
+
+    assert cached.status_code == 304
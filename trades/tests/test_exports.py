@@ -0,0 +1,197 @@
+import io
+import time
+import zipfile
+from decimal import Decimal
+
+import pytest
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.http import StreamingHttpResponse
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from openpyxl import load_workbook
+
+from trades import exports
+from trades.models import Item, Calculation, CalculationItem
+
+
+@pytest.fixture
+def admin(db):
+    User = get_user_model()
+    return User.objects.create_user(username="admin", password="pass123", is_superuser=True, is_admin=True)
+
+
+@pytest.fixture
+def client(admin):
+    client = Client()
+    client.force_login(admin)
+    return client
+
+
+@pytest.fixture
+def calculations(admin):
+    cable = Item.objects.create(name="Кабель", price=Decimal("2.50"))
+    socket = Item.objects.create(name="Розетка", price=Decimal("100.00"))
+    result = []
+    for index in range(3):
+        calc = Calculation.objects.create(title=f"Расчёт {index}", markup=Decimal("10"), user=admin)
+        CalculationItem.objects.create(calculation=calc, item=cable, quantity=index + 1)
+        CalculationItem.objects.create(calculation=calc, item=socket, quantity=2)
+        result.append(calc)
+    # Расчёт без позиций: в книге только лист «Информация»
+    result.append(Calculation.objects.create(title="Пустой", markup=Decimal("0"), user=admin))
+    return result
+
+
+def workbook_name(calc):
+    return f"calculation_{calc.id}_{calc.title[:30]}.xlsx"
+
+
+def read_zip(response):
+    return zipfile.ZipFile(io.BytesIO(b"".join(response.streaming_content)))
+
+
+@pytest.mark.django_db
+def test_api_export_streams_zip_with_workbook_per_calculation(client, calculations):
+    response = client.post("/api/calculations/export/", {"ids": [calc.id for calc in calculations]})
+
+    assert response.status_code == 200
+    assert isinstance(response, StreamingHttpResponse)
+    assert response["Content-Type"] == "application/zip"
+    assert response["Content-Disposition"] == 'attachment; filename="calculations.zip"'
+
+    archive = read_zip(response)
+    assert archive.testzip() is None
+    assert archive.namelist() == [workbook_name(calc) for calc in calculations]
+
+    book = load_workbook(io.BytesIO(archive.read(workbook_name(calculations[1]))))
+    assert book.sheetnames == ["Информация", "Позиции"]
+    rows = list(book["Позиции"].iter_rows(values_only=True))
+    assert rows[0][:5] == ("№", "Наименование", "Цена за ед.", "Количество", "Сумма")
+    assert rows[1][:5] == (1, "Кабель", 2.5, 2, 5.0)
+    assert rows[2][1] == "Розетка"
+
+    empty = load_workbook(io.BytesIO(archive.read(workbook_name(calculations[-1]))))
+    assert empty.sheetnames == ["Информация"]
+
+
+@pytest.mark.django_db
+def test_html_export_streams_zip(client, calculations):
+    response = client.post("/calculations/", {"export_excel": "1", "calc_ids": [calculations[0].id]})
+
+    assert isinstance(response, StreamingHttpResponse)
+    assert read_zip(response).namelist() == [workbook_name(calculations[0])]
+
+
+@pytest.mark.django_db
+def test_stream_emits_each_workbook_separately(calculations):
+    chunks = list(exports.stream_zip(exports.iter_calculation_workbooks(Calculation.objects.all())))
+
+    # По куску на книгу и отдельный кусок с центральным каталогом архива
+    assert len(chunks) == len(calculations) + 1
+    archive = zipfile.ZipFile(io.BytesIO(b"".join(chunks)))
+    assert len(archive.namelist()) == len(calculations)
+
+
+@pytest.mark.django_db
+def test_calculations_are_read_in_chunks(calculations):
+    with CaptureQueriesContext(connection) as ctx:
+        names = [name for name, _ in exports.iter_calculation_workbooks(Calculation.objects.all(), chunk_size=2)]
+
+    assert names == [workbook_name(calc) for calc in calculations]
+    headers = [q for q in ctx.captured_queries if q["sql"].startswith('SELECT "trades_calculation"."id"')]
+    lines = [q for q in ctx.captured_queries if q["sql"].startswith('SELECT "trades_calculationitem"')]
+    # Две пачки: на каждую по запросу позиций
+    assert len(lines) == 2
+    assert len(headers) >= 1
+
+
+@pytest.mark.django_db
+def test_workbook_keeps_sheets_and_formats(calculations):
+    calc = Calculation.objects.select_related("user").prefetch_related("items__item").get(pk=calculations[2].pk)
+    book = load_workbook(io.BytesIO(exports.build_calculation_workbook(exports.calculation_export_data(calc))))
+
+    info = list(book["Информация"].iter_rows(values_only=True))
+    assert info[0] == exports.INFO_COLUMNS
+    assert info[1][:4] == (calc.id, "admin", "Расчёт 2", 10)
+    assert info[1][4:6] == (float(calc.total_price), float(calc.total_price_with_markup))
+
+    sheet = book["Позиции"]
+    assert sheet["A1"].font.b
+    assert sheet["F1"].value == "Сумма с наценкой (10.00%)"
+    assert sheet["C2"].number_format == "#,##0.00 ₽"
+    assert sheet["F2"].value == pytest.approx(7.5 * 1.1)
+    assert sheet.column_dimensions["B"].width == pytest.approx(40, abs=1)
+
+
+@pytest.mark.django_db
+def test_large_selection_builds_workbooks_in_process_pool(client, calculations, settings, monkeypatch):
+    monkeypatch.setattr(exports.os, "cpu_count", lambda: 4)
+    settings.CALCULATION_EXPORT_WORKERS = 2
+    settings.CALCULATION_EXPORT_PARALLEL_MIN = 2
+
+    response = client.post("/api/calculations/export/", {"ids": [calc.id for calc in calculations]})
+
+    archive = read_zip(response)
+    # Книги из пула попадают в архив в исходном порядке
+    assert archive.namelist() == [workbook_name(calc) for calc in calculations]
+    book = load_workbook(io.BytesIO(archive.read(workbook_name(calculations[2]))))
+    assert [row[1] for row in book["Позиции"].iter_rows(min_row=2, values_only=True)] == ["Кабель", "Розетка"]
+    assert 2 in exports._pools
+
+
+@pytest.mark.django_db
+def test_small_selection_builds_workbooks_in_request(calculations, settings, monkeypatch):
+    settings.CALCULATION_EXPORT_WORKERS = 4
+    settings.CALCULATION_EXPORT_PARALLEL_MIN = 10
+
+    def no_pool(workers):
+        raise AssertionError("пул не должен запускаться")
+
+    monkeypatch.setattr(exports, "_get_pool", no_pool)
+    names = [name for name, _ in exports.iter_calculation_workbooks(Calculation.objects.all())]
+
+    assert names == [workbook_name(calc) for calc in calculations]
+
+
+def test_parallel_build_gives_up_on_hung_workbook(settings, monkeypatch):
+    settings.CALCULATION_EXPORT_TIMEOUT = 0.5
+    # Встроенные функции передаются в процессы spawn без импорта Django
+    monkeypatch.setattr(exports, "build_calculation_workbook", time.sleep)
+    monkeypatch.setattr(exports, "workbook_name", str)
+
+    with pytest.raises(TimeoutError):
+        list(exports.build_workbooks_parallel([5], workers=3))
+
+    # Пул с зависшим процессом выведен из работы, его процессы завершены
+    assert 3 not in exports._pools
+    assert not exports._retired_pools and not exports._pool_users
+
+
+def test_retired_pool_stays_alive_while_other_export_uses_it():
+    pool = exports._acquire_pool(4)
+    exports._retire_pool(4, pool)
+
+    assert exports._get_pool(4) is not pool
+    assert pool.submit(sum, [1, 2]).result(timeout=60) == 3
+    exports._release_pool(pool)
+    with pytest.raises(RuntimeError):
+        pool.submit(sum, [1])
+
+
+def test_export_workers_are_capped_by_setting(settings, monkeypatch):
+    monkeypatch.setattr(exports.os, "cpu_count", lambda: 64)
+    settings.CALCULATION_EXPORT_WORKERS = 2
+    assert exports.get_export_workers() == 2
+
+    monkeypatch.setattr(exports.os, "cpu_count", lambda: 1)
+    assert exports.get_export_workers() == 1
+
+
+def test_pool_for_other_worker_count_does_not_stop_running_pool():
+    first = exports._get_pool(2)
+    future = first.submit(sum, [1, 2])
+
+    assert exports._get_pool(3) is not first
+    assert exports._get_pool(2) is first
+    assert future.result(timeout=60) == 3
@@ -0,0 +1,231 @@
+import importlib
+import io
+from decimal import Decimal
+
+import pandas as pd
+import pytest
+from django.core.files.uploadedfile import SimpleUploadedFile, TemporaryUploadedFile
+from django.apps import apps as django_apps
+from django.db import IntegrityError, connection
+from django.test.utils import CaptureQueriesContext
+
+from trades.importers import (
+    ImportFormatError,
+    detect_format,
+    import_items_dataframe,
+    import_items_upload,
+    iter_xlsx_chunks,
+    use_streaming,
+)
+from trades.models import Item, Calculation, CalculationItem
+
+XLSX_CONTENT_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+
+def make_frame(rows):
+    return pd.DataFrame(rows, columns=["Наименование комплектующей", "Цена"])
+
+
+@pytest.mark.django_db
+def test_import_reports_created_updated_skipped_and_errors():
+    Item.objects.create(name="Кабель", price=Decimal("10.00"))
+    Item.objects.create(name="Розетка", price=Decimal("5.00"))
+
+    df = make_frame([
+        ["  Новый товар ", 12.5],
+        ["Кабель", 11],
+        ["Розетка", 5],
+        ["", 3],
+        ["Без цены", None],
+        ["Плохая цена", "abc"],
+        ["Новый товар", 13],
+    ])
+    report = import_items_dataframe(df)
+
+    assert report["created"] == 1
+    # «Кабель» и повтор «Новый товар» в том же файле
+    assert report["updated"] == 2
+    assert report["skipped"] == 1
+    assert report["errors"] == [
+        "Строка 5: отсутствует название или цена",
+        "Строка 6: отсутствует название или цена",
+        "Строка 7: некорректная цена",
+    ]
+    assert Item.objects.get(name="Новый товар").price == Decimal("13.00")
+    assert Item.objects.get(name="Кабель").price == Decimal("11.00")
+
+
+@pytest.mark.django_db
+def test_import_matches_existing_items_case_insensitively():
+    Item.objects.create(name="Cable UTP", price=Decimal("1.00"))
+
+    report = import_items_dataframe(make_frame([["cable utp", 2]]))
+
+    assert report["updated"] == 1
+    assert Item.objects.count() == 1
+    assert Item.objects.get().price == Decimal("2.00")
+
+
+@pytest.mark.django_db
+def test_import_query_count_does_not_grow_with_rows():
+    Item.objects.bulk_create(
+        Item(name=f"Товар {i}", lookup_key=f"товар {i}", price=Decimal("1.00")) for i in range(200)
+    )
+    df = make_frame([[f"Товар {i}", 2] for i in range(400)])
+
+    with CaptureQueriesContext(connection) as ctx:
+        report = import_items_dataframe(df, batch_size=1000)
+
+    assert report["created"] == 200
+    assert report["updated"] == 200
+    # поиск + bulk_create + bulk_update + служебные запросы транзакции
+    assert len(ctx.captured_queries) < 15
+
+
+@pytest.mark.django_db
+def test_import_recalculates_affected_calculations_once_at_the_end():
+    item = Item.objects.create(name="Плата", price=Decimal("10.00"))
+    calc = Calculation.objects.create(title="Расчёт", markup=Decimal("10"))
+    CalculationItem.objects.create(calculation=calc, item=item, quantity=3)
+
+    import_items_dataframe(make_frame([["Плата", 20]]))
+
+    calc.refresh_from_db()
+    assert calc.total_price == Decimal("60.00")
+    assert calc.total_price_with_markup == Decimal("66.00")
+
+
+def test_import_requires_columns():
+    with pytest.raises(ImportFormatError):
+        import_items_dataframe(pd.DataFrame({"Название": ["x"], "Цена": [1]}))
+
+
+def make_xlsx(rows):
+    buffer = io.BytesIO()
+    with pd.ExcelWriter(buffer, engine="xlsxwriter") as writer:
+        make_frame(rows).to_excel(writer, index=False)
+    return buffer.getvalue()
+
+
+def test_xlsx_stream_yields_fixed_size_chunks_with_sheet_row_numbers():
+    content = make_xlsx([[f"Товар {i}", i + 1] for i in range(5)] + [["", 1]])
+
+    chunks = list(iter_xlsx_chunks(io.BytesIO(content), chunk_size=2))
+
+    assert [len(rows) for rows, _ in chunks] == [2, 2, 1]
+    assert chunks[0][0][0] == (2, "Товар 0", Decimal("1.00"))
+    assert chunks[-1][1] == ["Строка 7: отсутствует название или цена"]
+
+
+@pytest.mark.django_db
+def test_streaming_upload_reads_temporary_file_in_place():
+    content = make_xlsx([["Товар 1", 10.5], ["Товар 2", 20]])
+    upload = TemporaryUploadedFile("items.xlsx", XLSX_CONTENT_TYPE, len(content), None)
+    upload.write(content)
+    upload.flush()
+
+    try:
+        report = import_items_upload(upload, streaming=True, batch_size=1)
+    finally:
+        upload.close()
+
+    assert report == {"created": 2, "updated": 0, "skipped": 0, "errors": []}
+    assert Item.objects.get(name="Товар 1").price == Decimal("10.50")
+
+
+@pytest.mark.django_db
+def test_large_xlsx_upload_switches_to_streaming(settings):
+    settings.ITEMS_IMPORT_STREAMING_MIN_SIZE = 1
+    upload = SimpleUploadedFile("items.xlsx", make_xlsx([["Товар", 1]]), content_type=XLSX_CONTENT_TYPE)
+
+    assert use_streaming(upload)
+    assert import_items_upload(upload)["created"] == 1
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("name, content", [
+    ("items.csv", "Наименование комплектующей,Цена\nТовар 1,10.5\nТовар 2,\"20,00\"\n".encode("utf-8-sig")),
+    ("items.csv", "Наименование комплектующей;Цена\nТовар 1;10,5\nТовар 2;20\n".encode("cp1251")),
+    ("items.tsv", "Наименование комплектующей\tЦена\nТовар 1\t10.5\nТовар 2\t20\n".encode("utf-8")),
+    ("upload", "Наименование комплектующей\tЦена\nТовар 1\t10.5\nТовар 2\t20\n".encode("utf-8")),
+])
+def test_text_formats_are_imported_with_same_report(name, content):
+    report = import_items_upload(SimpleUploadedFile(name, content))
+
+    assert report == {"created": 2, "updated": 0, "skipped": 0, "errors": []}
+    assert Item.objects.get(name="Товар 1").price == Decimal("10.50")
+    assert Item.objects.get(name="Товар 2").price == Decimal("20.00")
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("name, content", [
+    ("items.csv", "Наименование комплектующей;Цена\nНоль;0,00\nМинус;-5,10\nТовар;1,50\n".encode("utf-8")),
+    ("items.csv", "Наименование комплектующей,Цена\nНоль,\"0,00\"\nМинус,\"-5,10\"\nТовар,\"1,50\"\n".encode("utf-8")),
+])
+def test_zero_and_negative_prices_are_rejected(name, content):
+    report = import_items_upload(SimpleUploadedFile(name, content))
+
+    assert report["created"] == 1
+    assert report["errors"] == [
+        "Строка 2: отсутствует название или цена",
+        "Строка 3: цена должна быть больше нуля",
+    ]
+    assert list(Item.objects.values_list("name", flat=True)) == ["Товар"]
+
+
+@pytest.mark.django_db
+def test_zero_and_negative_prices_are_rejected_in_xlsx_frame():
+    report = import_items_dataframe(make_frame([["Ноль", 0], ["Минус", -5.1], ["Товар", 1.5]]))
+
+    assert report["created"] == 1
+    assert report["errors"] == [
+        "Строка 2: отсутствует название или цена",
+        "Строка 3: цена должна быть больше нуля",
+    ]
+
+
+def test_csv_without_required_columns_is_rejected():
+    with pytest.raises(ImportFormatError):
+        import_items_upload(SimpleUploadedFile("items.csv", b"name,price\nx,1\n"))
+
+
+@pytest.mark.django_db
+def test_parquet_is_detected_by_magic_bytes():
+    pytest.importorskip("pyarrow")
+    buffer = io.BytesIO()
+    make_frame([["Товар 1", 10.5], ["Товар 2", None]]).to_parquet(buffer, index=False)
+
+    upload = SimpleUploadedFile("export.bin", buffer.getvalue())
+    assert detect_format(upload) == "parquet"
+
+    report = import_items_upload(upload)
+    assert report["created"] == 1
+    assert report["errors"] == ["Строка 3: отсутствует название или цена"]
+
+
+@pytest.mark.django_db
+def test_lookup_key_folds_case_whitespace_and_yo():
+    item = Item.objects.create(name="Ёлка  Большая", price=Decimal("1.00"))
+    assert item.lookup_key == "елка большая"
+
+    report = import_items_dataframe(make_frame([["ЕЛКА большая", 2]]))
+
+    assert report["updated"] == 1
+    assert Item.objects.get().price == Decimal("2.00")
+    with pytest.raises(IntegrityError):
+        Item.objects.create(name="елка большая", price=Decimal("3.00"))
+
+
+@pytest.mark.django_db
+def test_lookup_key_backfill_reports_collisions(capsys):
+    backfill = importlib.import_module("trades.migrations.0010_item_lookup_key").backfill_lookup_keys
+    first = Item.objects.create(name="Кабель", price=Decimal("1.00"))
+    second = Item.objects.create(name="Розетка", price=Decimal("1.00"))
+    Item.objects.filter(pk=second.pk).update(name="КАБЕЛЬ ")
+    Item.objects.update(lookup_key=None)
+
+    collisions = backfill(django_apps, None)
+
+    assert collisions == {"кабель": [first.pk, second.pk]}
+    assert list(Item.objects.order_by("pk").values_list("lookup_key", flat=True)) == ["кабель", None]
+    assert "кабель" in capsys.readouterr().out
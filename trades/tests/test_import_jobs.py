@@ -0,0 +1,150 @@
+import io
+from datetime import timedelta
+from decimal import Decimal
+
+import pandas as pd
+import pytest
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import Client
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from trades.jobs import claim_next_job, run_import_job
+from trades.models import ImportJob, Item
+
+
+@pytest.fixture(autouse=True)
+def media_root(settings, tmp_path):
+    settings.MEDIA_ROOT = tmp_path
+
+
+@pytest.fixture
+def user(db):
+    User = get_user_model()
+    return User.objects.create_user(username="importer", password="pass123")
+
+
+def make_upload(rows, name="items.xlsx"):
+    df = pd.DataFrame(rows, columns=["Наименование комплектующей", "Цена"])
+    buffer = io.BytesIO()
+    with pd.ExcelWriter(buffer, engine="xlsxwriter") as writer:
+        df.to_excel(writer, index=False)
+    return SimpleUploadedFile(name, buffer.getvalue())
+
+
+@pytest.mark.django_db
+def test_background_upload_returns_job_and_worker_reports_progress(user):
+    client = Client()
+    client.force_login(user)
+    Item.objects.create(name="Старый товар", price=Decimal("1.00"))
+
+    response = client.post(
+        "/api/upload-items/?background=1",
+        {"file": make_upload([["Новый товар", 10], ["Старый товар", 2], ["", 5]])},
+    )
+
+    assert response.status_code == 202
+    job_id = response.json()["job_id"]
+    assert ImportJob.objects.get(id=job_id).status == ImportJob.STATUS_PENDING
+    assert not Item.objects.filter(name="Новый товар").exists()
+
+    call_command("run_import_worker", "--once", stdout=io.StringIO())
+
+    api_client = APIClient()
+    api_client.force_authenticate(user=user)
+    data = api_client.get(response.json()["status_url"]).data
+    assert data["status"] == ImportJob.STATUS_DONE
+    assert (data["rows_processed"], data["created"], data["updated"], data["skipped"]) == (3, 1, 1, 0)
+    assert data["errors"] == ["Строка 4: отсутствует название или цена"]
+    assert Item.objects.get(name="Новый товар").price == Decimal("10.00")
+
+
+@pytest.mark.django_db
+def test_large_upload_goes_to_background_by_size(user, settings):
+    settings.ITEMS_IMPORT_BACKGROUND_MIN_SIZE = 1
+    client = Client()
+    client.force_login(user)
+
+    response = client.post("/api/upload-items/", {"file": make_upload([["Товар", 1]])})
+
+    assert response.status_code == 202
+
+
+@pytest.mark.django_db
+def test_job_with_bad_columns_fails_with_message(user, settings):
+    buffer = io.BytesIO()
+    pd.DataFrame({"Название": ["x"]}).to_excel(buffer, index=False)
+    job = ImportJob(created_by=user)
+    job.file.save("bad.xlsx", SimpleUploadedFile("bad.xlsx", buffer.getvalue()))
+
+    call_command("run_import_worker", "--once", stdout=io.StringIO())
+
+    job.refresh_from_db()
+    assert job.status == ImportJob.STATUS_FAILED
+    assert "Наименование комплектующей" in job.error_message
+    # Файл удаляется и после неудачного импорта
+    assert not job.file
+    assert not list(settings.MEDIA_ROOT.rglob("bad*.xlsx"))
+
+
+@pytest.mark.django_db
+def test_claimed_job_is_not_claimed_twice(user):
+    job = ImportJob(created_by=user)
+    job.file.save("items.xlsx", make_upload([["Товар", 1]]))
+
+    assert claim_next_job().pk == job.pk
+    assert claim_next_job() is None
+
+
+@pytest.mark.django_db
+def test_user_cannot_see_foreign_import_job(user):
+    other = get_user_model().objects.create_user(username="other", password="pass123")
+    job = ImportJob(created_by=other)
+    job.file.save("items.xlsx", make_upload([["Товар", 1]]))
+
+    api_client = APIClient()
+    api_client.force_authenticate(user=user)
+    assert api_client.get(f"/api/import-jobs/{job.id}/").status_code == 404
+
+
+@pytest.mark.django_db
+def test_abandoned_running_job_is_claimed_again(user, settings):
+    settings.ITEMS_IMPORT_JOB_TIMEOUT = 60
+    job = ImportJob(created_by=user)
+    job.file.save("items.xlsx", make_upload([["Товар", 1]]))
+    assert claim_next_job().attempts == 1
+    ImportJob.objects.filter(pk=job.pk).update(rows_processed=500)
+
+    # Воркер ещё работает — задачу никто не забирает
+    assert claim_next_job() is None
+
+    # Воркер остановлен посреди импорта: после таймаута задача забирается снова
+    ImportJob.objects.filter(pk=job.pk).update(started_at=timezone.now() - timedelta(minutes=5))
+    reclaimed = claim_next_job()
+    assert (reclaimed.pk, reclaimed.attempts, reclaimed.rows_processed) == (job.pk, 2, 0)
+
+    run_import_job(reclaimed)
+    reclaimed.refresh_from_db()
+    assert reclaimed.status == ImportJob.STATUS_DONE
+    assert Item.objects.filter(name="Товар").exists()
+
+
+@pytest.mark.django_db
+def test_abandoned_job_fails_after_max_attempts(user, settings):
+    settings.ITEMS_IMPORT_JOB_TIMEOUT = 60
+    settings.ITEMS_IMPORT_JOB_MAX_ATTEMPTS = 2
+    job = ImportJob(created_by=user)
+    job.file.save("items.xlsx", make_upload([["Товар", 1]]))
+    ImportJob.objects.filter(pk=job.pk).update(
+        status=ImportJob.STATUS_RUNNING, attempts=2, started_at=timezone.now() - timedelta(minutes=5)
+    )
+
+    assert claim_next_job() is None
+
+    job.refresh_from_db()
+    assert job.status == ImportJob.STATUS_FAILED
+    assert job.error_message
+    assert not job.file
+    assert not list(settings.MEDIA_ROOT.rglob("items*.xlsx"))
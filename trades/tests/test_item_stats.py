@@ -0,0 +1,80 @@
+from decimal import Decimal
+
+import pytest
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+import pandas as pd
+
+from trades.importers import import_items_dataframe
+from trades.models import Item
+from trades.utils import get_item_stats
+
+
+@pytest.fixture
+def items(db):
+    return [
+        Item.objects.create(name="Кабель медный", price=Decimal("10.00")),
+        Item.objects.create(name="Кабель алюминиевый", price=Decimal("30.00")),
+        Item.objects.create(name="Розетка", price=Decimal("5.00")),
+    ]
+
+
+def test_stats_are_aggregated_in_database(items):
+    stats = get_item_stats("кабель")
+
+    assert stats["total_items"] == 2
+    assert stats["total_price"] == Decimal("40.00")
+    assert stats["avg_price"] == Decimal("20")
+    assert stats["min_price"] == Decimal("10.00")
+    assert stats["max_price"] == Decimal("30.00")
+
+
+@pytest.mark.django_db
+def test_stats_for_empty_result():
+    stats = get_item_stats("нет такого")
+
+    assert stats["total_items"] == 0
+    assert stats["total_price"] == 0
+    assert stats["avg_price"] == 0
+
+
+def test_stats_are_cached_until_item_changes(items):
+    get_item_stats()
+    with CaptureQueriesContext(connection) as ctx:
+        assert get_item_stats()["total_items"] == 3
+    assert len(ctx.captured_queries) == 0
+
+    items[2].price = Decimal("7.00")
+    items[2].save()
+    assert get_item_stats()["total_price"] == Decimal("47.00")
+
+    items[2].delete()
+    assert get_item_stats()["total_items"] == 2
+
+
+def test_bulk_import_invalidates_stats(items):
+    assert get_item_stats()["total_items"] == 3
+
+    import_items_dataframe(pd.DataFrame(
+        [["Выключатель", 12]], columns=["Наименование комплектующей", "Цена"]
+    ))
+
+    assert get_item_stats()["total_items"] == 4
+
+
+def test_item_list_reuses_cached_count_for_pagination(items, client):
+    user = get_user_model().objects.create_user(username="u", password="p", is_admin=True)
+    client.force_login(user)
+    url = reverse("item_list")
+    client.get(url)
+
+    with CaptureQueriesContext(connection) as ctx:
+        response = client.get(url, {"page": 2, "page_size": 10})
+    sql = " ".join(q["sql"] for q in ctx.captured_queries)
+
+    assert response.context["total_items"] == 3
+    assert response.context["max_price"] == Decimal("30.00")
+    assert "COUNT(" not in sql and "SUM(" not in sql
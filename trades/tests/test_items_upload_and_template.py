@@ -37,6 +37,18 @@ def test_download_import_template(api_client, admin):
     assert list(df.columns) == ["Наименование комплектующей", "Цена"]
 
 
+@pytest.mark.django_db
+@pytest.mark.parametrize("template_format, separator", [("csv", ","), ("tsv", "\t")])
+def test_download_import_template_text_formats(api_client, admin, template_format, separator):
+    api_client.force_authenticate(user=admin)
+    response = api_client.get("/api/download-template/", {"format": template_format})
+
+    assert response.status_code == 200
+    assert f'import_template.{template_format}' in response["Content-Disposition"]
+    df = pd.read_csv(io.BytesIO(response.content), sep=separator, encoding="utf-8-sig")
+    assert list(df.columns) == ["Наименование комплектующей", "Цена"]
+
+
 @pytest.mark.django_db
 def test_upload_items_api_success(api_client, admin, tmp_path):
     client = Client()
@@ -0,0 +1,128 @@
+from datetime import timedelta
+from decimal import Decimal
+
+import pytest
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from trades.keyset import InvalidCursor, get_ordering, paginate_keyset
+from trades.models import Calculation, Item, PriceHistory
+
+
+@pytest.fixture
+def admin(db):
+    return get_user_model().objects.create_user(
+        username="admin", password="pass123", is_superuser=True, is_admin=True
+    )
+
+
+@pytest.fixture
+def api_client(admin):
+    client = APIClient()
+    client.force_authenticate(user=admin)
+    return client
+
+
+@pytest.fixture
+def history(db):
+    item = Item.objects.create(name="Товар", price=Decimal("1.00"))
+    now = timezone.now()
+    rows = [
+        PriceHistory.objects.create(item=item, old_price=Decimal("1.00"), new_price=Decimal("2.00"))
+        for _ in range(7)
+    ]
+    # Две пары записей с одинаковым временем — курсор должен различать их по id
+    for index, row in enumerate(rows):
+        PriceHistory.objects.filter(pk=row.pk).update(changed_at=now - timedelta(minutes=index // 2))
+    return list(PriceHistory.objects.order_by("-changed_at", "-id"))
+
+
+def test_ordering_gets_pk_tiebreak():
+    ordering = get_ordering(PriceHistory.objects.order_by("-changed_at"))
+    assert [(field.name, desc) for field, desc in ordering] == [("changed_at", True), ("id", True)]
+    assert get_ordering(PriceHistory.objects.order_by("item__name")) is None
+
+
+def test_walks_forward_and_back_without_gaps(history):
+    queryset = PriceHistory.objects.order_by("-changed_at")
+
+    first = paginate_keyset(queryset, None, 3)
+    second = paginate_keyset(queryset, first.next_cursor, 3)
+    third = paginate_keyset(queryset, second.next_cursor, 3)
+
+    assert list(first) + list(second) + list(third) == history
+    assert not first.has_previous() and not third.has_next()
+
+    back = paginate_keyset(queryset, third.previous_cursor, 3)
+    assert list(back) == list(second)
+    assert list(paginate_keyset(queryset, back.previous_cursor, 3)) == list(first)
+
+
+def test_page_query_does_not_use_offset(history):
+    queryset = PriceHistory.objects.order_by("-changed_at")
+    cursor = paginate_keyset(queryset, None, 3).next_cursor
+
+    with CaptureQueriesContext(connection) as ctx:
+        page = paginate_keyset(queryset, cursor, 3)
+
+    assert page.count is None
+    assert len(ctx.captured_queries) == 1
+    assert "OFFSET" not in ctx.captured_queries[0]["sql"]
+
+
+def test_cursor_from_other_ordering_is_rejected(history):
+    cursor = paginate_keyset(PriceHistory.objects.order_by("-changed_at"), None, 3).next_cursor
+
+    with pytest.raises(InvalidCursor):
+        paginate_keyset(PriceHistory.objects.order_by("changed_at"), cursor, 3)
+    with pytest.raises(InvalidCursor):
+        paginate_keyset(PriceHistory.objects.order_by("-changed_at"), "мусор", 3)
+
+
+def test_api_cursor_mode(api_client, history):
+    response = api_client.get("/api/price-history/", {"cursor": "", "page_size": 4, "count": "off"})
+
+    assert response.status_code == 200
+    assert response.data["count"] is None
+    assert [row["id"] for row in response.data["results"]] == [row.id for row in history[:4]]
+
+    response = api_client.get(response.data["next"])
+    assert [row["id"] for row in response.data["results"]] == [row.id for row in history[4:]]
+    assert response.data["next"] is None
+    assert "cursor=" in response.data["previous"]
+
+    assert api_client.get("/api/price-history/", {"cursor": "abc"}).status_code == 404
+
+
+def test_api_page_numbers_remain_default(api_client, history):
+    response = api_client.get("/api/price-history/", {"page_size": 4, "page": 2})
+
+    assert response.data["count"] == 7
+    assert "cursor" not in response.data["previous"]
+    assert response.data["next"] is None
+
+
+def test_api_cursor_respects_ordering_param(api_client, admin):
+    for title, total in [("A", "3.00"), ("B", "1.00"), ("C", "2.00")]:
+        Calculation.objects.create(title=title, user=admin, total_price=Decimal(total))
+
+    response = api_client.get("/api/calculations/", {"cursor": "", "ordering": "total_price", "page_size": 2})
+    titles = [row["title"] for row in response.data["results"]]
+    titles += [row["title"] for row in api_client.get(response.data["next"]).data["results"]]
+
+    assert titles == ["B", "C", "A"]
+    assert response.data["count"] == 3
+
+
+def test_price_history_page_uses_cursor_links(client, admin, history):
+    client.force_login(admin)
+
+    response = client.get(reverse("price_history"), {"page_size": 10})
+
+    assert response.status_code == 200
+    assert response.context["page_obj"].is_keyset
+    assert "cursor=None" not in response.content.decode()
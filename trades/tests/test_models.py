@@ -126,4 +126,17 @@ class CalculationTests(TestCase):
     @pytest.mark.skip(reason="Валидация отрицательной цены и количества выполняется на уровне форм/DRF, а не при прямом save() модели")
     def test_validation(self):
         """Проверка валидации цен и количества (устаревший тест, пропущен)."""
-        pass
\ No newline at end of file
+        pass
+    def test_concurrent_saves_bump_revision_in_database(self):
+        """Два сохранения одной строки из разных копий дают две разные ревизии."""
+        calc = Calculation.objects.create(title='Ревизия', user=self.user)
+        first = Calculation.objects.get(pk=calc.pk)
+        second = Calculation.objects.get(pk=calc.pk)
+
+        first.title = 'Первый'
+        first.save()
+        second.markup = Decimal('5')
+        second.save(update_fields=['markup'])
+
+        self.assertEqual((first.revision, second.revision), (calc.revision + 1, calc.revision + 2))
+        self.assertEqual(Calculation.objects.get(pk=calc.pk).revision, calc.revision + 2)
@@ -0,0 +1,119 @@
+import io
+from decimal import Decimal
+
+import pytest
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from trades import caching
+from trades.models import Item, Calculation, CalculationItem
+
+
+@pytest.fixture
+def admin(db):
+    User = get_user_model()
+    return User.objects.create_user(username="admin", password="pass123", is_superuser=True, is_admin=True)
+
+
+@pytest.fixture
+def api_client(admin):
+    client = APIClient()
+    client.force_authenticate(user=admin)
+    return client
+
+
+@pytest.fixture
+def calculation(admin):
+    item = Item.objects.create(name="Кабель", price=Decimal("2.50"))
+    calc = Calculation.objects.create(title="Склад", markup=Decimal("10"), user=admin)
+    CalculationItem.objects.create(calculation=calc, item=item, quantity=4)
+    return calc
+
+
+def selects_from(ctx, table):
+    return [q for q in ctx.captured_queries if q["sql"].startswith(f'SELECT "{table}"')]
+
+
+@pytest.mark.django_db
+def test_api_detail_is_served_from_cache_until_revision_changes(api_client, calculation):
+    url = f"/api/calculations/{calculation.id}/"
+    first = api_client.get(url)
+
+    with CaptureQueriesContext(connection) as ctx:
+        second = api_client.get(url)
+    assert second.data == first.data
+    assert not selects_from(ctx, "trades_calculationitem")
+    assert caching.get_stats()["api.calculations.retrieve"] == (1, 1)
+
+    item = Item.objects.get()
+    item.price = Decimal("3.00")
+    item.save()
+    third = api_client.get(url)
+    assert third.data["total_price"] == "12.00"
+    assert third.data["items"][0]["item_price"] == "3.00"
+
+
+@pytest.mark.django_db
+def test_api_list_cache_follows_writes_and_deletes(api_client, calculation):
+    api_client.get("/api/calculations/")
+    with CaptureQueriesContext(connection) as ctx:
+        cached = api_client.get("/api/calculations/")
+    assert cached.data["count"] == 1
+    assert not selects_from(ctx, "trades_calculation")
+
+    api_client.patch(f"/api/calculations/{calculation.id}/", {"title": "Переименован"}, format="json")
+    assert api_client.get("/api/calculations/").data["results"][0]["title"] == "Переименован"
+
+    Calculation.objects.create(title="Второй", user=calculation.user)
+    calculation.delete()
+    assert [row["title"] for row in api_client.get("/api/calculations/").data["results"]] == ["Второй"]
+    hits, misses = caching.get_stats()["api.calculations.list"]
+    assert (hits, misses) == (1, 3)
+
+
+@pytest.mark.django_db
+def test_html_list_page_is_cached_and_tracks_user_rename(admin, calculation):
+    client = Client()
+    client.force_login(admin)
+    client.get("/calculations/")
+
+    with CaptureQueriesContext(connection) as ctx:
+        response = client.get("/calculations/")
+    assert [calc.title for calc in response.context["page_obj"]] == ["Склад"]
+    assert not selects_from(ctx, "trades_calculation")
+
+    admin.username = "boss"
+    admin.save()
+    response = client.get("/calculations/")
+    assert response.context["page_obj"][0].user.username == "boss"
+    assert caching.get_stats()["html.calculations_list"] == (1, 2)
+
+
+@pytest.mark.django_db
+def test_html_list_cache_key_separates_relevance_and_title_order(admin):
+    Calculation.objects.create(title="a foo", user=admin)
+    Calculation.objects.create(title="zfoo", user=admin)
+    client = Client()
+    client.force_login(admin)
+
+    relevance = client.get("/calculations/", {"search": "foo"})
+    by_title = client.get("/calculations/", {"search": "foo", "sort": "title"})
+
+    assert [calc.title for calc in relevance.context["page_obj"]] == ["zfoo", "a foo"]
+    assert [calc.title for calc in by_title.context["page_obj"]] == ["a foo", "zfoo"]
+
+
+@pytest.mark.django_db
+def test_cache_stats_command(api_client, calculation):
+    api_client.get("/api/calculations/")
+    api_client.get("/api/calculations/")
+
+    out = io.StringIO()
+    call_command("cache_stats", "--reset", stdout=out)
+
+    assert "api.calculations.list: попаданий 1, промахов 1, доля попаданий 50.0%" in out.getvalue()
+    assert caching.get_stats()["api.calculations.list"] == (0, 0)
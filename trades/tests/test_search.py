@@ -0,0 +1,103 @@
+from decimal import Decimal
+
+import pytest
+from django.contrib.auth import get_user_model
+from django.db import connection
+from rest_framework.test import APIClient
+
+from trades.models import Item, Calculation, PriceHistory
+from trades.search import fts_available, get_search_backend, search, search_ordered
+
+
+@pytest.fixture
+def admin_client(db):
+    User = get_user_model()
+    user = User.objects.create_user(username="admin", password="pass123", is_superuser=True, is_admin=True)
+    client = APIClient()
+    client.force_authenticate(user=user)
+    return client
+
+
+def names(queryset):
+    return [obj.name for obj in queryset]
+
+
+@pytest.mark.django_db
+def test_sqlite_uses_fts_table_created_after_migrate():
+    assert connection.vendor == "sqlite"
+    assert type(get_search_backend()).__name__ == "SQLiteFTS5SearchBackend"
+    assert fts_available(Item)
+    assert fts_available(Calculation)
+
+
+@pytest.mark.django_db
+def test_search_is_case_insensitive_substring_for_cyrillic():
+    Item.objects.create(name="Кабель ВВГнг 3x2.5", price=Decimal("1.00"))
+    Item.objects.create(name="Розетка двойная", price=Decimal("1.00"))
+
+    assert names(search(Item.objects.all(), "КАБЕЛ")) == ["Кабель ВВГнг 3x2.5"]
+    assert names(search(Item.objects.all(), "ввгНГ")) == ["Кабель ВВГнг 3x2.5"]
+    # Слова короче трёх символов ищутся через icontains
+    assert names(search(Item.objects.all(), "кабель 3x")) == ["Кабель ВВГнг 3x2.5"]
+    # Все слова запроса должны встретиться в названии
+    assert names(search(Item.objects.all(), "кабель двойная")) == []
+
+
+@pytest.mark.django_db
+def test_search_ranks_closer_matches_first():
+    Item.objects.create(name="Держатель кабеля настенный с креплением", price=Decimal("1.00"))
+    Item.objects.create(name="Кабель", price=Decimal("1.00"))
+
+    result = search_ordered(Item.objects.all(), "кабел", "name")
+
+    assert names(result) == ["Кабель", "Держатель кабеля настенный с креплением"]
+    assert all(obj.search_rank is not None for obj in result)
+
+
+@pytest.mark.django_db
+def test_fts_index_follows_updates_and_deletes():
+    item = Item.objects.create(name="Автомат", price=Decimal("1.00"))
+    item.name = "Выключатель"
+    item.save()
+
+    assert names(search(Item.objects.all(), "автомат")) == []
+    assert names(search(Item.objects.all(), "выключат")) == ["Выключатель"]
+
+    item.delete()
+    assert names(search(Item.objects.all(), "выключат")) == []
+
+
+@pytest.mark.django_db
+def test_api_search_is_ranked_unless_ordering_given(admin_client):
+    Item.objects.create(name="Держатель кабеля", price=Decimal("1.00"))
+    Item.objects.create(name="Кабель", price=Decimal("2.00"))
+    Item.objects.create(name="Розетка", price=Decimal("3.00"))
+
+    response = admin_client.get("/api/items/", {"search": "кабел"})
+    assert [row["name"] for row in response.data["results"]] == ["Кабель", "Держатель кабеля"]
+
+    response = admin_client.get("/api/items/", {"search": "кабел", "ordering": "price"})
+    assert [row["name"] for row in response.data["results"]] == ["Держатель кабеля", "Кабель"]
+
+
+@pytest.mark.django_db
+def test_api_search_over_related_field(admin_client):
+    item = Item.objects.create(name="Щиток", price=Decimal("1.00"))
+    other = Item.objects.create(name="Лампа", price=Decimal("1.00"))
+    PriceHistory.objects.create(item=item, old_price=Decimal("1.00"), new_price=Decimal("2.00"))
+    PriceHistory.objects.create(item=other, old_price=Decimal("1.00"), new_price=Decimal("2.00"))
+
+    response = admin_client.get("/api/price-history/", {"search": "щит"})
+
+    assert response.status_code == 200
+    assert response.data["count"] == 1
+
+
+@pytest.mark.django_db
+def test_calculations_api_search_by_title(admin_client):
+    Calculation.objects.create(title="Офис на Ленина")
+    Calculation.objects.create(title="Склад")
+
+    response = admin_client.get("/api/calculations/", {"search": "ленин"})
+
+    assert [row["title"] for row in response.data["results"]] == ["Офис на Ленина"]
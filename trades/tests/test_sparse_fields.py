@@ -0,0 +1,90 @@
+from decimal import Decimal
+
+import pytest
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from trades.models import Item, Calculation, CalculationItem, CalculationSnapshot, CalculationSnapshotItem, PriceHistory
+
+
+@pytest.fixture
+def admin_client(db):
+    User = get_user_model()
+    user = User.objects.create_user(username="admin", password="pass123", is_superuser=True, is_admin=True)
+    client = APIClient()
+    client.force_authenticate(user=user)
+    return client
+
+
+@pytest.fixture
+def calculation(admin_client):
+    item = Item.objects.create(name="Кабель", price=Decimal("2.50"))
+    calc = Calculation.objects.create(title="Склад", markup=Decimal("10"))
+    CalculationItem.objects.create(calculation=calc, item=item, quantity=4)
+    return calc
+
+
+def page_query(ctx, table):
+    return [q["sql"] for q in ctx.captured_queries if q["sql"].startswith("SELECT") and f'FROM "{table}"' in q["sql"]][-1]
+
+
+@pytest.mark.django_db
+def test_fields_limit_response_and_selected_columns(admin_client, calculation):
+    with CaptureQueriesContext(connection) as ctx:
+        response = admin_client.get("/api/calculations/", {"fields": "id,title,total_price"})
+
+    assert response.data["results"] == [{"id": calculation.id, "title": "Склад", "total_price": "10.00"}]
+    sql = page_query(ctx, "trades_calculation")
+    assert '"markup"' not in sql
+    assert "JOIN" not in sql
+    assert not any(q["sql"].startswith('SELECT "trades_calculationitem"') for q in ctx.captured_queries)
+
+
+@pytest.mark.django_db
+def test_expand_items_prefetches_only_needed_columns(admin_client, calculation):
+    with CaptureQueriesContext(connection) as ctx:
+        response = admin_client.get("/api/calculations/", {"expand": "items"})
+
+    row = response.data["results"][0]
+    assert row["items"][0]["item_name"] == "Кабель"
+    assert row["items"][0]["total_price"] == Decimal("10.00")
+    lines = [q["sql"] for q in ctx.captured_queries if q["sql"].startswith('SELECT "trades_calculationitem"')]
+    assert len(lines) == 1 and 'INNER JOIN "trades_item"' in lines[0]
+    assert '"trades_calculationitem"."calculation_id"' in lines[0]
+
+    detail = admin_client.get(f"/api/calculations/{calculation.id}/", {"fields": "id,items_count"})
+    assert detail.data == {"id": calculation.id, "items_count": 1}
+
+
+@pytest.mark.django_db
+def test_price_history_and_snapshots_drop_unused_relations(admin_client, calculation):
+    item = Item.objects.get()
+    history = PriceHistory.objects.create(item=item, old_price=Decimal("2.00"), new_price=Decimal("2.50"))
+    snapshot = CalculationSnapshot.objects.create(
+        calculation=calculation, frozen_total_price=Decimal("10.00"), frozen_total_price_with_markup=Decimal("11.00")
+    )
+    CalculationSnapshotItem.objects.create(
+        snapshot=snapshot, item_name="Кабель", item_price=Decimal("2.50"), quantity=4, total_price=Decimal("10.00")
+    )
+
+    with CaptureQueriesContext(connection) as ctx:
+        response = admin_client.get("/api/price-history/", {"fields": "id,new_price"})
+    assert response.data["results"][0] == {"id": history.id, "new_price": "2.50"}
+    assert "JOIN" not in page_query(ctx, "trades_pricehistory")
+
+    response = admin_client.get("/api/snapshots/")
+    assert len(response.data["results"][0]["items"]) == 1
+    with CaptureQueriesContext(connection) as ctx:
+        response = admin_client.get("/api/snapshots/", {"fields": "id,calculation_title"})
+    assert response.data["results"][0] == {"id": snapshot.id, "calculation_title": "Склад"}
+    assert not any('FROM "trades_calculationsnapshotitem"' in q["sql"] for q in ctx.captured_queries)
+
+
+@pytest.mark.django_db
+def test_fields_do_not_affect_writes(admin_client):
+    response = admin_client.post("/api/items/?fields=id", {"name": "Новый", "price": "1.00"}, format="json")
+
+    assert response.status_code == 201
+    assert response.data["name"] == "Новый"
@@ -0,0 +1,221 @@
+import io
+import random
+from decimal import Decimal
+
+import pytest
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from trades.models import Calculation, CalculationItem, Item, recalculate_calculation_totals, sweep_stale_totals
+from trades.serializers import CalculationSerializer
+from trades.utils import calculate_total_price
+
+
+@pytest.mark.django_db
+def test_set_based_totals_match_python_rounding():
+    rng = random.Random(42)
+    items = [
+        Item.objects.create(name=f"Товар {i}", price=Decimal(rng.randint(1, 500000)) / 100)
+        for i in range(20)
+    ]
+    markups = [Decimal("0"), Decimal("12.5"), Decimal("33.33"), Decimal("7.77"), Decimal("-5.55"), Decimal("0.05")]
+    calculations = []
+    for index in range(30):
+        calc = Calculation.objects.create(title=f"Расчёт {index}", markup=rng.choice(markups))
+        for item in rng.sample(items, 5):
+            CalculationItem(calculation=calc, item=item, quantity=rng.randint(1, 40)).save(update_calculation=False)
+        calculations.append(calc)
+    Calculation.objects.create(title="Пустой", markup=Decimal("10"))
+
+    recalculate_calculation_totals(Calculation.objects.all())
+
+    for calc in Calculation.objects.all():
+        assert (calc.total_price, calc.total_price_with_markup) == calculate_total_price(calc)
+    assert Calculation.objects.get(title="Пустой").total_price == Decimal("0")
+
+
+@pytest.mark.django_db
+def test_half_cent_is_rounded_up():
+    item = Item.objects.create(name="Винт", price=Decimal("0.05"))
+    calc = Calculation.objects.create(title="Расчёт", markup=Decimal("10"))
+    CalculationItem.objects.create(calculation=calc, item=item, quantity=1)
+
+    calc.refresh_from_db()
+    # 0.05 × 1.10 = 0.055
+    assert calc.total_price_with_markup == Decimal("0.06")
+    assert calculate_total_price(calc) == (Decimal("0.05"), Decimal("0.06"))
+
+
+@pytest.mark.django_db
+def test_price_change_updates_all_calculations_in_constant_queries():
+    item = Item.objects.create(name="Популярная деталь", price=Decimal("10.00"))
+    other = Item.objects.create(name="Прочее", price=Decimal("1.50"))
+    calculations = Calculation.objects.bulk_create(
+        Calculation(title=f"Расчёт {i}", markup=Decimal("20")) for i in range(50)
+    )
+    CalculationItem.objects.bulk_create(
+        line
+        for calc in calculations
+        for line in (
+            CalculationItem(calculation=calc, item=item, quantity=2),
+            CalculationItem(calculation=calc, item=other, quantity=3),
+        )
+    )
+    untouched = Calculation.objects.create(title="Без детали", total_price=Decimal("1.00"))
+
+    item.price = Decimal("12.35")
+    with CaptureQueriesContext(connection) as ctx:
+        item.save()
+
+    updates = [q for q in ctx.captured_queries if q["sql"].startswith('UPDATE "trades_calculation"')]
+    assert len(updates) == 1
+    assert len(ctx.captured_queries) <= 3
+    assert set(Calculation.objects.exclude(pk=untouched.pk).values_list("total_price", "total_price_with_markup")) == {
+        (Decimal("29.20"), Decimal("35.04"))
+    }
+    untouched.refresh_from_db()
+    assert untouched.total_price == Decimal("1.00")
+
+
+@pytest.fixture
+def lazy_totals(settings):
+    settings.CALCULATION_TOTALS_MODE = "lazy"
+
+
+@pytest.fixture
+def stale_calculation(lazy_totals):
+    item = Item.objects.create(name="Деталь", price=Decimal("10.00"))
+    calc = Calculation.objects.create(title="Расчёт", markup=Decimal("10"))
+    CalculationItem.objects.create(calculation=calc, item=item, quantity=2)
+    item.price = Decimal("20.00")
+    item.save()
+    return calc
+
+
+@pytest.mark.django_db
+def test_lazy_mode_only_marks_calculations_stale(stale_calculation):
+    stale_calculation.refresh_from_db()
+
+    assert stale_calculation.totals_stale
+    assert stale_calculation.total_price == Decimal("20.00")
+
+
+@pytest.mark.django_db
+def test_api_snapshot_of_stale_calculation_freezes_fresh_totals(stale_calculation):
+    admin = get_user_model().objects.create_user(username="snap", password="pass123", is_superuser=True, is_admin=True)
+    client = APIClient()
+    client.force_authenticate(user=admin)
+
+    response = client.post(f"/api/calculations/{stale_calculation.pk}/save_snapshot/")
+
+    assert response.status_code == 201
+    assert response.data["frozen_total_price"] == "40.00"
+    assert response.data["frozen_total_price_with_markup"] == "44.00"
+    assert sum(Decimal(line["total_price"]) for line in response.data["items"]) == Decimal("40.00")
+
+
+@pytest.mark.django_db
+def test_stale_totals_are_recomputed_on_first_read(stale_calculation):
+    data = CalculationSerializer(Calculation.objects.get(pk=stale_calculation.pk)).data
+
+    assert data["total_price"] == "40.00"
+    assert data["total_price_with_markup"] == "44.00"
+    stale_calculation.refresh_from_db()
+    assert not stale_calculation.totals_stale
+
+
+@pytest.mark.django_db
+def test_api_list_refreshes_before_ordering_by_total(stale_calculation):
+    cheap = Calculation.objects.create(title="Дешёвый", total_price=Decimal("30.00"))
+    client = APIClient()
+    client.force_authenticate(get_user_model().objects.create_user(username="a", password="p", is_admin=True))
+
+    response = client.get("/api/calculations/", {"ordering": "-total_price"})
+
+    assert [row["id"] for row in response.data["results"]] == [stale_calculation.pk, cheap.pk]
+
+
+@pytest.mark.django_db
+def test_sweeper_recomputes_in_batches(stale_calculation):
+    other = Calculation.objects.create(title="Другой")
+    Calculation.objects.filter(pk=other.pk).update(totals_stale=True, total_price=Decimal("5.00"))
+
+    assert sweep_stale_totals(batch_size=1, max_batches=1) == 1
+    call_command("sweep_stale_totals", stdout=io.StringIO())
+
+    assert not Calculation.objects.filter(totals_stale=True).exists()
+    assert Calculation.objects.get(pk=other.pk).total_price == Decimal("0")
+    assert Calculation.objects.get(pk=stale_calculation.pk).total_price_with_markup == Decimal("44.00")
+
+
+@pytest.mark.django_db
+def test_line_mutations_maintain_items_count_and_revision():
+    from trades.models import create_calculation_with_items
+
+    items = [Item.objects.create(name=f"Счётчик {i}", price=Decimal("1.00")) for i in range(4)]
+    calc = create_calculation_with_items(user=None, title="Счётчики", markup=0, lines=[(items[0], 1), (items[1], 2)])
+    assert calc.items_count == 2
+
+    def state():
+        fresh = Calculation.objects.get(pk=calc.pk)
+        return fresh.items_count, fresh.revision
+
+    revisions = [state()[1]]
+
+    def changed(expected_count):
+        count, revision = state()
+        assert count == expected_count
+        assert revision > revisions[-1]
+        revisions.append(revision)
+
+    calc.title = "Переименован"
+    calc.save(update_fields=["title"])
+    changed(2)
+    CalculationItem.objects.create(calculation=calc, item=items[2], quantity=1)
+    changed(3)
+    with calc.batch_edit() as batch:
+        batch.remove(items[0].id)
+        batch.remove(items[1].id)
+    changed(1)
+    line = calc.add_line(items[3], 2)
+    changed(2)
+    calc.set_line_quantity(line.pk, 5)
+    changed(2)
+    calc.remove_line(line.pk)
+    changed(1)
+    items[2].price = Decimal("3.00")
+    items[2].save()
+    changed(1)
+    items[2].delete()
+    changed(0)
+    assert Calculation.objects.get(pk=calc.pk).total_price == Decimal("0")
+
+    copy = calc.copy(user=None)
+    assert copy.items_count == 0
+
+
+@pytest.mark.django_db
+def test_repair_calculation_counters_command():
+    item = Item.objects.create(name="Дрейф", price=Decimal("1.00"))
+    calc = Calculation.objects.create(title="Дрейф")
+    CalculationItem.objects.create(calculation=calc, item=item, quantity=1)
+    # Расхождение, как после записи в обход модели
+    Calculation.objects.filter(pk=calc.pk).update(items_count=0)
+    calc.refresh_from_db()
+
+    out = io.StringIO()
+    call_command("repair_calculation_counters", "--dry-run", stdout=out)
+    assert f"расчёт {calc.pk}: items_count=0, позиций=1" in out.getvalue()
+    assert Calculation.objects.get(pk=calc.pk).items_count == 0
+
+    call_command("repair_calculation_counters", stdout=io.StringIO())
+    calc_after = Calculation.objects.get(pk=calc.pk)
+    assert calc_after.items_count == 1
+    assert calc_after.revision > calc.revision
+
+    out = io.StringIO()
+    call_command("repair_calculation_counters", stdout=out)
+    assert "Расхождений нет" in out.getvalue()
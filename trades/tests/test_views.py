@@ -4,7 +4,8 @@ from django.contrib.auth import get_user_model
 from django.test import TestCase
 from django.urls import reverse
 
-from trades.models import Item, Calculation, CalculationItem
+from trades.forms import ItemForm
+from trades.models import Item, Calculation, CalculationItem, PriceHistory
 
 
 User = get_user_model()
@@ -40,6 +41,15 @@ class ItemListViewTests(BaseViewTestCase):
         self.assertContains(response, "Apple Turbo Fan")
         self.assertNotContains(response, "Banana Board")
 
+    def test_search_orders_by_relevance_by_default(self):
+        Item.objects.create(name="Board", price=Decimal("5.00"))
+        response = self.client.get(reverse("item_list"), {"search": "board"})
+        self.assertEqual(response.context["sort_by"], "relevance")
+        self.assertEqual([item.name for item in response.context["items"]], ["Board", "Banana Board"])
+
+        response = self.client.get(reverse("item_list"), {"search": "board", "sort": "price", "direction": "desc"})
+        self.assertEqual([item.name for item in response.context["items"]], ["Banana Board", "Board"])
+
     def test_ajax_request_returns_partial(self):
         response = self.client.get(
             reverse("item_list"),
@@ -107,3 +117,125 @@ class CalculationDetailSearchTests(BaseViewTestCase):
         self.assertContains(response, "Rotor 2000")
         self.assertNotContains(response, "Rotor 1000")
 
+    def test_save_calculation_updates_lines_in_batch(self):
+        url = reverse("calculation_detail", args=[self.calc.id])
+        response = self.client.post(url, {
+            "save_calculation": "1",
+            "title": "Demo Calc",
+            "markup": "20",
+            "items": [str(self.item_two.id), "999999"],
+            f"quantity_{self.item_two.id}": "2",
+        })
+
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(
+            list(self.calc.items.values_list("item_id", "quantity")), [(self.item_two.id, 2)]
+        )
+        self.calc.refresh_from_db()
+        self.assertEqual(self.calc.total_price, Decimal("50.00"))
+        self.assertEqual(self.calc.total_price_with_markup, Decimal("60.00"))
+
+
+class CreateCalculationPostTests(BaseViewTestCase):
+    def test_create_with_snapshot_and_missing_items(self):
+        alpha = Item.objects.create(name="Alpha", price=Decimal("10.00"))
+        bravo = Item.objects.create(name="Bravo", price=Decimal("5.00"))
+
+        response = self.client.post(reverse("create_calculation"), {
+            "title": "New",
+            "markup": "10",
+            "items": [str(alpha.id), "999998", str(bravo.id), "999999"],
+            f"quantity_{alpha.id}": "2",
+            f"quantity_{bravo.id}": "3",
+        }, follow=True)
+
+        calc = Calculation.objects.get(title="New")
+        self.assertEqual(calc.total_price, Decimal("35.00"))
+        self.assertEqual(calc.total_price_with_markup, Decimal("38.50"))
+        snapshot = calc.snapshots.get()
+        self.assertEqual(snapshot.frozen_total_price, Decimal("35.00"))
+        self.assertEqual(snapshot.items.count(), 2)
+        messages = [str(message) for message in response.context["messages"]]
+        self.assertIn("Товары не найдены (id): 999998, 999999", messages)
+
+
+class CopyCalculationViewTests(BaseViewTestCase):
+    def test_copy_requires_post_and_opens_copy(self):
+        item = Item.objects.create(name="Rotor 3000", price=Decimal("12.00"))
+        calc = Calculation.objects.create(title="Source", user=self.user, markup=Decimal("0"))
+        CalculationItem.objects.create(calculation=calc, item=item, quantity=3)
+        url = reverse("copy_calculation", args=[calc.id])
+
+        self.assertEqual(self.client.get(url).status_code, 405)
+
+        response = self.client.post(url)
+        copy = Calculation.objects.exclude(pk=calc.pk).get()
+        self.assertRedirects(response, reverse("calculation_detail", args=[copy.id]))
+        self.assertEqual(copy.title, "Source (копия)")
+        self.assertEqual(copy.user, self.admin)
+        self.assertEqual(copy.total_price, Decimal("36.00"))
+        self.assertEqual(list(copy.items.values_list("item_id", "quantity")), [(item.id, 3)])
+
+
+class CalculationsListSortTests(BaseViewTestCase):
+    def test_title_sort_uses_collation_key_in_database(self):
+        titles = ["яблоко", "Ёлка", "арбуз", "Банан", "ель", "Zebra", "apple"]
+        for title in titles:
+            Calculation.objects.create(title=title, user=self.admin)
+        renamed = Calculation.objects.get(title="ель")
+        renamed.title = "Вишня"
+        renamed.save(update_fields=["title"])
+
+        response = self.client.get(reverse("calculations_list"), {"sort": "title", "page_size": 100})
+        self.assertEqual(
+            [calc.title for calc in response.context["page_obj"]],
+            ["apple", "Zebra", "арбуз", "Банан", "Вишня", "Ёлка", "яблоко"],
+        )
+        self.assertIn("ORDER BY", str(response.context["page_obj"].paginator.object_list.query))
+
+        response = self.client.get(reverse("calculations_list"), {"sort": "title", "direction": "desc"})
+        self.assertEqual(response.context["page_obj"][0].title, "яблоко")
+
+
+class ItemEditDuplicateTests(BaseViewTestCase):
+    def setUp(self):
+        super().setUp()
+        self.cable = Item.objects.create(name="Кабель", price=Decimal("10.00"))
+        self.socket = Item.objects.create(name="Розетка", price=Decimal("20.00"))
+        # Старый дубль, оставленный миграцией 0010 без lookup_key
+        self.legacy = Item.objects.create(name="Лампа", price=Decimal("5.00"))
+        Item.objects.filter(pk=self.legacy.pk).update(name="КАБЕЛЬ ", lookup_key=None)
+
+    def test_price_edit_of_legacy_duplicate_keeps_null_key(self):
+        response = self.client.post(
+            reverse("edit_item", args=[self.legacy.pk]), {"name": "КАБЕЛЬ ", "price": "7.00"}
+        )
+
+        self.assertRedirects(response, reverse("item_list"), fetch_redirect_response=False)
+        self.legacy.refresh_from_db()
+        self.assertEqual(self.legacy.price, Decimal("7.00"))
+        self.assertIsNone(self.legacy.lookup_key)
+
+    def test_rename_to_case_variant_returns_error_without_history(self):
+        response = self.client.post(
+            reverse("edit_item_ajax"),
+            {"edit_item": self.socket.pk, f"name_{self.socket.pk}": "кабель", f"price_{self.socket.pk}": "25.00"},
+            HTTP_X_REQUESTED_WITH="XMLHttpRequest",
+        )
+
+        self.assertEqual(response.json(), {"success": False, "error": "Товар с таким названием уже существует."})
+        self.socket.refresh_from_db()
+        self.assertEqual((self.socket.name, self.socket.price), ("Розетка", Decimal("20.00")))
+        self.assertFalse(PriceHistory.objects.exists())
+
+    def test_edit_page_shows_error_for_taken_name(self):
+        response = self.client.post(reverse("edit_item", args=[self.socket.pk]), {"name": "Кабёль", "price": "20"})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Товар с таким названием уже существует.")
+
+    def test_item_form_checks_lookup_key(self):
+        form = ItemForm(data={"name": "  кабель ", "price": "1"}, instance=self.socket)
+        self.assertFalse(form.is_valid())
+        self.assertIn("name", form.errors)
+        self.assertTrue(ItemForm(data={"name": "розетка", "price": "1"}, instance=self.socket).is_valid())
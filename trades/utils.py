@@ -1,5 +1,10 @@
-from decimal import Decimal
-from django.core.paginator import Paginator
+from decimal import ROUND_HALF_UP, Decimal
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Page, Paginator
+from django.db.models import Avg, Count, Max, Min, Sum
 
 
 def normalize_item_name(name: str) -> str:
@@ -7,6 +12,59 @@ def normalize_item_name(name: str) -> str:
     return name.strip()
 
 
+def make_item_lookup_key(name: str) -> str:
+    """
+    Ключ поиска товара: без учёта регистра, лишних пробелов и различия ё/е.
+    Хранится в Item.lookup_key (уникальный индекс).
+    """
+    return " ".join(str(name).casefold().replace("ё", "е").split())[:255]
+
+
+ITEM_NAME_TAKEN_MESSAGE = "Товар с таким названием уже существует."
+
+
+def item_name_taken(name: str, instance=None) -> bool:
+    """
+    Занято ли название другим товаром: то же название или тот же lookup_key
+    (регистр, пробелы, ё/е). instance — редактируемый товар. Ключ, совпадающий
+    с ключом его текущего названия, не проверяется: у старых дублей
+    (lookup_key=NULL) он занят оригиналом, а правка цены или регистра допустима.
+    """
+    from django.db.models import Q
+
+    from .models import Item
+
+    key = make_item_lookup_key(name)
+    lookups = Q(name=name)
+    editing = instance is not None and instance.pk is not None
+    if not editing or key != make_item_lookup_key(instance.name):
+        lookups |= Q(lookup_key=key)
+    duplicates = Item.objects.filter(lookups)
+    if editing:
+        duplicates = duplicates.exclude(pk=instance.pk)
+    return duplicates.exists()
+
+
+TITLE_SORT_KEY_LENGTH = 512
+
+
+@lru_cache(maxsize=None)
+def _collator():
+    from pyuca import Collator
+
+    return Collator()
+
+
+def make_title_sort_key(title: str) -> str:
+    """
+    Ключ сортировки названия по Unicode Collation Algorithm (pyuca): каждый вес —
+    4 hex-цифры, поэтому строки сравниваются в БД так же, как кортежи sort_key.
+    Хранится в Calculation.title_sort_key (обрезается до TITLE_SORT_KEY_LENGTH).
+    """
+    key = "".join(f"{weight:04x}" for weight in _collator().sort_key(str(title)))
+    return key[:TITLE_SORT_KEY_LENGTH]
+
+
 def update_or_create_item_clean(name: str, price):
     """
     Возвращает кортеж (item, created, updated).
@@ -16,7 +74,7 @@ def update_or_create_item_clean(name: str, price):
     from .models import Item
 
     name_clean = normalize_item_name(name)
-    existing = Item.objects.filter(name__iexact=name_clean).first()
+    existing = Item.objects.filter(lookup_key=make_item_lookup_key(name_clean)).first()
 
     if existing:
         if existing.price != price:
@@ -28,23 +86,67 @@ def update_or_create_item_clean(name: str, price):
     return Item.objects.create(name=name_clean, price=price), True, False
 
 
+# Итоги расчёта хранятся с точностью до копейки; округление — половина вверх,
+# как у numeric(10, 2) в PostgreSQL и у set-based пересчёта (recalculate_calculation_totals)
+TOTAL_QUANT = Decimal("0.01")
+
+
+def quantize_total(value):
+    return Decimal(value).quantize(TOTAL_QUANT, rounding=ROUND_HALF_UP)
+
+
+def calculate_lines_total(lines, markup):
+    """Сумма и сумма с наценкой по парам (количество, цена) — без обращения к БД."""
+    total = sum((quantity * price for quantity, price in lines), Decimal("0"))
+
+    markup_multiplier = (Decimal("100") + Decimal(markup)) / Decimal("100")
+    total_with_markup = total * markup_multiplier
+    return quantize_total(total), quantize_total(total_with_markup)
+
+
 def calculate_total_price(calculation):
     """Считает сумму расчёта и сумму с наценкой на основании текущих позиций."""
     items = calculation.items.all()
     if hasattr(items, "select_related"):
         items = items.select_related("item")
 
-    total = sum(
-        (item.quantity * item.item.price for item in items),
-        Decimal("0"),
-    )
+    return calculate_lines_total(((item.quantity, item.item.price) for item in items), calculation.markup)
 
-    markup_multiplier = (Decimal("100") + calculation.markup) / Decimal("100")
-    total_with_markup = total * markup_multiplier
-    return total, total_with_markup
+
+def get_item_stats(search=""):
+    """
+    Статистика по товарам, подходящим под поисковый запрос: количество, сумма,
+    средняя, минимальная и максимальная цена.
+
+    Считается одним агрегатным запросом и кэшируется по поисковому запросу;
+    любая запись в Item инвалидирует кэш (см. caching.bump_version).
+    """
+    from . import caching
+    from .models import Item
+    from .search import get_search_backend
+
+    key = caching.make_key(caching.ITEMS, 'stats', search)
+    stats = cache.get(key)
+    if stats is None:
+        queryset = Item.objects.all()
+        if search:
+            queryset = get_search_backend(queryset.db).filter(queryset, search)
+        stats = queryset.aggregate(
+            total_items=Count('id'),
+            total_price=Sum('price'),
+            avg_price=Avg('price'),
+            min_price=Min('price'),
+            max_price=Max('price'),
+        )
+        # Пустой результат: суммы нулевые, как и раньше
+        stats['total_price'] = stats['total_price'] or Decimal('0')
+        stats['avg_price'] = stats['avg_price'] or 0
+        cache.set(key, stats, getattr(settings, 'ITEMS_STATS_CACHE_TIMEOUT', 300))
+    return stats
 
 
-def paginate_queryset(queryset, request, page_size_options=None):
+def paginate_queryset(queryset, request, page_size_options=None, count=None, keyset=False,
+                      cache_name=None, cache_parts=()):
     """
     Helper функция для пагинации queryset.
     
@@ -52,6 +154,12 @@ def paginate_queryset(queryset, request, page_size_options=None):
         queryset: QuerySet для пагинации
         request: HTTP request с параметрами page и page_size
         page_size_options: Список доступных размеров страницы (по умолчанию [10, 25, 50, 100, 200])
+        count: Уже известное число записей (тогда Paginator не делает COUNT)
+        keyset: Листать по курсору (?cursor=) вместо номера страницы; page_obj тогда
+            KeysetPage, page_range пустой, общее число — по ?count=off|estimate|exact
+        cache_name: Кэшировать страницу (число записей и объекты) под этим именем
+            (trades.caching.RESPONSE_CACHES); cache_parts — версия данных и параметры
+            запроса, которые определяют содержимое страницы
     
     Returns:
         tuple: (page_obj, page_range, page_size, page_size_options)
@@ -67,9 +175,34 @@ def paginate_queryset(queryset, request, page_size_options=None):
     if page_size not in page_size_options:
         page_size = page_size_options[0]
     
+    if keyset:
+        from .keyset import InvalidCursor, get_count_mode, paginate_keyset
+
+        count_mode = get_count_mode(request, getattr(settings, "PAGINATION_COUNT_MODE", "exact"))
+        try:
+            page_obj = paginate_keyset(queryset, request.GET.get("cursor"), page_size, count_mode=count_mode)
+        except InvalidCursor:
+            # Устаревшая или испорченная ссылка — показываем первую страницу
+            page_obj = paginate_keyset(queryset, None, page_size, count_mode=count_mode)
+        return page_obj, [], page_size, page_size_options
+
     paginator = Paginator(queryset, page_size)
+    if count is not None:
+        paginator.count = count
     page_number = request.GET.get("page")
-    page_obj = paginator.get_page(page_number)
+    if cache_name is None:
+        page_obj = paginator.get_page(page_number)
+    else:
+        from . import caching
+
+        key = caching.make_key(caching.RESPONSES, cache_name, page_size, page_number, *cache_parts)
+        cached = caching.get_cached(key, cache_name)
+        if cached is None:
+            page_obj = paginator.get_page(page_number)
+            cached = (paginator.count, page_obj.number, list(page_obj.object_list))
+            cache.set(key, cached, caching.response_timeout())
+        paginator.count, number, object_list = cached
+        page_obj = Page(object_list, number, paginator)
     page_range = paginator.get_elided_page_range(page_obj.number, on_each_side=1, on_ends=1)
     
     return page_obj, page_range, page_size, page_size_options
@@ -2,26 +2,41 @@ from django.contrib.auth import get_user_model
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.views import LoginView
 from django.core.exceptions import PermissionDenied
-from django.db import IntegrityError
+from django.db import IntegrityError, transaction
 from django.http import HttpResponse, JsonResponse
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
 from .forms import UserCreateForm, UserEditForm, AdminSetPasswordForm
 from .models import Item, Calculation, CalculationItem, PriceHistory, CustomUser, CalculationSnapshot, \
-    CalculationSnapshotItem
-import pandas as pd
+    create_calculation_with_items, refresh_stale_totals, resolve_items
 import decimal
-import io
-import zipfile
 import json
 from django.urls import reverse
-from django.db.models import Count
+from django.db.models import Count, Max, Sum
 from django.db.models.functions import Collate
 from django.core.paginator import Paginator
 from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 from functools import wraps
 
-from .utils import update_or_create_item_clean, calculate_total_price, paginate_queryset
+from .exports import calculations_zip_response
+from .importers import (
+    FORMAT_XLSX,
+    TEMPLATE_FORMATS,
+    ImportFormatError,
+    build_import_template,
+    import_items_upload,
+)
+from .jobs import enqueue_import_job, use_background_import
+from .search import search_ordered
+from .utils import (
+    ITEM_NAME_TAKEN_MESSAGE,
+    calculate_total_price,
+    get_item_stats,
+    item_name_taken,
+    paginate_queryset,
+    update_or_create_item_clean,
+)
 
 
 # Фиксированные настройки (шаг цены и наценки)
@@ -41,6 +56,31 @@ def admin_required(view_func):
     return wrapper
 
 
+def save_item_changes(item, name, price, history_user=None):
+    """
+    Сохраняет новое название и цену товара; при смене цены и заданном history_user
+    пишет PriceHistory. Возвращает текст ошибки (название занято) или None.
+    """
+    if item_name_taken(name, item):
+        return ITEM_NAME_TAKEN_MESSAGE
+    try:
+        # История цены откатывается вместе с неудачным сохранением
+        with transaction.atomic():
+            if history_user is not None and item.price != price:
+                PriceHistory.objects.create(
+                    item=item,
+                    old_price=item.price,
+                    new_price=price,
+                    changed_by=history_user,
+                )
+            item.name = name
+            item.price = price
+            item.save()
+    except IntegrityError:
+        return ITEM_NAME_TAKEN_MESSAGE
+    return None
+
+
 def handle_add_item(request):
     """Обработка добавления товара с проверкой дубликатов и форматированием имени."""
     name = request.POST.get("name")
@@ -79,21 +119,12 @@ def handle_edit_item(request):
 
     try:
         item = Item.objects.get(id=item_id)
-        old_price = item.price  # Сохраняем старую цену
-
-        if old_price != price:
-            # Создаём запись в истории цен с указанием пользователя, изменившего цену.
-            PriceHistory.objects.create(
-                item=item,
-                old_price=old_price,
-                new_price=price,
-                changed_by=request.user  # Здесь передаем текущего пользователя
-            )
-
-        item.name = name
-        item.price = price
-        item.save()
-        messages.success(request, "Товар успешно обновлён!")
+        # При смене цены в историю пишется пользователь, изменивший цену
+        error = save_item_changes(item, name, price, history_user=request.user)
+        if error:
+            messages.error(request, error)
+        else:
+            messages.success(request, "Товар успешно обновлён!")
 
     except Item.DoesNotExist:
         messages.error(request, "Товар не найден!")
@@ -123,17 +154,9 @@ def edit_item_ajax(request):
             return JsonResponse({"success": False, "error": "Введите корректное значение цены!"})
         try:
             item = Item.objects.get(id=item_id)
-            old_price = item.price
-            if old_price != price:
-                PriceHistory.objects.create(
-                    item=item,
-                    old_price=old_price,
-                    new_price=price,
-                    changed_by=request.user
-                )
-            item.name = name
-            item.price = price
-            item.save()
+            error = save_item_changes(item, name, price, history_user=request.user)
+            if error:
+                return JsonResponse({"success": False, "error": error})
             return JsonResponse({"success": True, "item_id": item.id, "message": "Товар успешно обновлён"})
         except Item.DoesNotExist:
             return JsonResponse({"success": False, "error": "Товар не найден!"})
@@ -157,35 +180,19 @@ def delete_item_ajax(request):
 def handle_upload_file(request):
     """Обработка загрузки товаров из файла с проверкой дубликатов и форматированием имен."""
     file = request.FILES.get("file")
-    updated, created, skipped = 0, 0, 0
 
     try:
-        df = pd.read_excel(file)
-        if 'Наименование комплектующей' not in df.columns or 'Цена' not in df.columns:
-            messages.error(request, "Файл должен содержать столбцы 'Наименование комплектующей' и 'Цена'.")
-        else:
-            for _, row in df.iterrows():
-                name = row.get('Наименование комплектующей')
-                price = row.get('Цена')
-                if name and price:
-                    try:
-                        price = decimal.Decimal(str(price))
-                        item, created_flag, updated_flag = update_or_create_item_clean(name, price)
-                        if created_flag:
-                            created += 1
-                        elif updated_flag:
-                            updated += 1
-                        else:
-                            skipped += 1
-                    except decimal.InvalidOperation:
-                        continue
-
-            messages.success(
-                request,
-                f"Товары загружены! Обновлено — {updated}, добавлено — {created}, пропущено — {skipped}",
-            )
+        report = import_items_upload(file)
+    except ImportFormatError as e:
+        messages.error(request, str(e))
     except Exception as e:
         messages.error(request, f"Ошибка загрузки файла: {e}")
+    else:
+        messages.success(
+            request,
+            f"Товары загружены! Обновлено — {report['updated']}, добавлено — {report['created']}, "
+            f"пропущено — {report['skipped']}",
+        )
 
 
 # Главная страница: список товаров, редактирование, удаление и загрузка
@@ -206,20 +213,25 @@ def item_list(request):
 
     # Поиск и сортировка
     search = request.GET.get("search", "").strip()
-    sort_by = request.GET.get("sort", "name")
+    # При поиске без явной сортировки результаты идут по релевантности
+    sort_by = request.GET.get("sort", "relevance" if search else "name")
     direction = request.GET.get("direction", "asc")
-    order = sort_by if direction == "asc" else f"-{sort_by}"
 
-    # Применяем фильтр только если есть поисковый запрос
-    items_qs = Item.objects.filter(name__icontains=search).order_by(order) if search else Item.objects.all().order_by(order)
+    if search and sort_by == "relevance":
+        items_qs = search_ordered(Item.objects.all(), search, "name")
+    else:
+        if sort_by == "relevance":
+            sort_by = "name"
+        order = sort_by if direction == "asc" else f"-{sort_by}"
+        items_qs = search_ordered(Item.objects.all(), search).order_by(order)
 
-    # Пагинация
-    page_obj, page_range, page_size, page_size_options = paginate_queryset(items_qs, request)
+    # Статистика по текущему фильтру (без учёта пагинации); количество заодно отдаём пагинатору
+    stats = get_item_stats(search)
 
-    # Статистика по текущему фильтру (без учёта пагинации)
-    total_items = items_qs.count()
-    total_price = sum(item.price for item in items_qs)
-    avg_price = total_price / total_items if total_items else 0
+    # Пагинация
+    page_obj, page_range, page_size, page_size_options = paginate_queryset(
+        items_qs, request, count=stats["total_items"]
+    )
 
     context = {
         "items": page_obj.object_list,
@@ -231,9 +243,7 @@ def item_list(request):
         "search": search,
         "sort_by": sort_by,
         "direction": direction,
-        "total_items": total_items,
-        "total_price": total_price,
-        "avg_price": avg_price,
+        **stats,
     }
 
     if request.headers.get('x-requested-with') == 'XMLHttpRequest':
@@ -242,11 +252,6 @@ def item_list(request):
     return render(request, "trades/item_list.html", context)
 
 
-from pyuca import Collator
-
-collator = Collator()
-
-
 @login_required(login_url='/login/')
 def calculations_list(request):
     updated_calc_id = request.GET.get("updated_calc")
@@ -273,79 +278,9 @@ def calculations_list(request):
         elif "export_excel" in request.POST:
             calc_ids = request.POST.getlist("calc_ids")
             if calc_ids:
-                calculations_for_export = (
-                    Calculation.objects
-                    .filter(id__in=calc_ids)
-                    .select_related('user')
-                    .prefetch_related('items__item')
-                )
-                zip_buffer = io.BytesIO()
-                with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED) as zip_file:
-                    for calc in calculations_for_export:
-                        total = calc.total_price
-                        total_with_markup = calc.total_price_with_markup
-                        
-                        # Общая информация о расчёте
-                        df_calc = pd.DataFrame({
-                            "ID": [calc.id],
-                            "Создал": [calc.user.username if calc.user else "Не указан"],
-                            "Название": [calc.title],
-                            "Наценка (%)": [calc.markup],
-                            "Стоимость": [total],
-                            "Стоимость с наценкой": [total_with_markup],
-                            "Дата создания": [calc.created_at.strftime("%d.%m.%Y %H:%M")]
-                        })
-                        
-                        # Детальный список товаров
-                        items_data = []
-                        for idx, calc_item in enumerate(calc.items.all(), start=1):
-                            item_total = calc_item.item.price * calc_item.quantity
-                            item_total_with_markup = item_total * (1 + calc.markup / 100)
-                            items_data.append({
-                                "№": idx,
-                                "Наименование": calc_item.item.name,
-                                "Цена за ед.": float(calc_item.item.price),
-                                "Количество": calc_item.quantity,
-                                "Сумма": float(item_total),
-                                f"Сумма с наценкой ({calc.markup}%)": float(item_total_with_markup)
-                            })
-                        
-                        df_items = pd.DataFrame(items_data) if items_data else pd.DataFrame()
-                        
-                        # Сохраняем в Excel с двумя листами
-                        excel_buffer = io.BytesIO()
-                        with pd.ExcelWriter(excel_buffer, engine='xlsxwriter') as writer:
-                            df_calc.to_excel(writer, index=False, sheet_name="Информация")
-                            if not df_items.empty:
-                                df_items.to_excel(writer, index=False, sheet_name="Позиции")
-                                
-                                # Форматирование для красоты
-                                workbook = writer.book
-                                worksheet = writer.sheets["Позиции"]
-                                
-                                # Форматы
-                                money_format = workbook.add_format({'num_format': '#,##0.00 ₽'})
-                                header_format = workbook.add_format({
-                                    'bold': True,
-                                    'bg_color': '#4472C4',
-                                    'font_color': 'white',
-                                    'align': 'center'
-                                })
-                                
-                                # Применяем форматы к столбцам с ценами
-                                worksheet.set_column('C:C', 15, money_format)  # Цена за ед.
-                                worksheet.set_column('E:F', 18, money_format)  # Сумма и Сумма с наценкой
-                                worksheet.set_column('A:A', 5)   # №
-                                worksheet.set_column('B:B', 40)  # Наименование
-                                worksheet.set_column('D:D', 12)  # Количество
-                        
-                        zip_file.writestr(f"calculation_{calc.id}_{calc.title[:30]}.xlsx", excel_buffer.getvalue())
-                zip_buffer.seek(0)
-                return HttpResponse(
-                    zip_buffer.getvalue(),
-                    content_type="application/zip",
-                    headers={"Content-Disposition": 'attachment; filename="calculations.zip"'}
-                )
+                calculations_for_export = Calculation.objects.filter(id__in=calc_ids)
+                refresh_stale_totals(calculations_for_export)
+                return calculations_zip_response(calculations_for_export)
             else:
                 messages.error(request, "Выберите хотя бы один расчёт для экспорта!")
                 return redirect('calculations_list')
@@ -355,29 +290,37 @@ def calculations_list(request):
     # Получаем поисковый запрос
     search = request.GET.get("search", "").strip()
     
-    base_queryset = (
-        Calculation.objects
-        .select_related('user')
-        .prefetch_related('items__item')
-        .annotate(items_count=Count('items', distinct=True))
-    )
+    # Список показывает только заголовки: позиции не загружаем, число позиций хранится в расчёте
+    base_queryset = Calculation.objects.select_related('user')
     
-    # Применяем поиск если есть
+    # Устаревшие итоги (ленивый режим) пересчитываем до сортировки по суммам
+    refresh_stale_totals(search_ordered(Calculation.objects.all(), search))
+
+    # Применяем поиск если есть; без явной сортировки — по релевантности
     if search:
-        base_queryset = base_queryset.filter(title__icontains=search)
-
-    # 🔠 Локализованная сортировка по title через Python
-    if sort_by == "title":
-        calculations_list = sorted(
-            base_queryset,
-            key=lambda c: collator.sort_key(c.title),
-            reverse=reverse
-        )
+        base_queryset = search_ordered(base_queryset, search, '-created_at')
+
+    # Порядок страницы: по релевантности (поиск без явной сортировки) или по полю sort_by
+    ordering = "relevance" if search and "sort" not in request.GET else sort_by
+    if ordering == "relevance":
+        calculations_list = base_queryset
+    # 🔠 Локализованная сортировка по title — по ключу title_sort_key в БД
+    elif sort_by == "title":
+        order = ("-title_sort_key", "-id") if reverse else ("title_sort_key", "id")
+        calculations_list = base_queryset.order_by(*order)
     else:
         order = sort_by if not reverse else f"-{sort_by}"
-        calculations_list = list(base_queryset.order_by(order))
+        calculations_list = base_queryset.order_by(order, "-id" if reverse else "id")
 
-    page_obj, page_range, page_size, page_size_options = paginate_queryset(calculations_list, request)
+    # Версия видимых расчётов: число, последнее изменение и сумма ревизий — ключ кэша страницы
+    version = base_queryset.order_by().aggregate(
+        count=Count('pk'), updated=Max('updated_at'), revisions=Sum('revision')
+    )
+    page_obj, page_range, page_size, page_size_options = paginate_queryset(
+        calculations_list, request, count=version['count'],
+        cache_name='html.calculations_list',
+        cache_parts=(search, ordering, direction, version['count'], version['updated'], version['revisions']),
+    )
 
     context = {
         "page_obj": page_obj,
@@ -430,12 +373,7 @@ def export_calculations_excel_api(request):
         return JsonResponse({"error": "Не переданы идентификаторы расчётов для экспорта."}, status=400)
 
     # Фильтруем расчёты с учётом прав доступа
-    calculations_for_export = (
-        Calculation.objects
-        .filter(id__in=normalized_ids)
-        .select_related('user')
-        .prefetch_related('items__item')
-    )
+    calculations_for_export = Calculation.objects.filter(id__in=normalized_ids)
 
     user = request.user
     if not (getattr(user, "is_superuser", False) or getattr(user, "is_admin", False)):
@@ -443,75 +381,10 @@ def export_calculations_excel_api(request):
 
     if not calculations_for_export.exists():
         return JsonResponse({"error": "Расчёты для экспорта не найдены или недоступны."}, status=404)
+    refresh_stale_totals(calculations_for_export)
 
-    # Формируем ZIP-архив аналогично calculations_list
-    zip_buffer = io.BytesIO()
-    with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED) as zip_file:
-        for calc in calculations_for_export:
-            total = calc.total_price
-            total_with_markup = calc.total_price_with_markup
-
-            df_calc = pd.DataFrame({
-                "ID": [calc.id],
-                "Создал": [calc.user.username if calc.user else "Не указан"],
-                "Название": [calc.title],
-                "Наценка (%)": [calc.markup],
-                "Стоимость": [total],
-                "Стоимость с наценкой": [total_with_markup],
-                "Дата создания": [calc.created_at.strftime("%d.%m.%Y %H:%M")],
-            })
-
-            items_data = []
-            for idx, calc_item in enumerate(calc.items.all(), start=1):
-                item_total = calc_item.item.price * calc_item.quantity
-                item_total_with_markup = item_total * (1 + calc.markup / 100)
-                items_data.append({
-                    "№": idx,
-                    "Наименование": calc_item.item.name,
-                    "Цена за ед.": float(calc_item.item.price),
-                    "Количество": calc_item.quantity,
-                    "Сумма": float(item_total),
-                    f"Сумма с наценкой ({calc.markup}%)": float(item_total_with_markup),
-                })
-
-            df_items = pd.DataFrame(items_data) if items_data else pd.DataFrame()
-
-            excel_buffer = io.BytesIO()
-            with pd.ExcelWriter(excel_buffer, engine="xlsxwriter") as writer:
-                df_calc.to_excel(writer, index=False, sheet_name="Информация")
-                if not df_items.empty:
-                    df_items.to_excel(writer, index=False, sheet_name="Позиции")
-
-                    workbook = writer.book
-                    worksheet = writer.sheets["Позиции"]
-
-                    money_format = workbook.add_format({"num_format": "#,##0.00 ₽"})
-                    header_format = workbook.add_format({
-                        "bold": True,
-                        "bg_color": "#4472C4",
-                        "font_color": "white",
-                        "align": "center",
-                    })
-
-                    # Применяем форматы к столбцам
-                    worksheet.set_column("C:C", 15, money_format)  # Цена за ед.
-                    worksheet.set_column("E:F", 18, money_format)  # Сумма и Сумма с наценкой
-                    worksheet.set_column("A:A", 5)   # №
-                    worksheet.set_column("B:B", 40)  # Наименование
-                    worksheet.set_column("D:D", 12)  # Количество
-
-            zip_file.writestr(
-                f"calculation_{calc.id}_{calc.title[:30]}.xlsx",
-                excel_buffer.getvalue(),
-            )
-
-    zip_buffer.seek(0)
-    response = HttpResponse(
-        zip_buffer.getvalue(),
-        content_type="application/zip",
-    )
-    response["Content-Disposition"] = 'attachment; filename=\"calculations.zip\"'
-    return response
+    # ZIP-архив отдаётся потоково, аналогично calculations_list
+    return calculations_zip_response(calculations_for_export)
 
 
 @login_required(login_url='/login/')
@@ -532,52 +405,30 @@ def create_calculation(request):
             messages.error(request, "Выберите хотя бы один товар для расчёта!")
             return redirect('create_calculation')
 
-        calculation = Calculation.objects.create(title=title, markup=markup, user=request.user)
+        # Все товары — одним запросом; об отсутствующих сообщаем одним сообщением
+        items_by_id, missing_ids = resolve_items(item_ids)
+        if missing_ids:
+            messages.error(request, f"Товары не найдены (id): {', '.join(map(str, missing_ids))}")
 
-        calculation_items = []
-        for item_id in item_ids:
+        quantities = {}
+        for raw_id in item_ids:
+            item_id = int(raw_id) if str(raw_id).isdigit() else None
+            if item_id not in items_by_id or item_id in quantities:
+                continue
             try:
-                quantity = int(request.POST.get(f"quantity_{item_id}", 1))
+                quantities[item_id] = max(int(request.POST.get(f"quantity_{raw_id}", 1)), 1)
             except ValueError:
-                quantity = 1
-            try:
-                item = Item.objects.get(id=item_id)
-                calculation_items.append(
-                    CalculationItem(calculation=calculation, item=item, quantity=quantity)
-                )
-            except Item.DoesNotExist:
-                messages.error(request, f"Товар с id {item_id} не найден!")
-                continue
-
-        if calculation_items:
-            CalculationItem.objects.bulk_create(calculation_items)
-
-        total, total_with_markup = calculate_total_price(calculation)
-        calculation.total_price = total
-        calculation.total_price_with_markup = total_with_markup
-        calculation.save()
-
-        snapshot = CalculationSnapshot.objects.create(
-            calculation=calculation,
-            frozen_total_price=total,
-            frozen_total_price_with_markup=total_with_markup,
-            created_by=request.user
+                quantities[item_id] = 1
+
+        # Позиции, итоги и начальный снимок — bulk-запросами из уже загруженных товаров
+        calculation = create_calculation_with_items(
+            user=request.user,
+            title=title,
+            markup=markup,
+            lines=[(items_by_id[item_id], quantity) for item_id, quantity in quantities.items()],
+            snapshot_by=request.user,
         )
 
-        snapshot_items = []
-        for calc_item in calculation.items.all():
-            snapshot_items.append(
-                CalculationSnapshotItem(
-                    snapshot=snapshot,
-                    item_name=calc_item.item.name,
-                    item_price=calc_item.item.price,
-                    quantity=calc_item.quantity,
-                    total_price=calc_item.total_price()
-                )
-            )
-        if snapshot_items:
-            CalculationSnapshotItem.objects.bulk_create(snapshot_items)
-
         messages.success(request, "Расчёт успешно создан!")
         return redirect(reverse('calculations_list') + f'?new_calc={calculation.id}')
 
@@ -592,10 +443,10 @@ def create_calculation(request):
             initial_quantities[item_id] = request.GET.get(key)
 
     search_query = request.GET.get('search', '')
-    items_qs = Item.objects.filter(name__icontains=search_query) if search_query else Item.objects.all()
+    items_qs = search_ordered(Item.objects.all(), search_query, 'name')
 
-    # Сортировка
-    sort_by = request.GET.get('sort_by', 'name')
+    # Сортировка (при поиске по умолчанию — по релевантности)
+    sort_by = request.GET.get('sort_by', 'relevance' if search_query else 'name')
     direction = request.GET.get('direction', 'asc')
     
     if sort_by in ['name', 'price']:
@@ -662,7 +513,7 @@ def save_calculation_snapshot(request, pk):
 def calculation_snapshot_list(request):
     """Страница списка снимков расчётов."""
     snapshots_qs = CalculationSnapshot.objects.select_related('calculation', 'created_by').order_by('-created_at')
-    page_obj, page_range, page_size, page_size_options = paginate_queryset(snapshots_qs, request)
+    page_obj, page_range, page_size, page_size_options = paginate_queryset(snapshots_qs, request, keyset=True)
 
     return render(request, 'trades/calculation_snapshot_list.html', {
         'page_obj': page_obj,
@@ -689,6 +540,7 @@ def calculation_snapshot_detail(request, snapshot_id):
 @login_required(login_url='/login/')
 def calculation_detail(request, pk):
     calculation = get_object_or_404(Calculation, pk=pk)
+    refresh_stale_totals([calculation])
 
     if request.method == "POST":
         if "delete_item" in request.POST:
@@ -709,29 +561,6 @@ def calculation_detail(request, pk):
                 except (TypeError, ValueError):
                     continue
 
-            # Обновление количества и удаление снятых товаров
-            existing_items = {
-                calc_item.item_id: calc_item
-                for calc_item in calculation.items.select_related("item")
-            }
-
-            for item_id, calc_item in list(existing_items.items()):
-                if item_id not in selected_item_ids:
-                    calc_item.delete()
-                    continue
-
-                quantity_value = request.POST.get(f"quantity_{item_id}")
-                if quantity_value is None:
-                    continue
-                try:
-                    quantity_int = int(quantity_value)
-                    if quantity_int < 1:
-                        raise ValueError
-                    calc_item.quantity = quantity_int
-                    calc_item.save(update_fields=["quantity"])
-                except ValueError:
-                    messages.error(request, f"Ошибка количества у {calc_item.item.name}")
-
             # Обновление названия
             title = request.POST.get("title", "").strip()
             if title:
@@ -745,33 +574,50 @@ def calculation_detail(request, pk):
             except decimal.InvalidOperation:
                 messages.error(request, "Введите корректную наценку!")
 
-            # Добавление новых товаров
-            for item_id in selected_item_ids:
-                if item_id in existing_items:
-                    continue
-                quantity_value = request.POST.get(f"quantity_{item_id}", 1)
-                try:
-                    quantity_int = int(quantity_value)
-                    if quantity_int < 1:
-                        raise ValueError
-                except ValueError:
-                    messages.error(request, f"Ошибка количества у товара ID={item_id}")
-                    continue
+            # Позиции меняются пачкой: bulk-запросы и один пересчёт итогов при выходе
+            with calculation.batch_edit() as batch:
+                existing_items = dict(batch.lines)
+                new_item_ids = selected_item_ids - existing_items.keys()
+                items_by_id = Item.objects.in_bulk(new_item_ids) if new_item_ids else {}
 
-                try:
-                    item = Item.objects.get(id=item_id)
-                except Item.DoesNotExist:
-                    messages.error(request, f"Товар с ID={item_id} не найден!")
-                    continue
+                # Обновление количества и удаление снятых товаров
+                for item_id in existing_items:
+                    if item_id not in selected_item_ids:
+                        batch.remove(item_id)
+                        continue
 
-                CalculationItem.objects.create(
-                    calculation=calculation,
-                    item=item,
-                    quantity=quantity_int
-                )
+                    quantity_value = request.POST.get(f"quantity_{item_id}")
+                    if quantity_value is None:
+                        continue
+                    try:
+                        quantity_int = int(quantity_value)
+                        if quantity_int < 1:
+                            raise ValueError
+                        batch.set_quantity(item_id, quantity_int)
+                    except ValueError:
+                        messages.error(request, f"Ошибка количества у {existing_items[item_id].item.name}")
+
+                # Добавление новых товаров
+                for item_id in new_item_ids:
+                    quantity_value = request.POST.get(f"quantity_{item_id}", 1)
+                    try:
+                        quantity_int = int(quantity_value)
+                        if quantity_int < 1:
+                            raise ValueError
+                    except ValueError:
+                        messages.error(request, f"Ошибка количества у товара ID={item_id}")
+                        continue
 
-            # Обновление сумм
-            calculation.refresh_totals()
+                    if item_id not in items_by_id:
+                        messages.error(request, f"Товар с ID={item_id} не найден!")
+                        continue
+
+                    batch.set_quantity(item_id, quantity_int)
+
+            # Итоги пересчитываются при выходе из batch_edit, если позиции менялись;
+            # наценка могла измениться и без них
+            if not batch.dirty:
+                calculation.refresh_totals()
 
             messages.success(request, "Расчёт успешно сохранён!")
             return redirect(reverse("calculations_list") + f"?updated_calc={calculation.id}")
@@ -785,10 +631,10 @@ def calculation_detail(request, pk):
 
     # Поиск
     search_query = request.GET.get('search', '')
-    items_qs = Item.objects.filter(name__icontains=search_query) if search_query else Item.objects.all()
+    items_qs = search_ordered(Item.objects.all(), search_query, 'name')
     
-    # Сортировка
-    sort_by = request.GET.get('sort_by', 'name')
+    # Сортировка (при поиске по умолчанию — по релевантности)
+    sort_by = request.GET.get('sort_by', 'relevance' if search_query else 'name')
     direction = request.GET.get('direction', 'asc')
     
     if sort_by in ['name', 'price']:
@@ -822,7 +668,7 @@ def calculation_detail(request, pk):
 @login_required(login_url='/login/')
 def price_history_view(request):
     price_history_qs = PriceHistory.objects.select_related('item', 'changed_by').order_by('-changed_at')
-    page_obj, page_range, page_size, page_size_options = paginate_queryset(price_history_qs, request)
+    page_obj, page_range, page_size, page_size_options = paginate_queryset(price_history_qs, request, keyset=True)
 
     return render(request, "trades/price_history.html", {
         "page_obj": page_obj,
@@ -908,52 +754,33 @@ def delete_user(request, user_id):
 
 def download_import_template(request):
     """
-    Создает Excel-шаблон для импорта товаров и возвращает его как файл для скачивания.
-    Шаблон содержит заголовки: 'Наименование комплектующей' и 'Цена'.
+    Возвращает пустой шаблон для импорта товаров со столбцами
+    'Наименование комплектующей' и 'Цена'.
+    Формат задаётся параметром ?format=xlsx|csv|tsv|parquet (по умолчанию xlsx).
     """
-    # Формируем DataFrame с необходимыми столбцами (без строк данных)
-    data = {
-        "Наименование комплектующей": [],
-        "Цена": []
-    }
-    df = pd.DataFrame(data)
-
-    # Создаем буфер для записи Excel-файла
-    output = io.BytesIO()
-    with pd.ExcelWriter(output, engine="xlsxwriter") as writer:
-        df.to_excel(writer, index=False, sheet_name="Импорт")
-    output.seek(0)
-
-    # Формируем HTTP-ответ с нужным content-type и заголовком для скачивания
-    response = HttpResponse(
-        output.getvalue(),
-        content_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-    )
-    response["Content-Disposition"] = 'attachment; filename="import_template.xlsx"'
+    template_format = request.GET.get("format", FORMAT_XLSX).lower()
+    if template_format not in TEMPLATE_FORMATS:
+        return JsonResponse({"error": f"Неизвестный формат шаблона: {template_format}"}, status=400)
+
+    try:
+        content = build_import_template(template_format)
+    except ImportFormatError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+    extension, content_type = TEMPLATE_FORMATS[template_format]
+    response = HttpResponse(content, content_type=content_type)
+    response["Content-Disposition"] = f'attachment; filename="import_template.{extension}"'
     return response
 
 
 @login_required(login_url='/login/')
+@require_POST
 def copy_calculation(request, calculation_id):
+    """Копирует расчёт на сервере и открывает копию для редактирования."""
     original_calc = get_object_or_404(Calculation, id=calculation_id)
-
-    # Формируем параметры для передачи в GET-запрос
-    params = {
-        'title': f"{original_calc.title} (копия)",
-        'markup': original_calc.markup,
-    }
-
-    for ci in original_calc.items.all():
-        params[f'quantity_{ci.item.id}'] = ci.quantity
-        params.setdefault('items', []).append(str(ci.item.id))
-
-    # Создаём URL с параметрами
-    base_url = reverse('create_calculation')
-    query_string = '&'.join([f"{key}={value}" for key, value in params.items() if key != 'items'])
-    items_string = '&'.join([f"items={item_id}" for item_id in params['items']])
-    redirect_url = f"{base_url}?{query_string}&{items_string}"
-
-    return redirect(redirect_url)
+    new_calc = original_calc.copy(user=request.user)
+    messages.success(request, f"Создана копия расчёта «{original_calc.title}»")
+    return redirect('calculation_detail', pk=new_calc.pk)
 
 
 @login_required(login_url='/login/')
@@ -966,13 +793,14 @@ def edit_item_page(request, item_id):
 
         try:
             price = decimal.Decimal(price)
-            item.name = name
-            item.price = price
-            item.save()
-            messages.success(request, "Товар успешно обновлён!")
-            return redirect('item_list')
         except decimal.InvalidOperation:
             messages.error(request, "Некорректная цена!")
+        else:
+            error = save_item_changes(item, name, price)
+            if not error:
+                messages.success(request, "Товар успешно обновлён!")
+                return redirect('item_list')
+            messages.error(request, error)
 
     return render(request, "trades/edit_item.html", {"item": item})
 
@@ -985,7 +813,12 @@ class CustomLoginView(LoginView):
 
 @login_required(login_url='/login/')
 def upload_items_api(request):
-    """API endpoint для загрузки товаров из Excel файла"""
+    """
+    API endpoint для загрузки товаров из Excel файла.
+
+    Небольшие файлы импортируются сразу; большие (или с ?background=1) ставятся
+    в очередь — ответ 202 с job_id, прогресс доступен в /api/import-jobs/<id>/.
+    """
     if request.method != 'POST':
         return JsonResponse({'error': 'Method not allowed'}, status=405)
     
@@ -993,41 +826,24 @@ def upload_items_api(request):
         return JsonResponse({'error': 'No file provided'}, status=400)
     
     file = request.FILES['file']
-    updated, created, skipped = 0, 0, 0
-    errors = []
-    
-    try:
-        df = pd.read_excel(file)
-        if 'Наименование комплектующей' not in df.columns or 'Цена' not in df.columns:
-            return JsonResponse({
-                'error': "Файл должен содержать столбцы 'Наименование комплектующей' и 'Цена'."
-            }, status=400)
-        
-        for idx, row in df.iterrows():
-            name = row.get('Наименование комплектующей')
-            price = row.get('Цена')
-            if name and price:
-                try:
-                    price = decimal.Decimal(str(price))
-                    item, created_flag, updated_flag = update_or_create_item_clean(name, price)
-                    if created_flag:
-                        created += 1
-                    elif updated_flag:
-                        updated += 1
-                    else:
-                        skipped += 1
-                except decimal.InvalidOperation:
-                    errors.append(f"Строка {idx + 2}: некорректная цена")
-                    continue
-            else:
-                errors.append(f"Строка {idx + 2}: отсутствует название или цена")
-        
+
+    if use_background_import(request, file):
+        job = enqueue_import_job(file, request.user)
         return JsonResponse({
             'success': True,
-            'created': created,
-            'updated': updated,
-            'skipped': skipped,
-            'errors': errors
-        })
+            'job_id': job.id,
+            'status': job.status,
+            'status_url': reverse('importjob-detail', args=[job.id]),
+        }, status=202)
+
+    # ?mode=stream / ?mode=frame позволяют выбрать режим чтения явно
+    streaming = {'stream': True, 'frame': False}.get(request.GET.get('mode'))
+
+    try:
+        report = import_items_upload(file, streaming=streaming)
+    except ImportFormatError as e:
+        return JsonResponse({'error': str(e)}, status=400)
     except Exception as e:
         return JsonResponse({'error': f"Ошибка загрузки файла: {str(e)}"}, status=400)
+
+    return JsonResponse({'success': True, **report})